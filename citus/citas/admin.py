@@ -1,7 +1,10 @@
 from django.contrib import admin
 from django.contrib.auth.models import User
 from django.utils.html import format_html
-from .models import Cita, ServicioCorte, PerfilUsuario
+from . import lotes, series
+from .models import (
+    Ausencia, Cita, EsperaCita, EventoNotificacion, HorarioSemanal, SerieCita, ServicioCorte, PerfilUsuario,
+)
 
 
 # ==========================
@@ -46,6 +49,31 @@ class CitaAdmin(admin.ModelAdmin):
     list_filter = ('estado', 'fecha', 'servicio')
     search_fields = ('usuario__username', 'nombre_cliente', 'correo_cliente', 'peluquero__username')
     ordering = ('-fecha', '-hora')
+    actions = ('confirmar_seleccionadas', 'completar_seleccionadas', 'cancelar_seleccionadas')
+
+    # ---- ACCIONES EN LOTE (un UPDATE para todas las seleccionadas) ----
+    def _aplicar_lote(self, request, queryset, accion, **kwargs):
+        resumen = lotes.aplicar(accion, list(queryset.values_list('pk', flat=True)), **kwargs)
+        mensaje = f"{len(resumen['aplicadas'])} citas actualizadas"
+        if resumen['omitidas']:
+            mensaje += f"; {len(resumen['omitidas'])} omitidas por su estado"
+        self.message_user(request, mensaje)
+
+    @admin.action(description="Confirmar citas seleccionadas")
+    def confirmar_seleccionadas(self, request, queryset):
+        self._aplicar_lote(request, queryset, 'confirmar')
+
+    @admin.action(description="Marcar como completadas")
+    def completar_seleccionadas(self, request, queryset):
+        self._aplicar_lote(request, queryset, 'completar')
+
+    @admin.action(description="Cancelar citas seleccionadas (avisa al cliente y al peluquero)")
+    def cancelar_seleccionadas(self, request, queryset):
+        self._aplicar_lote(request, queryset, 'cancelar', motivo="Cancelada por la administración")
+
+    def delete_queryset(self, request, queryset):
+        # "Eliminar seleccionadas": un DELETE y los resúmenes recalculados una vez
+        lotes.aplicar('eliminar', list(queryset.values_list('pk', flat=True)))
 
     # ---- FILTRA SOLO PELUQUEROS EN EL ADMIN ----
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
@@ -82,3 +110,104 @@ class CitaAdmin(admin.ModelAdmin):
             color, obj.get_estado_display()
         )
     estado_coloreado.short_description = "Estado"
+
+
+# ==========================
+# HORARIOS Y AUSENCIAS
+# ==========================
+
+def _solo_peluqueros(db_field, kwargs):
+    if db_field.name == "peluquero":
+        kwargs["queryset"] = User.objects.filter(perfilusuario__es_peluquero=True).order_by('username')
+    return kwargs
+
+
+@admin.register(HorarioSemanal)
+class HorarioSemanalAdmin(admin.ModelAdmin):
+    list_display = ('peluquero', 'dia_semana', 'hora_inicio', 'hora_fin', 'tipo')
+    list_filter = ('tipo', 'dia_semana', 'peluquero')
+    ordering = ('peluquero', 'dia_semana', 'hora_inicio')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        return super().formfield_for_foreignkey(db_field, request, **_solo_peluqueros(db_field, kwargs))
+
+
+@admin.register(Ausencia)
+class AusenciaAdmin(admin.ModelAdmin):
+    list_display = ('desde', 'hasta', 'peluquero_display', 'hora_inicio', 'hora_fin', 'motivo')
+    list_filter = ('peluquero',)
+    search_fields = ('motivo', 'peluquero__username')
+    ordering = ('-desde',)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        return super().formfield_for_foreignkey(db_field, request, **_solo_peluqueros(db_field, kwargs))
+
+    def peluquero_display(self, obj):
+        return obj.peluquero.username if obj.peluquero else "Todo el local (feriado)"
+    peluquero_display.short_description = "Peluquero"
+
+
+# ==========================
+# CITAS RECURRENTES
+# ==========================
+
+@admin.register(SerieCita)
+class SerieCitaAdmin(admin.ModelAdmin):
+    list_display = ('usuario', 'servicio', 'hora', 'intervalo_semanas', 'fecha_inicio', 'hasta', 'peluquero', 'estado')
+    list_filter = ('estado', 'intervalo_semanas', 'servicio')
+    search_fields = ('usuario__username', 'peluquero__username')
+    ordering = ('-creado_en',)
+    raw_id_fields = ('usuario',)
+    actions = ('cancelar_series',)
+
+    def get_readonly_fields(self, request, obj=None):
+        # La regla no se cambia después de creada: las citas ya existen
+        if obj:
+            return ('usuario', 'peluquero', 'servicio', 'hora', 'fecha_inicio', 'intervalo_semanas', 'hasta', 'estado')
+        return ('estado',)
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            return super().save_model(request, obj, form, change)
+        # Crear la serie reserva todas sus ocurrencias libres en lote
+        resultado = series.crear_serie(obj, omitir_conflictos=True)
+        if resultado['omitidas']:
+            fechas = ', '.join(f"{f:%d/%m/%Y}" for f in resultado['omitidas'])
+            self.message_user(request, f"Fechas ocupadas sin reservar: {fechas}", level='warning')
+
+    @admin.action(description="Cancelar series seleccionadas y sus citas pendientes")
+    def cancelar_series(self, request, queryset):
+        canceladas = 0
+        for serie in queryset.filter(estado='activa'):
+            canceladas += len(series.cancelar_serie(serie, motivo="Cancelada por la administración")['aplicadas'])
+        self.message_user(request, f"{canceladas} citas pendientes canceladas")
+
+
+# ==========================
+# BANDEJA DE NOTIFICACIONES
+# ==========================
+
+@admin.register(EventoNotificacion)
+class EventoNotificacionAdmin(admin.ModelAdmin):
+    list_display = ('creado_en', 'tipo', 'destinatario', 'estado', 'intentos', 'disponible_en', 'enviado_en')
+    list_filter = ('estado', 'tipo')
+    search_fields = ('destinatario',)
+    ordering = ('-creado_en',)
+    raw_id_fields = ('cita',)
+    readonly_fields = ('creado_en', 'enviado_en', 'ultimo_error')
+
+
+# ==========================
+# LISTA DE ESPERA
+# ==========================
+
+@admin.register(EsperaCita)
+class EsperaCitaAdmin(admin.ModelAdmin):
+    list_display = ('usuario', 'servicio', 'fecha', 'desde', 'hasta', 'peluquero', 'estado', 'vence_en')
+    list_filter = ('estado', 'fecha', 'servicio')
+    search_fields = ('usuario__username', 'peluquero__username')
+    ordering = ('fecha', 'creado_en')
+    raw_id_fields = ('usuario', 'cita')
+    # Las ofertas las crea y vence el worker (citas.lista_espera)
+    readonly_fields = ('estado', 'cita', 'vence_en', 'creado_en')
+
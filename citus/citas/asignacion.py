@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Sum
+
+from . import metricas
+from .disponibilidad import AgendaDia
+from .models import Cita
+
+
+# -----------------------
+#   ESTRATEGIAS
+# -----------------------
+
+ESTRATEGIAS = {}
+ESTRATEGIA_POR_DEFECTO = 'menor_carga'
+
+
+def registrar_estrategia(nombre):
+    """Registra una función `(candidatos, cita, preferido) -> peluquero_id`"""
+    def decorador(funcion):
+        ESTRATEGIAS[nombre] = funcion
+        return funcion
+    return decorador
+
+
+def cargas_del_dia(candidatos, fecha, por_minutos=False):
+    """Carga de cada candidato en la fecha, en una sola consulta agregada.
+
+    Se agrupa desde Cita (y no desde User) para que el filtro por fecha use
+    el índice parcial de citas activas en vez de recorrer todo el historial.
+    """
+    carga = Sum('servicio__duracion_minutos') if por_minutos else Count('id')
+    filas = (
+        Cita.objects.filter(peluquero_id__in=candidatos, fecha=fecha, estado__in=Cita.ESTADOS_ACTIVOS)
+        .order_by()
+        .values('peluquero_id')
+        .annotate(carga=carga)
+        .values_list('peluquero_id', 'carga')
+    )
+    return dict(filas)
+
+
+@registrar_estrategia('menor_carga')
+def menor_carga(candidatos, cita, preferido=None):
+    cargas = cargas_del_dia(candidatos, cita.fecha)
+    return min(candidatos, key=lambda p: (cargas.get(p, 0), p))
+
+
+@registrar_estrategia('menor_minutos')
+def menor_minutos(candidatos, cita, preferido=None):
+    cargas = cargas_del_dia(candidatos, cita.fecha, por_minutos=True)
+    return min(candidatos, key=lambda p: (cargas.get(p, 0), p))
+
+
+@registrar_estrategia('rotativo')
+def rotativo(candidatos, cita, preferido=None):
+    """Turno circular a partir del peluquero de la última cita registrada"""
+    ultimo = Cita.objects.filter(peluquero__isnull=False).order_by('-id').values_list('peluquero_id', flat=True).first()
+    ordenados = sorted(candidatos)
+    for p in ordenados:
+        if ultimo is None or p > ultimo:
+            return p
+    return ordenados[0]
+
+
+@registrar_estrategia('preferido')
+def peluquero_preferido(candidatos, cita, preferido=None):
+    if preferido is not None and preferido in candidatos:
+        return preferido
+    return menor_carga(candidatos, cita)
+
+
+def obtener_estrategia(nombre=None):
+    nombre = nombre or getattr(settings, 'CITAS_ESTRATEGIA_ASIGNACION', ESTRATEGIA_POR_DEFECTO)
+    try:
+        return ESTRATEGIAS[nombre]
+    except KeyError:
+        raise ValueError(f"Estrategia de asignación desconocida: {nombre}")
+
+
+# -----------------------
+#   ASIGNACIÓN
+# -----------------------
+
+def asignar_peluquero(cita, agenda=None, estrategia=None, preferido=None, excluir=()):
+    """Asigna a la cita un peluquero libre durante todo el servicio.
+
+    Devuelve el id asignado, o None si aún no hay peluqueros registrados.
+    Lanza ValidationError si todos están ocupados a esa hora.
+    """
+    agenda = agenda or AgendaDia.cargar(cita.fecha, excluir=cita.pk)
+    if agenda.peluqueros == [None]:
+        metricas.incrementar('asignaciones', resultado='sin_peluqueros')
+        return None
+
+    candidatos = [
+        p for p in agenda.peluqueros_libres(cita.hora, cita.servicio.duracion_minutos)
+        if p not in excluir
+    ]
+    if not candidatos:
+        metricas.incrementar('asignaciones', resultado='sin_disponibles')
+        raise ValidationError("No hay peluqueros disponibles para ese horario.")
+
+    if len(candidatos) == 1:
+        metricas.incrementar('asignaciones', resultado='unico_libre')
+        cita.peluquero_id = candidatos[0]
+        return cita.peluquero_id
+
+    preferido_id = getattr(preferido, 'pk', preferido)
+    if preferido_id is not None and estrategia is None:
+        estrategia = 'preferido'
+    estrategia = estrategia or getattr(settings, 'CITAS_ESTRATEGIA_ASIGNACION', ESTRATEGIA_POR_DEFECTO)
+    cita.peluquero_id = obtener_estrategia(estrategia)(candidatos, cita, preferido_id)
+    metricas.incrementar('asignaciones', resultado='estrategia', estrategia=estrategia)
+    return cita.peluquero_id
@@ -0,0 +1,38 @@
+"""Apoyo para las vistas asíncronas (ASGI).
+
+Bajo ASGI una consulta síncrona dentro de una vista `async def` falla con
+SynchronousOnlyOperation. Estas funciones cargan de una vez, con el ORM
+asíncrono, lo que después leen sin saberlo el código síncrono de Django
+(request.user en plantillas y context processors, `condition`, la caché
+del catálogo).
+"""
+import asyncio
+from functools import wraps
+
+from django.contrib.auth.models import User
+
+from .catalogo import aobtener_catalogo
+
+
+async def resolver_usuario(request):
+    """Reemplaza request.user (perezoso) por el usuario ya cargado, con su perfil"""
+    usuario = await request.auser()
+    if usuario.is_authenticated:
+        # La plantilla base consulta user.perfilusuario: se trae en la misma consulta
+        usuario = await User.objects.select_related('perfilusuario').aget(pk=usuario.pk)
+
+    async def auser():
+        return usuario
+
+    request.user = usuario
+    request.auser = auser
+    return usuario
+
+
+def preparar_peticion(vista):
+    """Resuelve en paralelo el usuario y el catálogo antes de la vista asíncrona"""
+    @wraps(vista)
+    async def envoltura(request, *args, **kwargs):
+        await asyncio.gather(resolver_usuario(request), aobtener_catalogo())
+        return await vista(request, *args, **kwargs)
+    return envoltura
@@ -0,0 +1,29 @@
+from django.conf import settings
+
+
+DIARIOS = {'WAL', 'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'OFF'}
+SINCRONICOS = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+
+def configurar_sqlite(sender, connection, **kwargs):
+    """Aplica los PRAGMAs de CITAS_SQLITE_* a cada conexión SQLite nueva (señal connection_created).
+
+    - journal_mode=WAL: los lectores no esperan al escritor y el escritor no
+      espera a los lectores; queda guardado en el archivo de la base.
+    - synchronous=NORMAL: en WAL es seguro ante caídas del proceso y evita un
+      fsync por transacción.
+    - busy_timeout: espera el bloqueo de escritura en vez de fallar con
+      "database is locked" (mismo valor que OPTIONS['timeout']).
+    """
+    if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+        return
+    diario = getattr(settings, 'CITAS_SQLITE_DIARIO', 'WAL').upper()
+    sincronico = getattr(settings, 'CITAS_SQLITE_SINCRONICO', 'NORMAL').upper()
+    if diario not in DIARIOS or sincronico not in SINCRONICOS:
+        raise ValueError(f"Configuración SQLite no válida: journal_mode={diario}, synchronous={sincronico}")
+    espera_ms = int(connection.settings_dict['OPTIONS'].get('timeout', 5) * 1000)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA journal_mode={diario}")
+        cursor.execute(f"PRAGMA synchronous={sincronico}")
+        cursor.execute(f"PRAGMA busy_timeout={espera_ms}")
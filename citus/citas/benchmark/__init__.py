@@ -0,0 +1 @@
+"""Generador de carga y mediciones del flujo de reservas (ver `manage.py benchmark`)."""
@@ -0,0 +1,103 @@
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from citas import estadisticas, ocupacion
+from citas.catalogo import invalidar_catalogo
+from citas.management.commands.cargar_servicios import SERVICIOS
+from citas.models import Cita, PerfilUsuario, ServicioCorte
+
+
+CLAVE = "benchmark123"
+LOTE = 5000
+
+
+class Datos:
+    """Usuarios y fechas del conjunto sembrado que usan los escenarios"""
+
+    def __init__(self, peluqueros, clientes, admin, servicios, desde, hasta):
+        self.peluqueros = peluqueros
+        self.clientes = clientes
+        self.admin = admin
+        self.servicios = servicios
+        self.desde = desde
+        self.hasta = hasta
+
+
+def _crear_usuarios(prefijo, cantidad, clave, es_peluquero=False):
+    usuarios = User.objects.bulk_create([
+        User(username=f"{prefijo}{i}", email=f"{prefijo}{i}@citus.test", password=clave)
+        for i in range(cantidad)
+    ])
+    # bulk_create no emite post_save: los perfiles se crean aquí
+    PerfilUsuario.objects.bulk_create([PerfilUsuario(usuario=u, es_peluquero=es_peluquero) for u in usuarios])
+    return usuarios
+
+
+def sembrar(peluqueros=5, servicios=10, anios=1, clientes=200, citas_por_dia=6, dias_futuros=30, semilla=1):
+    """Crea N peluqueros, M servicios del catálogo base y K años de historial de citas.
+
+    Cada peluquero recibe `citas_por_dia` citas por día hábil, en horas que no
+    se solapan; las pasadas quedan mayormente completadas y las futuras
+    pendientes o confirmadas. Todo se inserta en bloque y los resúmenes
+    (ocupación y estadísticas) se reconstruyen al final.
+    """
+    azar = random.Random(semilla)
+    clave = make_password(CLAVE)
+
+    with transaction.atomic():
+        lista_peluqueros = _crear_usuarios("peluquero", peluqueros, clave, es_peluquero=True)
+        lista_clientes = _crear_usuarios("cliente", clientes, clave)
+        admin = User.objects.create_superuser("admin_benchmark", "admin@citus.test", CLAVE)
+        lista_servicios = ServicioCorte.objects.bulk_create([
+            ServicioCorte(nombre=s["nombre"], descripcion="", precio=s["precio"], duracion_minutos=s["duracion_minutos"])
+            for s in SERVICIOS[:servicios]
+        ])
+    invalidar_catalogo()
+
+    hoy = timezone.localdate()
+    desde = hoy - datetime.timedelta(days=int(365 * anios))
+    hasta = hoy + datetime.timedelta(days=dias_futuros)
+    fechas = set()
+
+    def citas():
+        fecha = desde
+        while fecha <= hasta:
+            if fecha.weekday() < 6:
+                fechas.add(fecha)
+                for peluquero in lista_peluqueros:
+                    # Bloques de una hora: ningún servicio base dura más que eso
+                    for bloque in sorted(azar.sample(range(10), min(citas_por_dia, 10))):
+                        if fecha < hoy:
+                            estado = 'cancelada' if azar.random() < 0.1 else 'completada'
+                        else:
+                            estado = azar.choice(Cita.ESTADOS_ACTIVOS)
+                        cliente, servicio = azar.choice(lista_clientes), azar.choice(lista_servicios)
+                        yield Cita(
+                            usuario=cliente, peluquero=peluquero, servicio=servicio, precio=servicio.precio,
+                            fecha=fecha, hora=datetime.time(9 + bloque), estado=estado,
+                            nombre_cliente=cliente.username, correo_cliente=cliente.email,
+                            recordatorio_enviado_en=timezone.now() if fecha < hoy else None,
+                        )
+            fecha += datetime.timedelta(days=1)
+
+    lote = []
+    for cita in citas():
+        lote.append(cita)
+        if len(lote) >= LOTE:
+            Cita.objects.bulk_create(lote)
+            lote = []
+    Cita.objects.bulk_create(lote)
+
+    # bulk_create no emite señales: se reconstruyen los resúmenes
+    fechas = sorted(fechas)
+    for i in range(0, len(fechas), 31):
+        parte = fechas[i:i + 31]
+        ocupacion.recalcular({(p.pk, f) for p in lista_peluqueros for f in parte})
+        estadisticas.recalcular_fechas(parte)
+
+    return Datos(lista_peluqueros, lista_clientes, admin, lista_servicios, desde, hasta)
@@ -0,0 +1,65 @@
+import datetime
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from citas.disponibilidad import a_hora, inicios_del_dia
+
+from .medicion import percentil
+
+
+def medir_reservas(datos, reservas=400, hilos=8):
+    """Reservas por segundo del flujo real de /agendar/ con `hilos` clientes simultáneos.
+
+    Cada hilo usa su propia conexión a la base, como lo haría un worker de
+    Gunicorn. Las reservas caen en días posteriores al historial sembrado y
+    nunca compiten por el mismo hueco, así lo que se mide es la contención
+    de la base y no el rechazo de horas ocupadas.
+    """
+    # Un hueco por peluquero: la asignación reparte entre todos
+    pendientes = (
+        (datos.hasta + datetime.timedelta(days=dia), a_hora(minutos))
+        for dia in itertools.count(1)
+        for minutos in inicios_del_dia()
+        for _ in datos.peluqueros
+    )
+    candado = threading.Lock()
+    servicio = datos.servicios[0].pk
+
+    def reservar(_):
+        with candado:
+            fecha, hora = next(pendientes)
+        inicio = time.perf_counter()
+        try:
+            respuesta = Client().post(reverse('agendar_cita_publica'), {
+                'nombre_cliente': 'Carga', 'servicio': servicio,
+                'fecha': fecha.isoformat(), 'hora': hora.strftime('%H:%M'),
+            })
+            ok = respuesta.status_code == 302
+        except Exception:
+            ok = False
+        finally:
+            connection.close()
+        return ok, (time.perf_counter() - inicio) * 1000
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        resultados = list(pool.map(reservar, range(reservas)))
+    segundos = time.perf_counter() - inicio
+
+    tiempos = [ms for _, ms in resultados]
+    exitosas = sum(1 for ok, _ in resultados if ok)
+    return {
+        'reservas': reservas,
+        'hilos': hilos,
+        'exitosas': exitosas,
+        'errores': reservas - exitosas,
+        'reservas_por_segundo': round(exitosas / segundos, 1),
+        'p50_ms': round(percentil(tiempos, 50), 2),
+        'p95_ms': round(percentil(tiempos, 95), 2),
+    }
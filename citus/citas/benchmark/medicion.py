@@ -0,0 +1,129 @@
+import datetime
+import itertools
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from citas.disponibilidad import a_hora, inicios_del_dia
+
+
+# Peticiones medidas con tracemalloc (que vuelve lentas las peticiones: no se mezcla con los tiempos)
+PETICIONES_MEMORIA = 3
+
+
+def percentil(valores, p):
+    """Percentil `p` (0-100) por interpolación lineal"""
+    orden = sorted(valores)
+    if not orden:
+        return 0.0
+    posicion = (len(orden) - 1) * p / 100
+    bajo = int(posicion)
+    alto = min(bajo + 1, len(orden) - 1)
+    return orden[bajo] + (orden[alto] - orden[bajo]) * (posicion - bajo)
+
+
+def _cliente(usuario=None):
+    cliente = Client()
+    if usuario is not None:
+        cliente.force_login(usuario)
+    return cliente
+
+
+def escenarios(datos):
+    """{nombre: función que hace una petición}; cada llamada es una petición real a la URL"""
+    servicio = datos.servicios[0]
+    dia_consulta = (datos.hasta - datetime.timedelta(days=7)).isoformat()
+    anonimo = _cliente()
+    peluquero = _cliente(datos.peluqueros[0])
+    cliente = _cliente(datos.clientes[0])
+    admin = _cliente(datos.admin)
+
+    # Cada reserva usa un hueco libre distinto, en días posteriores al historial
+    huecos = (
+        (datos.hasta + datetime.timedelta(days=dia), a_hora(minutos))
+        for dia in itertools.count(1)
+        for minutos in inicios_del_dia()
+        for _ in datos.peluqueros
+    )
+
+    def reservar():
+        fecha, hora = next(huecos)
+        return anonimo.post(reverse('agendar_cita_publica'), {
+            'nombre_cliente': 'Carga', 'correo_cliente': 'carga@citus.test', 'servicio': servicio.pk,
+            'fecha': fecha.isoformat(), 'hora': hora.strftime('%H:%M'),
+        })
+
+    return {
+        'horas': lambda: anonimo.get(reverse('obtener_horas_disponibles'),
+                                     {'fecha': dia_consulta, 'servicio': servicio.pk}),
+        'agendar_get': lambda: anonimo.get(reverse('agendar_cita_publica')),
+        'agendar_post': reservar,
+        'peluquero': lambda: peluquero.get(reverse('panel_peluquero')),
+        'panel': lambda: cliente.get(reverse('panel_usuario')),
+        'reportes': lambda: admin.get(reverse('reportes_basicos')),
+    }
+
+
+def medir_escenario(peticion, repeticiones):
+    tiempos, consultas, estados = [], [], set()
+    for _ in range(repeticiones):
+        with CaptureQueriesContext(connection) as capturadas:
+            inicio = time.perf_counter()
+            respuesta = peticion()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        consultas.append(len(capturadas))
+        estados.add(respuesta.status_code)
+
+    pico = 0
+    tracemalloc.start()
+    try:
+        for _ in range(PETICIONES_MEMORIA):
+            tracemalloc.reset_peak()
+            peticion()
+            pico = max(pico, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'peticiones': repeticiones,
+        'estados': sorted(estados),
+        'p50_ms': round(percentil(tiempos, 50), 2),
+        'p95_ms': round(percentil(tiempos, 95), 2),
+        'p99_ms': round(percentil(tiempos, 99), 2),
+        'consultas': max(consultas),
+        'memoria_kb': round(pico / 1024, 1),
+    }
+
+
+def medir(datos, repeticiones=50, solo=None):
+    """Resultados por escenario, en el orden de `escenarios`"""
+    resultados = {}
+    for nombre, peticion in escenarios(datos).items():
+        if solo and nombre not in solo:
+            continue
+        peticion()  # calentamiento: cachés de plantillas, catálogo y conexiones
+        resultados[nombre] = medir_escenario(peticion, repeticiones)
+    return resultados
+
+
+# Diferencias de p95 menores que esto son ruido de medición, no regresiones
+MARGEN_MS = 1.0
+
+
+def comparar(base, actual, tolerancia=20):
+    """Regresiones respecto de la línea base: p95 más de `tolerancia` % peor o más consultas"""
+    regresiones = []
+    for nombre, medida in actual.items():
+        anterior = base.get(nombre)
+        if anterior is None:
+            continue
+        limite = max(anterior['p95_ms'] * (1 + tolerancia / 100), anterior['p95_ms'] + MARGEN_MS)
+        if medida['p95_ms'] > limite:
+            regresiones.append(f"{nombre}: p95 {anterior['p95_ms']} ms → {medida['p95_ms']} ms")
+        if medida['consultas'] > anterior['consultas']:
+            regresiones.append(f"{nombre}: consultas {anterior['consultas']} → {medida['consultas']}")
+    return regresiones
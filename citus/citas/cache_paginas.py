@@ -0,0 +1,142 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from . import metricas
+from .catalogo import aobtener_catalogo, obtener_catalogo
+
+
+# Marcas que dejan las plantillas en la versión cacheada de la página
+HUECO_CSRF = '<!--citus:hueco:csrf-->'
+HUECO_MENSAJES = '<!--citus:hueco:mensajes-->'
+
+CLAVE_VERSION = 'citas:paginas:version'
+
+
+def _cache():
+    return caches[getattr(settings, 'CITAS_CACHE_PAGINAS', 'default')]
+
+
+def en_cache(request):
+    """True mientras se renderiza una página que se va a guardar en caché"""
+    return getattr(request, '_cache_pagina', False)
+
+
+def version_paginas():
+    return _cache().get_or_set(CLAVE_VERSION, 1, None)
+
+
+async def aversion_paginas():
+    return await _cache().aget_or_set(CLAVE_VERSION, 1, None)
+
+
+def invalidar_paginas():
+    """Descarta todas las páginas y fragmentos cacheados (cambió algo que muestran)"""
+    try:
+        _cache().incr(CLAVE_VERSION)
+    except ValueError:
+        _cache().set(CLAVE_VERSION, 1, None)
+
+
+def csrf_input(request):
+    return format_html('<input type="hidden" name="csrfmiddlewaretoken" value="{}">', get_token(request))
+
+
+def mensajes_html(request):
+    return mark_safe(render_to_string('_mensajes.html', {'messages': get_messages(request)}))
+
+
+def _rellenar_huecos(request, contenido):
+    if HUECO_CSRF in contenido:
+        contenido = contenido.replace(HUECO_CSRF, csrf_input(request))
+    if HUECO_MENSAJES in contenido:
+        contenido = contenido.replace(HUECO_MENSAJES, mensajes_html(request))
+    return contenido
+
+
+def _clave_pagina(request, version, catalogo):
+    ruta = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"citas:pagina:{version}:{catalogo.version}:{ruta}"
+
+
+def _respuesta_guardada(request, guardada):
+    metricas.incrementar('cache_pagina_aciertos')
+    contenido, tipo = guardada
+    return HttpResponse(_rellenar_huecos(request, contenido), content_type=tipo)
+
+
+def _para_guardar(request, respuesta):
+    """(contenido, tipo) a guardar en caché, o None; deja los huecos completos en la respuesta"""
+    if respuesta.streaming:
+        return None
+    contenido = respuesta.content.decode(respuesta.charset)
+    guardar = respuesta.status_code == 200 and not respuesta.cookies
+    respuesta.content = _rellenar_huecos(request, contenido)
+    return (contenido, respuesta['Content-Type']) if guardar else None
+
+
+def _segundos():
+    return getattr(settings, 'CITAS_CACHE_PAGINAS_SEGUNDOS', 300)
+
+
+def cachear_pagina_anonima(vista):
+    """Cachea el HTML de los GET anónimos por URL y versión del catálogo.
+
+    El token CSRF y los mensajes se dejan como huecos en la copia cacheada
+    y se completan en cada respuesta, así la página sigue siendo correcta
+    para cada visitante. Sirve para vistas síncronas y asíncronas.
+    """
+    if iscoroutinefunction(vista):
+        @wraps(vista)
+        async def envoltura_asincrona(request, *args, **kwargs):
+            usuario = await request.auser()
+            if request.method not in ('GET', 'HEAD') or usuario.is_authenticated:
+                return await vista(request, *args, **kwargs)
+
+            clave = _clave_pagina(request, await aversion_paginas(), await aobtener_catalogo())
+            guardada = await _cache().aget(clave)
+            if guardada is not None:
+                return _respuesta_guardada(request, guardada)
+
+            metricas.incrementar('cache_pagina_fallos')
+            request._cache_pagina = True
+            try:
+                respuesta = await vista(request, *args, **kwargs)
+            finally:
+                request._cache_pagina = False
+            guardar = _para_guardar(request, respuesta)
+            if guardar:
+                await _cache().aset(clave, guardar, _segundos())
+            return respuesta
+        return envoltura_asincrona
+
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return vista(request, *args, **kwargs)
+
+        clave = _clave_pagina(request, version_paginas(), obtener_catalogo())
+        guardada = _cache().get(clave)
+        if guardada is not None:
+            return _respuesta_guardada(request, guardada)
+
+        metricas.incrementar('cache_pagina_fallos')
+        request._cache_pagina = True
+        try:
+            respuesta = vista(request, *args, **kwargs)
+        finally:
+            request._cache_pagina = False
+        guardar = _para_guardar(request, respuesta)
+        if guardar:
+            _cache().set(clave, guardar, _segundos())
+        return respuesta
+    return envoltura
@@ -0,0 +1,71 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from . import metricas
+from .models import ServicioCorte
+
+
+CLAVE_CATALOGO = 'citas:catalogo'
+
+
+class Catalogo:
+    """Foto de los servicios activos con su versión y fecha de generación"""
+
+    def __init__(self, servicios, actualizado):
+        self.servicios = servicios
+        self.actualizado = actualizado
+        self.por_id = {s.pk: s for s in servicios}
+        # La versión depende solo del contenido: es la misma en todos los procesos
+        firma = "|".join(
+            f"{s.pk}:{s.nombre}:{s.descripcion}:{s.duracion_minutos}:{s.precio}" for s in servicios
+        )
+        self.version = hashlib.sha1(firma.encode()).hexdigest()[:16]
+
+
+def _cache():
+    return caches[getattr(settings, 'CITAS_CACHE_CATALOGO', 'default')]
+
+
+def obtener_catalogo():
+    """Catálogo de servicios activos; solo consulta la base si no está en caché"""
+    catalogo = _cache().get(CLAVE_CATALOGO)
+    if catalogo is not None:
+        metricas.incrementar('cache_catalogo_aciertos')
+    else:
+        metricas.incrementar('cache_catalogo_fallos')
+        servicios = list(ServicioCorte.objects.filter(activo=True).order_by('nombre'))
+        catalogo = Catalogo(servicios, timezone.now())
+        _cache().set(CLAVE_CATALOGO, catalogo, None)
+    return catalogo
+
+
+async def aobtener_catalogo():
+    """Versión asíncrona de obtener_catalogo para las vistas ASGI"""
+    catalogo = await _cache().aget(CLAVE_CATALOGO)
+    if catalogo is not None:
+        metricas.incrementar('cache_catalogo_aciertos')
+    else:
+        metricas.incrementar('cache_catalogo_fallos')
+        servicios = [s async for s in ServicioCorte.objects.filter(activo=True).order_by('nombre')]
+        catalogo = Catalogo(servicios, timezone.now())
+        await _cache().aset(CLAVE_CATALOGO, catalogo, None)
+    return catalogo
+
+
+def obtener_servicio(pk):
+    """Servicio por id desde el catálogo (o desde la base si está inactivo)"""
+    servicio = obtener_catalogo().por_id.get(pk)
+    if servicio is None:
+        servicio = ServicioCorte.objects.get(pk=pk)
+    return servicio
+
+
+def invalidar_catalogo():
+    # Se borra ya y otra vez al confirmar la transacción, por si alguien
+    # regeneró la caché leyendo los datos previos al commit
+    _cache().delete(CLAVE_CATALOGO)
+    transaction.on_commit(lambda: _cache().delete(CLAVE_CATALOGO))
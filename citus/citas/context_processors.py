@@ -0,0 +1,10 @@
+from .cache_paginas import version_paginas
+from .catalogo import obtener_catalogo
+
+
+def versiones_cache(request):
+    """Versiones para las claves de {% cache %}; se evalúan solo si la plantilla las usa"""
+    return {
+        'version_paginas': version_paginas,
+        'catalogo_version': lambda: obtener_catalogo().version,
+    }
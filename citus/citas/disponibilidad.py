@@ -0,0 +1,219 @@
+import asyncio
+import datetime
+from collections import defaultdict
+
+from django.utils import timezone
+
+from . import horarios, ocupacion as mapas_ocupacion
+from .models import Cita, PerfilUsuario
+
+
+# -----------------------
+#   HORARIO DE ATENCIÓN
+# -----------------------
+
+HORA_APERTURA = datetime.time(9, 0)
+HORA_CIERRE = datetime.time(19, 0)
+INTERVALO_MINUTOS = 30
+
+
+def a_minutos(hora):
+    return hora.hour * 60 + hora.minute
+
+
+def a_hora(minutos):
+    return datetime.time(minutos // 60, minutos % 60)
+
+
+def inicios_del_dia():
+    """Horas de inicio posibles (en minutos) según el horario de atención"""
+    return list(range(a_minutos(HORA_APERTURA), a_minutos(HORA_CIERRE), INTERVALO_MINUTOS))
+
+
+def fusionar_intervalos(intervalos):
+    """Ordena y une intervalos (inicio, fin) que se solapan o se tocan"""
+    fusionados = []
+    for inicio, fin in sorted(intervalos):
+        if fusionados and inicio <= fusionados[-1][1]:
+            if fin > fusionados[-1][1]:
+                fusionados[-1] = (fusionados[-1][0], fin)
+        else:
+            fusionados.append((inicio, fin))
+    return fusionados
+
+
+def inicios_libres(intervalos, inicios, duracion, cierre):
+    """Inicios donde cabe un servicio de `duracion` minutos, en una sola pasada.
+
+    `intervalos` debe venir fusionado (ordenado y sin solapes) e `inicios` ordenado.
+    """
+    libres = []
+    i, n = 0, len(intervalos)
+    for inicio in inicios:
+        fin = inicio + duracion
+        if fin > cierre:
+            break
+        while i < n and intervalos[i][1] <= inicio:
+            i += 1
+        if i == n or intervalos[i][0] >= fin:
+            libres.append(inicio)
+    return libres
+
+
+def _consulta_peluqueros():
+    return PerfilUsuario.objects.filter(es_peluquero=True).order_by('usuario_id').values_list('usuario_id', flat=True)
+
+
+def ids_peluqueros():
+    """Ids de los peluqueros; `[None]` si aún no hay ninguno (las citas quedan sin asignar)"""
+    return list(_consulta_peluqueros()) or [None]
+
+
+async def aids_peluqueros():
+    return [p async for p in _consulta_peluqueros()] or [None]
+
+
+def minimo_reservable(fecha):
+    """Primer minuto del día que aún se puede reservar"""
+    ahora = timezone.localtime()
+    if fecha < ahora.date():
+        return 24 * 60
+    if fecha == ahora.date():
+        return ahora.hour * 60 + ahora.minute
+    return 0
+
+
+def peluquero_libre(peluquero_id, fecha, hora, duracion, excluir=None):
+    """Comprueba con una consulta si un peluquero puede atender [hora, hora + duracion)"""
+    citas = Cita.objects.filter(peluquero_id=peluquero_id, fecha=fecha, estado__in=Cita.ESTADOS_ACTIVOS)
+    if excluir:
+        citas = citas.exclude(pk=excluir)
+    intervalos = fusionar_intervalos(
+        [(a_minutos(h), a_minutos(h) + d)
+         for h, d in citas.order_by().values_list('hora', 'servicio__duracion_minutos')]
+        + horarios.bloqueos([fecha], [peluquero_id])[(peluquero_id, fecha)]
+    )
+    return bool(inicios_libres(intervalos, [a_minutos(hora)], duracion, a_minutos(HORA_CIERRE)))
+
+
+class AgendaDia:
+    """Ocupación de todos los peluqueros para una fecha.
+
+    Se construye con dos consultas (peluqueros y citas activas del día) más
+    el horario compilado de cada peluquero (citas.horarios, en caché), y
+    responde en memoria qué horas y qué peluqueros quedan libres.
+    """
+
+    def __init__(self, fecha, peluqueros, ocupacion):
+        self.fecha = fecha
+        self.peluqueros = peluqueros
+        self.ocupacion = ocupacion
+        self.minimo = minimo_reservable(fecha)
+
+    @staticmethod
+    def _consulta_citas(fecha, excluir):
+        citas = Cita.objects.filter(fecha=fecha, estado__in=Cita.ESTADOS_ACTIVOS)
+        if excluir:
+            citas = citas.exclude(pk=excluir)
+        return citas.order_by().values_list('peluquero_id', 'hora', 'servicio__duracion_minutos')
+
+    @classmethod
+    def _construir(cls, fecha, peluqueros, filas, bloqueos):
+        # Las horas en que un peluquero no atiende cuentan como ocupadas
+        ocupacion = defaultdict(list)
+        for (peluquero_id, _), intervalos in bloqueos.items():
+            ocupacion[peluquero_id].extend(intervalos)
+        for peluquero_id, hora, duracion in filas:
+            inicio = a_minutos(hora)
+            ocupacion[peluquero_id].append((inicio, inicio + duracion))
+        return cls(fecha, peluqueros, {p: fusionar_intervalos(i) for p, i in ocupacion.items()})
+
+    @classmethod
+    def cargar(cls, fecha, excluir=None):
+        peluqueros = ids_peluqueros()
+        return cls._construir(
+            fecha, peluqueros, cls._consulta_citas(fecha, excluir), horarios.bloqueos([fecha], peluqueros)
+        )
+
+    @classmethod
+    async def acargar(cls, fecha, excluir=None):
+        """Como cargar, con las consultas en paralelo (vistas ASGI)"""
+        async def filas():
+            return [f async for f in cls._consulta_citas(fecha, excluir)]
+
+        async def peluqueros_y_bloqueos():
+            peluqueros = await aids_peluqueros()
+            return peluqueros, await horarios.abloqueos([fecha], peluqueros)
+        (peluqueros, bloqueos), citas = await asyncio.gather(peluqueros_y_bloqueos(), filas())
+        return cls._construir(fecha, peluqueros, citas, bloqueos)
+
+    def _inicios(self):
+        return [m for m in inicios_del_dia() if m >= self.minimo]
+
+    def inicios_libres(self, duracion, peluquero_id=None):
+        """Horas en que al menos un peluquero (o el indicado) puede atender el servicio"""
+        cierre = a_minutos(HORA_CIERRE)
+        inicios = self._inicios()
+        peluqueros = self.peluqueros if peluquero_id is None else [peluquero_id]
+        libres = set()
+        for p in peluqueros:
+            libres.update(inicios_libres(self.ocupacion.get(p, []), inicios, duracion, cierre))
+        return [a_hora(m) for m in sorted(libres)]
+
+    def peluqueros_libres(self, hora, duracion):
+        """Peluqueros sin citas que se crucen con [hora, hora + duracion)"""
+        inicio = a_minutos(hora)
+        if inicio < self.minimo:
+            return []
+        libres = []
+        for p in self.peluqueros:
+            if inicios_libres(self.ocupacion.get(p, []), [inicio], duracion, a_minutos(HORA_CIERRE)):
+                libres.append(p)
+        return libres
+
+
+def _fechas_rango(desde, hasta):
+    return [desde + datetime.timedelta(days=i) for i in range((hasta - desde).days + 1)]
+
+
+def disponibilidad_rango(desde, hasta, duracion):
+    """Horas libres de cada día del rango a partir de los mapas de ocupación.
+
+    Cuesta dos consultas sin importar cuántos días abarque el rango (más dos
+    si el horario compilado de algún peluquero no está en caché).
+    """
+    peluqueros = ids_peluqueros()
+    return _libres_rango(
+        desde, hasta, duracion, peluqueros, mapas_ocupacion.mapas_rango(desde, hasta),
+        horarios.bloqueos(_fechas_rango(desde, hasta), peluqueros),
+    )
+
+
+async def adisponibilidad_rango(desde, hasta, duracion):
+    async def peluqueros_y_bloqueos():
+        peluqueros = await aids_peluqueros()
+        return peluqueros, await horarios.abloqueos(_fechas_rango(desde, hasta), peluqueros)
+    (peluqueros, bloqueos), mapas = await asyncio.gather(
+        peluqueros_y_bloqueos(), mapas_ocupacion.amapas_rango(desde, hasta)
+    )
+    return _libres_rango(desde, hasta, duracion, peluqueros, mapas, bloqueos)
+
+
+def _libres_rango(desde, hasta, duracion, peluqueros, mapas, bloqueos):
+    cierre = a_minutos(HORA_CIERRE)
+    todos = inicios_del_dia()
+
+    dias = {}
+    fecha = desde
+    while fecha <= hasta:
+        minimo = minimo_reservable(fecha)
+        inicios = [m for m in todos if m >= minimo and m + duracion <= cierre]
+        libres = set()
+        for p in peluqueros:
+            mapa = mapas.get((p, fecha), 0)
+            for inicio, fin in bloqueos.get((p, fecha), ()):
+                mapa |= mapas_ocupacion.mascara(inicio, fin)
+            libres.update(m for m in inicios if mapas_ocupacion.cabe(mapa, m, duracion))
+        dias[fecha] = [a_hora(m) for m in sorted(libres)]
+        fecha += datetime.timedelta(days=1)
+    return dias
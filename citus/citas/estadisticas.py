@@ -0,0 +1,71 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import Coalesce
+
+from .catalogo import obtener_servicio
+from .models import Cita, EstadisticaDiaria
+
+
+def _filas(fecha, peluquero_id, servicio_id, estado):
+    filas = EstadisticaDiaria.objects.filter(fecha=fecha, servicio_id=servicio_id, estado=estado)
+    if peluquero_id is None:
+        return filas.filter(peluquero__isnull=True)
+    return filas.filter(peluquero_id=peluquero_id)
+
+
+def ajustar(fecha, peluquero_id, servicio_id, estado, precio, signo):
+    """Suma (signo=1) o resta (signo=-1) una cita en su fila del resumen.
+
+    Los ingresos suman el precio fijado en la cita (Cita.precio), así lo
+    cobrado no cambia si después se modifica el catálogo. Los minutos se
+    recalculan desde el total con la duración vigente, como en
+    recalcular_fechas.
+    """
+    duracion = obtener_servicio(servicio_id).duracion_minutos
+    precio = precio or 0
+    cambios = {
+        'total': F('total') + signo,
+        'ingresos': F('ingresos') + signo * precio,
+        'minutos': (F('total') + signo) * duracion,
+    }
+    if _filas(fecha, peluquero_id, servicio_id, estado).update(**cambios) or signo < 0:
+        return
+    try:
+        with transaction.atomic():
+            EstadisticaDiaria.objects.create(
+                fecha=fecha, peluquero_id=peluquero_id, servicio_id=servicio_id, estado=estado,
+                total=1, ingresos=precio, minutos=duracion,
+            )
+    except IntegrityError:
+        # Otra transacción creó la fila entre el UPDATE y el INSERT
+        _filas(fecha, peluquero_id, servicio_id, estado).update(**cambios)
+
+
+def actualizar_minutos(servicio):
+    """Tras cambiar la duración de un servicio, lleva sus filas del resumen a los minutos nuevos.
+
+    Una fila agrupa citas de un solo servicio, así que basta un UPDATE sobre
+    el total; el resultado es el mismo que daría recalcular_fechas. Los
+    ingresos no se tocan: salen del precio fijado en cada cita.
+    """
+    EstadisticaDiaria.objects.filter(servicio_id=servicio.pk).update(minutos=F('total') * servicio.duracion_minutos)
+
+
+def recalcular_fechas(fechas):
+    """Reconstruye el resumen de las fechas indicadas con un GROUP BY sobre Cita"""
+    fechas = set(fechas)
+    if not fechas:
+        return
+    grupos = (
+        Cita.objects.filter(fecha__in=fechas)
+        .order_by()
+        .values('fecha', 'peluquero_id', 'servicio_id', 'estado')
+        .annotate(
+            total=Count('id'),
+            ingresos=Coalesce(Sum('precio'), 0, output_field=DecimalField()),
+            minutos=Sum('servicio__duracion_minutos'),
+        )
+    )
+    with transaction.atomic():
+        EstadisticaDiaria.objects.filter(fecha__in=fechas).delete()
+        EstadisticaDiaria.objects.bulk_create([EstadisticaDiaria(**g) for g in grupos], batch_size=1000)
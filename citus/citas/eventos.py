@@ -0,0 +1,264 @@
+"""Avisos en vivo de horas ocupadas y liberadas, por fecha (Server-Sent Events).
+
+Cada cambio de una cita activa se publica al confirmar la transacción en la
+central configurada en CITAS_EVENTOS_CENTRAL. La central reparte el aviso a
+todas las colas suscritas a esa fecha; la vista `eventos_huecos` transmite
+cada cola a un navegador. Al transmitirlo, el aviso se completa con las horas
+libres del día para cada servicio del catálogo, así el navegador actualiza su
+selector sin volver a consultar /horas/. Ese cálculo corre del lado de quien
+escucha: la petición que reservó solo publica un aviso corto y, si la central
+falla, la reserva ya confirmada no se ve afectada.
+"""
+import asyncio
+import datetime
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from . import metricas
+from .catalogo import obtener_catalogo
+from .disponibilidad import INTERVALO_MINUTOS, AgendaDia
+from .models import Cita
+
+
+# Avisos pendientes por oyente; si un navegador no lee, se descartan los más viejos
+COLA_MAXIMA = 20
+# Milisegundos que espera EventSource antes de reconectarse
+REINTENTO_MS = 3000
+
+
+# -----------------------
+#   CENTRALES
+# -----------------------
+
+class CentralLocal:
+    """Reparte los avisos entre los oyentes de este proceso.
+
+    `publicar` se llama desde código síncrono (señales, otros hilos): cada
+    aviso se entrega en el bucle de eventos del oyente con call_soon_threadsafe.
+    """
+
+    def __init__(self, **opciones):
+        self._oyentes = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publicar(self, fecha, evento):
+        self.repartir(fecha, evento)
+
+    def repartir(self, fecha, evento):
+        with self._lock:
+            oyentes = list(self._oyentes.get(fecha, ()))
+        for bucle, cola in oyentes:
+            try:
+                bucle.call_soon_threadsafe(_encolar, cola, evento)
+            except RuntimeError:
+                pass  # el bucle del oyente ya se cerró
+
+    def hay_oyentes(self, fecha):
+        """False si publicar el aviso no llegaría a nadie (para no calcularlo)"""
+        return bool(self._oyentes.get(fecha))
+
+    def oyentes(self, fecha):
+        return len(self._oyentes.get(fecha, ()))
+
+    @asynccontextmanager
+    async def suscribir(self, fecha):
+        """Cola con los avisos de `fecha` mientras dure el bloque `async with`"""
+        oyente = (asyncio.get_running_loop(), asyncio.Queue(maxsize=COLA_MAXIMA))
+        with self._lock:
+            self._oyentes[fecha].add(oyente)
+        try:
+            yield oyente[1]
+        finally:
+            with self._lock:
+                self._oyentes[fecha].discard(oyente)
+                if not self._oyentes[fecha]:
+                    del self._oyentes[fecha]
+
+
+class CentralRedis(CentralLocal):
+    """Reparte entre todos los workers con pub/sub de Redis.
+
+    Cada proceso publica en el canal y un hilo por proceso escucha el canal
+    y reparte localmente, así un aviso llega a los oyentes de cualquier worker.
+    Opciones: `url` (por defecto redis://localhost:6379/0) y `canal`.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', canal='citus:huecos', **opciones):
+        super().__init__(**opciones)
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("CentralRedis requiere el paquete 'redis'")
+        self._redis = redis
+        self._cliente = redis.Redis.from_url(url)
+        self._canal = canal
+        self._escucha = None
+
+    def publicar(self, fecha, evento):
+        self._cliente.publish(self._canal, json.dumps({'fecha': fecha.isoformat(), 'evento': evento}))
+
+    def hay_oyentes(self, fecha):
+        return True  # puede haberlos en otro worker
+
+    def _escuchar(self):
+        while True:
+            try:
+                suscripcion = self._cliente.pubsub(ignore_subscribe_messages=True)
+                suscripcion.subscribe(self._canal)
+                for mensaje in suscripcion.listen():
+                    datos = json.loads(mensaje['data'])
+                    self.repartir(datetime.date.fromisoformat(datos['fecha']), datos['evento'])
+            except self._redis.ConnectionError:
+                time.sleep(1)  # Redis se reinició: se vuelve a suscribir
+
+    @asynccontextmanager
+    async def suscribir(self, fecha):
+        with self._lock:
+            if self._escucha is None:
+                self._escucha = threading.Thread(target=self._escuchar, name='citas-eventos', daemon=True)
+                self._escucha.start()
+        async with super().suscribir(fecha) as cola:
+            yield cola
+
+
+def _encolar(cola, evento):
+    if cola.full():
+        cola.get_nowait()
+    cola.put_nowait(evento)
+
+
+_central = None
+_central_lock = threading.Lock()
+
+
+def central():
+    """Central configurada en CITAS_EVENTOS_CENTRAL (una por proceso)"""
+    global _central
+    if _central is None:
+        with _central_lock:
+            if _central is None:
+                clase = import_string(getattr(settings, 'CITAS_EVENTOS_CENTRAL', 'citas.eventos.CentralLocal'))
+                _central = clase(**getattr(settings, 'CITAS_EVENTOS_OPCIONES', {}))
+    return _central
+
+
+# -----------------------
+#   PUBLICACIÓN
+# -----------------------
+
+def _activa(valores):
+    return bool(valores) and valores['estado'] in Cita.ESTADOS_ACTIVOS and valores['fecha'] is not None
+
+
+def _hueco(valores):
+    return (valores['fecha'], valores['hora'], valores['peluquero_id'], valores['servicio_id'])
+
+
+def horas_libres(fecha):
+    """{servicio_id: ['HH:MM', ...]} del día para cada servicio del catálogo ('' = intervalo base)"""
+    agenda = AgendaDia.cargar(fecha)
+    por_duracion = {}
+    libres = {}
+    servicios = [('', INTERVALO_MINUTOS)] + [(str(s.pk), s.duracion_minutos) for s in obtener_catalogo().servicios]
+    for clave, duracion in servicios:
+        if duracion not in por_duracion:
+            por_duracion[duracion] = [h.strftime('%H:%M') for h in agenda.inicios_libres(duracion)]
+        libres[clave] = por_duracion[duracion]
+    return libres
+
+
+def _publicar(tipo, fecha, hora=None, peluquero_id=None):
+    if not central().hay_oyentes(fecha):
+        return
+    metricas.incrementar('eventos_huecos', tipo=tipo)
+    central().publicar(fecha, {
+        'tipo': tipo,
+        'fecha': fecha.isoformat(),
+        'hora': hora.strftime('%H:%M') if hora else None,
+        'peluquero': peluquero_id,
+    })
+
+
+def _al_confirmar(funcion):
+    # robust: un error de la central se registra sin convertir en 500 una reserva ya confirmada
+    transaction.on_commit(funcion, robust=True)
+
+
+def _publicar_cita(tipo, valores):
+    _publicar(tipo, valores['fecha'], valores['hora'], valores['peluquero_id'])
+
+
+def avisar_cambio(original, actual):
+    """Publica al confirmar la transacción las horas que la cita liberó u ocupó.
+
+    `original` y `actual` son los valores seguidos por las señales de Cita
+    (None si la cita es nueva o se eliminó).
+    """
+    movida = _activa(original) and _activa(actual) and _hueco(original) != _hueco(actual)
+    if _activa(original) and (not _activa(actual) or movida):
+        _al_confirmar(lambda: _publicar_cita('liberada', original))
+    if _activa(actual) and (not _activa(original) or movida):
+        _al_confirmar(lambda: _publicar_cita('ocupada', actual))
+
+
+def avisar_liberadas(fechas):
+    """Un solo aviso 'liberada' por fecha para los cambios en lote (sin hora puntual)"""
+    for fecha in set(fechas):
+        _al_confirmar(partial(_publicar, 'liberada', fecha))
+
+
+def avisar_ocupadas(fechas):
+    """Como avisar_liberadas, para citas creadas o movidas en lote"""
+    for fecha in set(fechas):
+        _al_confirmar(partial(_publicar, 'ocupada', fecha))
+
+
+# -----------------------
+#   TRANSMISIÓN
+# -----------------------
+
+async def _con_libres(fecha, cola, evento):
+    """El aviso y los que ya esperan en la cola, con las horas libres calculadas una sola vez"""
+    avisos = [evento]
+    while not cola.empty():
+        avisos.append(cola.get_nowait())
+    libres = await sync_to_async(horas_libres)(fecha)
+    return [dict(aviso, libres=libres) if 'libres' not in aviso else aviso for aviso in avisos]
+
+
+def formatear(evento):
+    """Un aviso en formato text/event-stream"""
+    return f"event: {evento['tipo']}\ndata: {json.dumps(evento)}\n\n"
+
+
+async def transmitir(fecha, latido=None, duracion=None):
+    """Generador asíncrono del flujo SSE de `fecha`.
+
+    Envía un comentario cada `latido` segundos para que los proxies no corten
+    la conexión y termina a los `duracion` segundos; EventSource se reconecta
+    solo, y así ninguna conexión queda abierta para siempre.
+    """
+    latido = latido or getattr(settings, 'CITAS_EVENTOS_LATIDO', 15)
+    duracion = duracion or getattr(settings, 'CITAS_EVENTOS_DURACION', 300)
+    bucle = asyncio.get_running_loop()
+    async with central().suscribir(fecha) as cola:
+        yield f"retry: {REINTENTO_MS}\n\n"
+        limite = bucle.time() + duracion
+        while (restante := limite - bucle.time()) > 0:
+            try:
+                evento = await asyncio.wait_for(cola.get(), min(latido, restante))
+            except asyncio.TimeoutError:
+                yield ": latido\n\n"
+                continue
+            for aviso in await _con_libres(fecha, cola, evento):
+                yield formatear(aviso)
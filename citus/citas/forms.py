@@ -1,7 +1,11 @@
+import datetime
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
-from .models import Cita, ServicioCorte
+from django.utils import timezone
+from .catalogo import obtener_catalogo
+from .models import Cita, EsperaCita, SerieCita, ServicioCorte
 
 class CitaEstadoForm(forms.ModelForm):
     class Meta:
@@ -24,6 +28,53 @@ class CancelarCitaPeluqueroForm(forms.ModelForm):
         model = Cita
         fields = ['motivo_cancelacion']
 
+class FiltroFechasForm(forms.Form):
+    desde = forms.DateField(required=False, label="Desde", widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-input'}))
+    hasta = forms.DateField(required=False, label="Hasta", widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-input'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        desde, hasta = cleaned_data.get('desde'), cleaned_data.get('hasta')
+        if desde and hasta and hasta < desde:
+            raise forms.ValidationError("La fecha final no puede ser anterior a la inicial.")
+        return cleaned_data
+
+class ReporteForm(FiltroFechasForm):
+    agrupacion = forms.ChoiceField(
+        required=False, label="Agrupar por",
+        choices=[('dia', 'Día'), ('semana', 'Semana'), ('mes', 'Mes')],
+        widget=forms.Select(attrs={'class': 'form-input'})
+    )
+
+class FiltroCitasAdminForm(FiltroFechasForm):
+    estado = forms.ChoiceField(
+        required=False, label="Estado",
+        choices=[('', 'Todos')] + Cita.ESTADOS,
+        widget=forms.Select(attrs={'class': 'form-input'})
+    )
+    peluquero = forms.ModelChoiceField(
+        required=False, label="Peluquero", empty_label="Todos",
+        queryset=User.objects.filter(perfilusuario__es_peluquero=True).order_by('username'),
+        widget=forms.Select(attrs={'class': 'form-input'})
+    )
+    servicio = forms.ModelChoiceField(
+        required=False, label="Servicio", empty_label="Todos",
+        queryset=ServicioCorte.objects.order_by('nombre'),
+        widget=forms.Select(attrs={'class': 'form-input'})
+    )
+
+    def filtrar(self, citas):
+        """Aplica los filtros válidos al QuerySet de citas"""
+        datos = self.cleaned_data if self.is_valid() else {}
+        if datos.get('desde'):
+            citas = citas.filter(fecha__gte=datos['desde'])
+        if datos.get('hasta'):
+            citas = citas.filter(fecha__lte=datos['hasta'])
+        for campo in ('estado', 'peluquero', 'servicio'):
+            if datos.get(campo):
+                citas = citas.filter(**{campo: datos[campo]})
+        return citas
+
 class CustomUserCreationForm(UserCreationForm):
     email = forms.EmailField(
         required=True,
@@ -63,6 +114,46 @@ class CustomUserCreationForm(UserCreationForm):
 
 
 
+def consulta_peluqueros():
+    return User.objects.filter(perfilusuario__es_peluquero=True).order_by('username')
+
+
+async def aopciones_peluqueros():
+    """Opciones del selector de peluquero cargadas con el ORM asíncrono"""
+    return [(pk, nombre) async for pk, nombre in consulta_peluqueros().values_list('pk', 'username')]
+
+
+def opciones_servicios():
+    return [('', '---------')] + [(s.pk, str(s)) for s in obtener_catalogo().servicios]
+
+
+class ServicioCatalogoField(forms.ChoiceField):
+    """Selector de servicio activo que se valida contra el catálogo en caché, sin consultar la base"""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('error_messages', {'invalid_choice': "Selecciona un servicio válido."})
+        super().__init__(choices=opciones_servicios, **kwargs)
+
+    def prepare_value(self, value):
+        return getattr(value, 'pk', value)
+
+    def to_python(self, value):
+        value = self.prepare_value(value)
+        if value in self.empty_values:
+            return None
+        try:
+            return obtener_catalogo().por_id[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value})
+
+    def validate(self, value):
+        if value is None and self.required:
+            raise forms.ValidationError(self.error_messages['required'], code='required')
+
+    def has_changed(self, initial, data):
+        return str(self.prepare_value(initial) or '') != str(data or '')
+
+
 class CitaPublicaForm(forms.ModelForm):
     """Formulario de agendamiento (dinámico: público o usuario registrado)"""
 
@@ -94,13 +185,20 @@ class CitaPublicaForm(forms.ModelForm):
     hora = forms.ChoiceField(
         widget=forms.Select(attrs={'class': 'form-input'}),
         label="Hora",
-        choices=[]
+        choices=[],
+        error_messages={'invalid_choice': "La hora seleccionada ya no está disponible."}
     )
-    servicio = forms.ModelChoiceField(
-        queryset=ServicioCorte.objects.filter(activo=True),
+    servicio = ServicioCatalogoField(
         widget=forms.Select(attrs={'class': 'form-input'}),
         label="Servicio"
     )
+    peluquero_preferido = forms.ModelChoiceField(
+        queryset=consulta_peluqueros(),
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-input'}),
+        label="Peluquero (opcional)",
+        empty_label="Cualquiera disponible"
+    )
     notas = forms.CharField(
         required=False,
         widget=forms.Textarea(attrs={'class': 'form-input', 'rows': 3, 'placeholder': 'Notas adicionales (opcional)'}),
@@ -116,21 +214,171 @@ class CitaPublicaForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None)
+        # [(id, nombre)] ya cargados (vista asíncrona): el selector no consulta la base al dibujarse
+        peluqueros = kwargs.pop('peluqueros', None)
         super().__init__(*args, **kwargs)
         self.fields['hora'].choices = self.generar_horas_disponibles()
 
+        # La preferencia de peluquero solo aplica al agendar una cita nueva
+        if self.instance.pk:
+            del self.fields['peluquero_preferido']
+        elif peluqueros is not None:
+            campo = self.fields['peluquero_preferido']
+            campo.choices = [('', campo.empty_label)] + list(peluqueros)
+
         # Si el usuario está logeado, ocultamos los campos de contacto
         if user and user.is_authenticated:
             for field in ['nombre_cliente', 'apellido_cliente', 'correo_cliente', 'telefono_cliente']:
                 self.fields[field].widget = forms.HiddenInput()
 
+    def clean_hora(self):
+        return datetime.datetime.strptime(self.cleaned_data['hora'], '%H:%M').time()
+
     def generar_horas_disponibles(self):
-        import datetime
-        horas = []
-        hora_actual = datetime.datetime.combine(datetime.date.today(), datetime.time(9, 0))
-        hora_final = datetime.datetime.combine(datetime.date.today(), datetime.time(19, 0))
-        while hora_actual < hora_final:
-            horas.append((hora_actual.time().strftime('%H:%M'), hora_actual.time().strftime('%H:%M')))
-            hora_actual += datetime.timedelta(minutes=30)
-        return horas
+        """Horas ofrecidas: la grilla completa o, si ya hay fecha y servicio, solo las libres"""
+        from .disponibilidad import AgendaDia, INTERVALO_MINUTOS, a_hora, inicios_del_dia
+
+        fecha, servicio = self._fecha_y_servicio()
+        if fecha is None:
+            horas = [a_hora(m) for m in inicios_del_dia()]
+        else:
+            duracion = servicio.duracion_minutos if servicio else INTERVALO_MINUTOS
+            horas = AgendaDia.cargar(fecha, excluir=self.instance.pk).inicios_libres(duracion)
+        return [(h.strftime('%H:%M'), h.strftime('%H:%M')) for h in horas]
+
+    def _fecha_y_servicio(self):
+        if not self.is_bound:
+            return None, None
+        try:
+            fecha = self.fields['fecha'].clean(self.data.get(self.add_prefix('fecha')))
+            servicio = self.fields['servicio'].clean(self.data.get(self.add_prefix('servicio')))
+        except forms.ValidationError:
+            return None, None
+        return fecha, servicio
+
+
+def opciones_horas():
+    from .disponibilidad import a_hora, inicios_del_dia
+    return [(h.strftime('%H:%M'), h.strftime('%H:%M')) for h in map(a_hora, inicios_del_dia())]
+
+
+class SerieCitaForm(forms.ModelForm):
+    """Cita recurrente: mismo servicio y hora cada cierta cantidad de semanas"""
+
+    servicio = ServicioCatalogoField(
+        widget=forms.Select(attrs={'class': 'form-input'}),
+        label="Servicio"
+    )
+    hora = forms.ChoiceField(
+        widget=forms.Select(attrs={'class': 'form-input'}),
+        label="Hora",
+        choices=opciones_horas,
+    )
+    peluquero = forms.ModelChoiceField(
+        queryset=consulta_peluqueros(),
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-input'}),
+        label="Peluquero (opcional)",
+        empty_label="El que tenga más fechas libres"
+    )
+    fecha_inicio = forms.DateField(
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-input'}),
+        label="Primera cita"
+    )
+    hasta = forms.DateField(
+        required=False,
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-input'}),
+        label="Repetir hasta (opcional, máximo seis meses)"
+    )
+    omitir_conflictos = forms.BooleanField(
+        required=False,
+        label="Reservar solo las fechas libres si alguna está ocupada"
+    )
+
+    class Meta:
+        model = SerieCita
+        fields = ['servicio', 'peluquero', 'fecha_inicio', 'hora', 'intervalo_semanas', 'hasta', 'notas']
+        widgets = {
+            'intervalo_semanas': forms.Select(attrs={'class': 'form-input'}),
+            'notas': forms.Textarea(attrs={'class': 'form-input', 'rows': 3, 'placeholder': 'Notas adicionales (opcional)'}),
+        }
+        labels = {'intervalo_semanas': "Frecuencia", 'notas': "Notas adicionales"}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Al editar solo se cambian el servicio, la hora y las notas de las citas pendientes
+        if self.instance.pk:
+            for campo in ('peluquero', 'fecha_inicio', 'intervalo_semanas', 'hasta', 'omitir_conflictos'):
+                del self.fields[campo]
+
+    def clean_hora(self):
+        return datetime.datetime.strptime(self.cleaned_data['hora'], '%H:%M').time()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        inicio, hasta = cleaned_data.get('fecha_inicio'), cleaned_data.get('hasta')
+        if inicio and hasta and hasta < inicio:
+            raise forms.ValidationError("La fecha de término no puede ser anterior a la primera cita.")
+        return cleaned_data
+
+
+def opciones_ventana():
+    """Horas de inicio del día más la de cierre (límite final de una ventana)"""
+    from .disponibilidad import HORA_CIERRE
+    cierre = HORA_CIERRE.strftime('%H:%M')
+    return opciones_horas()[1:] + [(cierre, cierre)]
+
+
+class EsperaCitaForm(forms.ModelForm):
+    """Inscripción en la lista de espera para una fecha y una ventana horaria"""
+
+    servicio = ServicioCatalogoField(
+        widget=forms.Select(attrs={'class': 'form-input'}),
+        label="Servicio"
+    )
+    peluquero = forms.ModelChoiceField(
+        queryset=consulta_peluqueros(),
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-input'}),
+        label="Peluquero (opcional)",
+        empty_label="Cualquiera"
+    )
+    fecha = forms.DateField(
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-input'}),
+        label="Fecha"
+    )
+    desde = forms.ChoiceField(
+        widget=forms.Select(attrs={'class': 'form-input'}),
+        label="Desde las",
+        choices=opciones_horas,
+    )
+    hasta = forms.ChoiceField(
+        widget=forms.Select(attrs={'class': 'form-input'}),
+        label="Hasta las",
+        choices=opciones_ventana,
+    )
+
+    class Meta:
+        model = EsperaCita
+        fields = ['servicio', 'peluquero', 'fecha', 'desde', 'hasta']
+
+    def clean_desde(self):
+        return datetime.datetime.strptime(self.cleaned_data['desde'], '%H:%M').time()
+
+    def clean_hasta(self):
+        return datetime.datetime.strptime(self.cleaned_data['hasta'], '%H:%M').time()
+
+    def clean_fecha(self):
+        fecha = self.cleaned_data['fecha']
+        if fecha < timezone.localdate():
+            raise forms.ValidationError("La fecha no puede ser pasada.")
+        return fecha
 
+    def clean(self):
+        cleaned_data = super().clean()
+        desde, hasta, servicio = cleaned_data.get('desde'), cleaned_data.get('hasta'), cleaned_data.get('servicio')
+        if desde and hasta and servicio:
+            inicio = datetime.datetime.combine(datetime.date.min, desde)
+            if inicio + datetime.timedelta(minutes=servicio.duracion_minutos) > datetime.datetime.combine(datetime.date.min, hasta):
+                raise forms.ValidationError("La ventana es más corta que la duración del servicio.")
+        return cleaned_data
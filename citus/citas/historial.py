@@ -0,0 +1,56 @@
+"""Citas de un cliente: las próximas (pocas, completas) y el historial paginado.
+
+Si una cita todavía se puede cancelar se decide en la consulta (anotación
+`cancelable`) comparando con un solo instante de corte, no fila por fila.
+"""
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import PLAZO_CANCELACION, Cita
+
+
+def _desde(instante, incluido=True):
+    """Citas cuya fecha y hora (locales) son posteriores a `instante` (o iguales, si `incluido`)"""
+    instante = timezone.localtime(instante)
+    hora = 'hora__gte' if incluido else 'hora__gt'
+    return Q(fecha__gt=instante.date()) | Q(fecha=instante.date(), **{hora: instante.time()})
+
+
+def anotar_cancelable(citas, ahora=None):
+    """Agrega `cancelable`: activa y a más de PLAZO_CANCELACION de empezar (como Cita.puede_cancelar)"""
+    corte = (ahora or timezone.now()) + PLAZO_CANCELACION
+    cancelable = Q(_desde(corte, incluido=False), estado__in=Cita.ESTADOS_ACTIVOS)
+    return citas.annotate(cancelable=ExpressionWrapper(cancelable, output_field=BooleanField()))
+
+
+def _del_usuario(usuario):
+    return Cita.objects.filter(usuario=usuario).select_related('servicio', 'peluquero')
+
+
+def proximas(usuario, ahora=None):
+    """Citas activas que aún no ocurren, de la más cercana a la más lejana"""
+    ahora = ahora or timezone.now()
+    citas = _del_usuario(usuario).filter(_desde(ahora), estado__in=Cita.ESTADOS_ACTIVOS)
+    return anotar_cancelable(citas, ahora).order_by('fecha', 'hora', 'id')
+
+
+def historial(usuario, ahora=None):
+    """Todo lo demás: citas pasadas, completadas o canceladas (para paginar con citas.paginacion)"""
+    ahora = ahora or timezone.now()
+    citas = _del_usuario(usuario).exclude(_desde(ahora), estado__in=Cita.ESTADOS_ACTIVOS)
+    return anotar_cancelable(citas, ahora)
+
+
+def a_json(cita):
+    return {
+        'id': cita.pk,
+        'fecha': cita.fecha.isoformat(),
+        'hora': cita.hora.strftime('%H:%M'),
+        'estado': cita.estado,
+        'estado_display': cita.get_estado_display(),
+        'servicio': cita.servicio.nombre,
+        'peluquero': cita.peluquero.username if cita.peluquero else None,
+        'cancelable': cita.cancelable,
+        'detalle_url': reverse('detalle_cita', args=[cita.pk]),
+    }
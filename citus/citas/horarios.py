@@ -0,0 +1,212 @@
+"""Jornada de cada peluquero: turnos semanales, descansos, ausencias y feriados.
+
+Las reglas se compilan, por peluquero y día, en los intervalos (minutos)
+del horario del local en que el peluquero no atiende. AgendaDia los fusiona
+con las citas, así que la disponibilidad sigue siendo una sola intersección
+de intervalos en memoria aunque cada peluquero tenga un horario distinto.
+
+Lo compilado se guarda en la caché CITAS_CACHE_HORARIOS. Cambiar un turno
+invalida solo a ese peluquero (su versión); una ausencia, solo sus fechas.
+"""
+import asyncio
+import datetime
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+
+from . import disponibilidad, metricas
+from .models import Ausencia, HorarioSemanal
+
+
+CLAVE_VERSION = 'citas:horario:version:{}'
+CLAVE_DIA = 'citas:horario:{}:{}:{}'
+
+# Una ausencia más larga que esto invalida al peluquero completo en vez de día por día
+MAX_DIAS_INVALIDACION = 62
+
+
+def _cache():
+    return caches[getattr(settings, 'CITAS_CACHE_HORARIOS', 'default')]
+
+
+def _segundos():
+    return getattr(settings, 'CITAS_CACHE_HORARIOS_SEGUNDOS', 3600)
+
+
+def _fechas(desde, hasta):
+    return [desde + datetime.timedelta(days=i) for i in range((hasta - desde).days + 1)]
+
+
+# -----------------------
+#   COMPILACIÓN
+# -----------------------
+
+def compilar(turnos, descansos, ausencias):
+    """Intervalos fusionados en que el peluquero no atiende en un día.
+
+    `turnos` son sus intervalos de atención de ese día de la semana (None si
+    no tiene turnos: atiende en el horario del local), `descansos` sus pausas
+    y `ausencias` los (inicio, fin) de ese día, con None para el día completo.
+    """
+    apertura = disponibilidad.a_minutos(disponibilidad.HORA_APERTURA)
+    cierre = disponibilidad.a_minutos(disponibilidad.HORA_CIERRE)
+    if None in ausencias:
+        return [(apertura, cierre)]
+
+    bloqueos = list(descansos) + list(ausencias)
+    if turnos is not None:
+        inicio = apertura
+        for desde, hasta in disponibilidad.fusionar_intervalos(turnos):
+            if desde > inicio:
+                bloqueos.append((inicio, desde))
+            inicio = max(inicio, hasta)
+        if inicio < cierre:
+            bloqueos.append((inicio, cierre))
+    return disponibilidad.fusionar_intervalos(bloqueos)
+
+
+def _consulta_turnos(peluqueros):
+    return HorarioSemanal.objects.filter(peluquero_id__in=[p for p in peluqueros if p is not None]).values_list(
+        'peluquero_id', 'dia_semana', 'hora_inicio', 'hora_fin', 'tipo'
+    )
+
+
+def _consulta_ausencias(peluqueros, desde, hasta):
+    return Ausencia.objects.filter(
+        Q(peluquero_id__in=[p for p in peluqueros if p is not None]) | Q(peluquero__isnull=True),
+        desde__lte=hasta, hasta__gte=desde,
+    ).values_list('peluquero_id', 'desde', 'hasta', 'hora_inicio', 'hora_fin')
+
+
+def _compilar_faltantes(faltantes, turnos, ausencias):
+    """{(peluquero_id, fecha): bloqueos} a partir de las filas de ambas consultas"""
+    a_minutos = disponibilidad.a_minutos
+    semanales = defaultdict(lambda: {'turno': defaultdict(list), 'descanso': defaultdict(list)})
+    for peluquero_id, dia, inicio, fin, tipo in turnos:
+        semanales[peluquero_id][tipo][dia].append((a_minutos(inicio), a_minutos(fin)))
+
+    ausentes = defaultdict(list)
+    for peluquero_id, desde, hasta, inicio, fin in ausencias:
+        intervalo = None if inicio is None else (a_minutos(inicio), a_minutos(fin))
+        ausentes[peluquero_id].append((desde, hasta, intervalo))
+
+    compilados = {}
+    for peluquero_id, fecha in faltantes:
+        reglas = semanales.get(peluquero_id)
+        dia = fecha.weekday()
+        del_dia = [
+            intervalo for desde, hasta, intervalo in ausentes[peluquero_id] + ausentes[None]
+            if desde <= fecha <= hasta
+        ]
+        compilados[(peluquero_id, fecha)] = compilar(
+            reglas['turno'].get(dia, []) if reglas and reglas['turno'] else None,
+            reglas['descanso'].get(dia, []) if reglas else [],
+            del_dia,
+        )
+    return compilados
+
+
+# -----------------------
+#   LECTURA CON CACHÉ
+# -----------------------
+
+def _claves(fechas, peluqueros, versiones):
+    return {
+        (p, f): CLAVE_DIA.format(p, versiones.get(CLAVE_VERSION.format(p), 0), f.isoformat())
+        for p in peluqueros for f in fechas
+    }
+
+
+def _repartir(claves, guardados):
+    resultado, faltantes = {}, []
+    for clave, llave in claves.items():
+        if llave in guardados:
+            resultado[clave] = guardados[llave]
+        else:
+            faltantes.append(clave)
+    metricas.incrementar('cache_horario_aciertos', len(resultado))
+    if faltantes:
+        metricas.incrementar('cache_horario_fallos', len(faltantes))
+    return resultado, faltantes
+
+
+def bloqueos(fechas, peluqueros):
+    """{(peluquero_id, fecha): [(inicio, fin)]} en que cada peluquero no atiende.
+
+    Dos lecturas de la caché; solo si faltan días se consultan las reglas
+    (dos consultas para todos los peluqueros y fechas que falten).
+    """
+    fechas = sorted(set(fechas))
+    if not fechas:
+        return {}
+    versiones = _cache().get_many([CLAVE_VERSION.format(p) for p in peluqueros])
+    claves = _claves(fechas, peluqueros, versiones)
+    resultado, faltantes = _repartir(claves, _cache().get_many(list(claves.values())))
+    if faltantes:
+        desde, hasta = min(f for _, f in faltantes), max(f for _, f in faltantes)
+        compilados = _compilar_faltantes(
+            faltantes, _consulta_turnos(peluqueros), _consulta_ausencias(peluqueros, desde, hasta)
+        )
+        _cache().set_many({claves[c]: v for c, v in compilados.items()}, _segundos())
+        resultado.update(compilados)
+    return resultado
+
+
+async def abloqueos(fechas, peluqueros):
+    """Como bloqueos, con la caché y el ORM asíncronos (vistas ASGI)"""
+    fechas = sorted(set(fechas))
+    if not fechas:
+        return {}
+    versiones = await _cache().aget_many([CLAVE_VERSION.format(p) for p in peluqueros])
+    claves = _claves(fechas, peluqueros, versiones)
+    resultado, faltantes = _repartir(claves, await _cache().aget_many(list(claves.values())))
+    if faltantes:
+        desde, hasta = min(f for _, f in faltantes), max(f for _, f in faltantes)
+
+        async def filas(consulta):
+            return [f async for f in consulta]
+        turnos, ausencias = await asyncio.gather(
+            filas(_consulta_turnos(peluqueros)), filas(_consulta_ausencias(peluqueros, desde, hasta))
+        )
+        compilados = _compilar_faltantes(faltantes, turnos, ausencias)
+        await _cache().aset_many({claves[c]: v for c, v in compilados.items()}, _segundos())
+        resultado.update(compilados)
+    return resultado
+
+
+# -----------------------
+#   INVALIDACIÓN
+# -----------------------
+
+def invalidar_peluquero(peluquero_id):
+    """Descarta todos los días compilados del peluquero (cambió su horario semanal)"""
+    def invalidar():
+        _cache().set(CLAVE_VERSION.format(peluquero_id), uuid.uuid4().hex, None)
+    # Ya y otra vez al confirmar, por si alguien compiló con los datos previos al commit
+    invalidar()
+    transaction.on_commit(invalidar)
+
+
+def invalidar_fechas(peluquero_id, desde, hasta):
+    """Descarta los días [desde, hasta] del peluquero, o de todos si `peluquero_id` es None (feriado)"""
+    fechas = _fechas(desde, hasta)
+    if peluquero_id is None:
+        peluqueros = disponibilidad.ids_peluqueros()
+        if peluqueros != [None]:
+            peluqueros.append(None)
+    else:
+        peluqueros = [peluquero_id]
+    if len(fechas) > MAX_DIAS_INVALIDACION:
+        for p in peluqueros:
+            invalidar_peluquero(p)
+        return
+
+    def invalidar():
+        versiones = _cache().get_many([CLAVE_VERSION.format(p) for p in peluqueros])
+        _cache().delete_many(list(_claves(fechas, peluqueros, versiones).values()))
+    invalidar()
+    transaction.on_commit(invalidar)
@@ -0,0 +1,205 @@
+import csv
+import datetime
+import itertools
+import json
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+
+from . import estadisticas, ocupacion
+from .disponibilidad import a_minutos
+from .models import Cita, PerfilUsuario, ServicioCorte
+from .solapes import Intervalos, hora_fin
+
+
+# Columnas del formato de intercambio (CSV o JSONL, una cita por fila)
+COLUMNAS = [
+    'fecha', 'hora', 'estado', 'servicio', 'peluquero', 'usuario',
+    'nombre_cliente', 'apellido_cliente', 'correo_cliente', 'telefono_cliente', 'notas',
+]
+# Campo del ORM de cada columna que no es un campo directo de Cita
+CAMPOS_ORM = {'servicio': 'servicio__nombre', 'peluquero': 'peluquero__username', 'usuario': 'usuario__username'}
+# Nombres alternativos aceptados al importar (p. ej. la exportación del panel admin)
+ALIAS = {orm: columna for columna, orm in CAMPOS_ORM.items()}
+
+ESTADOS_VALIDOS = {clave for clave, _ in Cita.ESTADOS}
+TAMANO_LOTE = 1000
+
+
+# -----------------------
+#   EXPORTACIÓN
+# -----------------------
+
+def filas_exportacion(queryset):
+    """Tuplas en el orden de COLUMNAS, leídas por trozos"""
+    campos = [CAMPOS_ORM.get(c, c) for c in COLUMNAS]
+    return queryset.order_by('fecha', 'hora', 'id').values_list(*campos).iterator(chunk_size=2000)
+
+
+def escribir(filas, salida, formato):
+    """Escribe las filas en `salida` sin acumularlas en memoria; devuelve cuántas escribió"""
+    total = 0
+    if formato == 'csv':
+        escritor = csv.writer(salida)
+        escritor.writerow(COLUMNAS)
+        for total, fila in enumerate(filas, 1):
+            escritor.writerow(['' if v is None else v for v in fila])
+    else:
+        for total, fila in enumerate(filas, 1):
+            salida.write(json.dumps(dict(zip(COLUMNAS, fila)), cls=DjangoJSONEncoder) + "\n")
+    return total
+
+
+# -----------------------
+#   IMPORTACIÓN
+# -----------------------
+
+def leer_registros(archivo, formato):
+    """Diccionarios del archivo, uno a la vez"""
+    if formato == 'csv':
+        registros = csv.DictReader(archivo)
+    else:
+        registros = (json.loads(linea) for linea in archivo if linea.strip())
+    for registro in registros:
+        yield {ALIAS.get(k, k): v for k, v in registro.items()}
+
+
+def en_lotes(registros, tamano, saltar=0):
+    """(número del último registro, lote) a partir del registro `saltar` + 1"""
+    registros = itertools.islice(registros, saltar, None)
+    numero = saltar
+    while True:
+        lote = list(itertools.islice(registros, tamano))
+        if not lote:
+            return
+        numero += len(lote)
+        yield numero, lote
+
+
+def _texto(valor):
+    return '' if valor is None else str(valor).strip()
+
+
+CAMPOS_CLAVE = ('fecha', 'hora', 'peluquero_id', 'servicio_id', 'usuario_id', 'correo_cliente', 'nombre_cliente')
+
+
+def clave_natural(cita):
+    """Identifica una cita importada: día, hora, peluquero, servicio y cliente (usuario, correo o nombre)"""
+    cliente = cita.usuario_id or cita.correo_cliente.lower() or cita.nombre_cliente
+    return cita.fecha, cita.hora, cita.peluquero_id, cita.servicio_id, cliente
+
+
+class Importador:
+    """Valida e inserta citas por lotes contra mapas en memoria de servicios y peluqueros"""
+
+    def __init__(self, batch_size=TAMANO_LOTE):
+        self.batch_size = batch_size
+        # Los servicios y peluqueros son pocos: se cargan una vez
+        self.servicios, self.duraciones, self.precios = {}, {}, {}
+        servicios = ServicioCorte.objects.order_by('-id').values_list('id', 'nombre', 'duracion_minutos', 'precio')
+        for pk, nombre, duracion, precio in servicios:
+            self.servicios[nombre] = pk
+            self.servicios[str(pk)] = pk
+            self.duraciones[pk] = duracion
+            self.precios[pk] = precio
+        self.peluqueros = dict(
+            PerfilUsuario.objects.filter(es_peluquero=True).values_list('usuario__username', 'usuario_id')
+        )
+
+    def _convertir(self, registro, usuarios):
+        """Cita sin guardar a partir del registro, o el texto del error"""
+        try:
+            fecha = datetime.date.fromisoformat(_texto(registro.get('fecha')))
+            hora = datetime.time.fromisoformat(_texto(registro.get('hora')))
+        except ValueError:
+            return "fecha u hora inválida"
+        estado = _texto(registro.get('estado')) or 'pendiente'
+        if estado not in ESTADOS_VALIDOS:
+            return f"estado desconocido: {estado}"
+        servicio_id = self.servicios.get(_texto(registro.get('servicio')))
+        if servicio_id is None:
+            return f"servicio desconocido: {registro.get('servicio')}"
+        peluquero = _texto(registro.get('peluquero'))
+        if peluquero and peluquero not in self.peluqueros:
+            return f"peluquero desconocido: {peluquero}"
+        usuario = _texto(registro.get('usuario'))
+        if usuario and usuario not in usuarios:
+            return f"usuario desconocido: {usuario}"
+
+        return Cita(
+            fecha=fecha, hora=hora, hora_fin=hora_fin(hora, self.duraciones[servicio_id]),
+            estado=estado, servicio_id=servicio_id, precio=self.precios[servicio_id],
+            peluquero_id=self.peluqueros.get(peluquero), usuario_id=usuarios.get(usuario),
+            nombre_cliente=_texto(registro.get('nombre_cliente'))[:100],
+            apellido_cliente=_texto(registro.get('apellido_cliente'))[:100],
+            correo_cliente=_texto(registro.get('correo_cliente')),
+            telefono_cliente=_texto(registro.get('telefono_cliente'))[:15],
+            notas=_texto(registro.get('notas')) or None,
+        )
+
+    def importar_lote(self, lote, primer_numero):
+        """Inserta un lote en una transacción.
+
+        Se omiten los registros ya importados (misma cita según clave_natural,
+        en cualquier estado), así reanudar o repetir una importación no
+        duplica el historial, y las citas activas que se cruzan con otra activa
+        del mismo peluquero, existente o anterior en el lote, según la
+        duración de ambos servicios (citas.solapes). Las agendas del lote se
+        bloquean antes de leerlas, como en una reserva. Devuelve (creadas,
+        conflictos, duplicadas, errores), donde errores es una lista de
+        (número de registro, motivo).
+        """
+        nombres = {_texto(r.get('usuario')) for r in lote} - {''}
+        usuarios = dict(User.objects.filter(username__in=nombres).values_list('username', 'id'))
+
+        citas, errores = [], []
+        for numero, registro in enumerate(lote, primer_numero):
+            cita = self._convertir(registro, usuarios)
+            if isinstance(cita, str):
+                errores.append((numero, cita))
+            else:
+                citas.append((numero, cita))
+        if not citas:
+            return 0, 0, 0, errores
+
+        with transaction.atomic():
+            ocupacion.bloquear({(c.peluquero_id, c.fecha) for _, c in citas if c.peluquero_id is not None})
+            # Una sola consulta: las citas de las fechas del lote, para duplicados y agendas
+            agendas, vistas = defaultdict(Intervalos), set()
+            peluqueros = {c.peluquero_id for _, c in citas} - {None}
+            existentes = Cita.objects.filter(
+                Q(peluquero_id__in=peluqueros) | Q(peluquero__isnull=True),
+                fecha__in={c.fecha for _, c in citas},
+            ).select_related('servicio').only(*CAMPOS_CLAVE, 'estado', 'servicio__duracion_minutos').order_by()
+            for cita in existentes:
+                vistas.add(clave_natural(cita))
+                if cita.peluquero_id is not None and cita.estado in Cita.ESTADOS_ACTIVOS:
+                    inicio = a_minutos(cita.hora)
+                    agendas[(cita.peluquero_id, cita.fecha)].agregar(inicio, inicio + cita.servicio.duracion_minutos)
+
+            nuevas, conflictos, duplicadas = [], 0, 0
+            for numero, cita in citas:
+                clave = clave_natural(cita)
+                if clave in vistas:
+                    duplicadas += 1
+                    continue
+                if cita.peluquero_id is not None and cita.estado in Cita.ESTADOS_ACTIVOS:
+                    inicio = a_minutos(cita.hora)
+                    fin = inicio + self.duraciones[cita.servicio_id]
+                    agenda = agendas[(cita.peluquero_id, cita.fecha)]
+                    if agenda.chocan(inicio, fin):
+                        conflictos += 1
+                        errores.append((numero, f"conflicto con otra cita del peluquero el {cita.fecha} a las {cita.hora}"))
+                        continue
+                    agenda.agregar(inicio, fin)
+                vistas.add(clave)
+                nuevas.append(cita)
+
+            # bulk_create no emite señales: los resúmenes se recalculan aquí mismo
+            Cita.objects.bulk_create(nuevas, batch_size=self.batch_size)
+            ocupacion.recalcular({(c.peluquero_id, c.fecha) for c in nuevas})
+            estadisticas.recalcular_fechas({c.fecha for c in nuevas})
+        return len(nuevas), conflictos, duplicadas, errores
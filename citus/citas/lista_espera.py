@@ -0,0 +1,223 @@
+"""Lista de espera: las horas que libera una cancelación se ofrecen a quien espera.
+
+Cancelar solo escribe un HuecoLiberado en la misma transacción (bandeja de
+salida, como EventoNotificacion). El worker de procesar_notificaciones los
+toma por lotes, busca con una consulta (índice por fecha y ventana) a los
+clientes que esperan esas horas y reserva cada una al primero que calce,
+con una cita retenida hasta PLAZO_OFERTA. Una oferta vencida o rechazada
+se cancela y su hora vuelve a la bandeja para el siguiente de la lista.
+"""
+import datetime
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metricas, notificaciones
+from .disponibilidad import a_minutos, minimo_reservable, peluquero_libre
+from .models import Cita, EsperaCita, HuecoLiberado
+from .reservas import bloquear_agenda
+
+
+TAMANO_LOTE = 100
+# Plazo de un worker para procesar lo que tomó; vencido, otro lo puede retomar
+PLAZO_PROCESO = datetime.timedelta(minutes=5)
+
+
+def plazo_oferta():
+    """Tiempo que se retiene la hora para el cliente antes de ofrecerla al siguiente"""
+    return datetime.timedelta(minutes=getattr(settings, 'CITAS_ESPERA_PLAZO_MINUTOS', 30))
+
+
+# -----------------------
+#   REGISTRO (dentro de la transacción de la cita)
+# -----------------------
+
+def _ofrecible(peluquero_id, fecha):
+    # Una cita sin peluquero no ocupaba ninguna agenda: no libera nada que ofrecer
+    return peluquero_id is not None and fecha is not None and fecha >= timezone.localdate()
+
+
+def registrar_liberadas(citas):
+    """Encola las horas que dejan libres `citas` (con sus valores previos al cambio), un INSERT"""
+    return HuecoLiberado.objects.bulk_create([
+        HuecoLiberado(peluquero_id=c.peluquero_id, fecha=c.fecha, hora=c.hora)
+        for c in citas if _ofrecible(c.peluquero_id, c.fecha)
+    ])
+
+
+def registrar_cambio(original, actual):
+    """Como eventos.avisar_cambio: encola la hora si la cita activa se canceló, eliminó o movió.
+
+    `original` y `actual` son los valores seguidos por las señales de Cita.
+    """
+    def activa(valores):
+        return valores is not None and valores['estado'] in Cita.ESTADOS_ACTIVOS
+
+    if not activa(original) or not _ofrecible(original['peluquero_id'], original['fecha']):
+        return
+    movida = activa(actual) and (
+        (original['peluquero_id'], original['fecha'], original['hora'])
+        != (actual['peluquero_id'], actual['fecha'], actual['hora'])
+    )
+    if not activa(actual) or movida:
+        HuecoLiberado.objects.create(
+            peluquero_id=original['peluquero_id'], fecha=original['fecha'], hora=original['hora'],
+        )
+
+
+# -----------------------
+#   WORKER
+# -----------------------
+
+def reclamar(tamano=TAMANO_LOTE, ahora=None):
+    """Toma hasta `tamano` huecos sin procesar; el UPDATE condicionado evita que dos workers tomen el mismo"""
+    ahora = ahora or timezone.now()
+    listos = HuecoLiberado.objects.filter(procesado=False, disponible_en__lte=ahora)
+    while True:
+        pks = list(listos.order_by('disponible_en', 'id').values_list('pk', flat=True)[:tamano])
+        if not pks:
+            return []
+        lote = uuid.uuid4().hex
+        if listos.filter(pk__in=pks).update(lote=lote, disponible_en=ahora + PLAZO_PROCESO):
+            return list(HuecoLiberado.objects.filter(pk__in=pks, lote=lote).order_by('creado_en', 'id'))
+
+
+def interesados(huecos):
+    """Quienes esperan alguna de las horas, en orden de llegada, con una sola consulta"""
+    filtro = Q()
+    for hueco in huecos:
+        peluquero = Q(peluquero__isnull=True) | Q(peluquero_id=hueco.peluquero_id)
+        filtro |= Q(peluquero, fecha=hueco.fecha, desde__lte=hueco.hora, hasta__gt=hueco.hora)
+    return list(
+        EsperaCita.objects.filter(filtro, estado='esperando')
+        .select_related('servicio', 'usuario__perfilusuario')
+        .order_by('creado_en', 'id')
+    )
+
+
+def _calza(espera, hueco):
+    if hueco.peluquero_id is None or espera.fecha != hueco.fecha:
+        return False
+    if espera.peluquero_id not in (None, hueco.peluquero_id):
+        return False
+    inicio = a_minutos(hueco.hora)
+    return a_minutos(espera.desde) <= inicio and inicio + espera.servicio.duracion_minutos <= a_minutos(espera.hasta)
+
+
+def ofrecer(espera, hueco, ahora=None):
+    """Reserva la hora del hueco para `espera` y le avisa; devuelve la cita o None si ya no se puede.
+
+    Todo en una transacción: bloquea la agenda del peluquero, vuelve a
+    comprobar el hueco para la duración del servicio pedido y marca la
+    espera como ofrecida solo si seguía esperando.
+    """
+    ahora = ahora or timezone.now()
+    duracion = espera.servicio.duracion_minutos
+    usuario = espera.usuario
+    perfil = getattr(usuario, 'perfilusuario', None)
+    inicio = timezone.make_aware(datetime.datetime.combine(hueco.fecha, hueco.hora))
+    vence = min(ahora + plazo_oferta(), inicio)
+    try:
+        with transaction.atomic():
+            bloquear_agenda(hueco.peluquero_id, hueco.fecha)
+            if not peluquero_libre(hueco.peluquero_id, hueco.fecha, hueco.hora, duracion):
+                return None
+            cita = Cita(
+                usuario=usuario, servicio=espera.servicio, peluquero_id=hueco.peluquero_id,
+                fecha=hueco.fecha, hora=hueco.hora, estado='pendiente',
+                nombre_cliente=usuario.username, correo_cliente=usuario.email,
+                telefono_cliente=(perfil.telefono if perfil else '') or '',
+            )
+            cita.full_clean()
+            cita.save()
+            if not EsperaCita.objects.filter(pk=espera.pk, estado='esperando').update(
+                estado='ofrecida', cita=cita, vence_en=vence,
+            ):
+                transaction.set_rollback(True)
+                return None
+            aviso = f"Reservada para ti hasta las {timezone.localtime(vence):%H:%M}; confírmala en tu panel."
+            notificaciones.registrar(cita, 'oferta', por='peluquero', motivo=aviso)
+    except (ValidationError, IntegrityError):
+        return None
+    espera.estado, espera.cita, espera.vence_en = 'ofrecida', cita, vence
+    return cita
+
+
+def vencer_ofertas(ahora=None):
+    """Cancela las citas retenidas cuya oferta venció; su hora vuelve a la bandeja. Devuelve cuántas"""
+    from . import lotes  # lotes importa signals, que importa este módulo
+    ahora = ahora or timezone.now()
+    # Si el cliente canceló la cita retenida, su espera termina ahí
+    EsperaCita.objects.filter(estado='ofrecida').exclude(cita__estado__in=Cita.ESTADOS_ACTIVOS).update(
+        estado='cancelada',
+    )
+    vencidas = EsperaCita.objects.filter(estado='ofrecida', vence_en__lte=ahora)
+    with transaction.atomic():
+        filas = list(vencidas.select_for_update().values_list('pk', 'cita_id'))
+        if not filas:
+            return 0
+        EsperaCita.objects.filter(pk__in=[pk for pk, _ in filas]).update(estado='vencida')
+        lotes.aplicar('cancelar', [cita_id for _, cita_id in filas if cita_id],
+                      por='peluquero', motivo="La oferta de la lista de espera venció")
+    metricas.incrementar('lista_espera', len(filas), resultado='vencida')
+    return len(filas)
+
+
+def procesar_lote(tamano=TAMANO_LOTE, ahora=None):
+    """Vence ofertas y ofrece los huecos de un lote. Devuelve (vencidas, huecos procesados, ofertas)"""
+    ahora = ahora or timezone.now()
+    vencidas = vencer_ofertas(ahora)
+    huecos = reclamar(tamano, ahora)
+    if not huecos:
+        return vencidas, 0, 0
+
+    candidatos = interesados(huecos)
+    ofertas = 0
+    for hueco in huecos:
+        local = timezone.localtime(ahora)
+        pasado = hueco.fecha < local.date() or (
+            hueco.fecha == local.date() and a_minutos(hueco.hora) < minimo_reservable(hueco.fecha)
+        )
+        if pasado:
+            continue
+        for espera in candidatos:
+            if espera.estado == 'esperando' and _calza(espera, hueco) and ofrecer(espera, hueco, ahora):
+                ofertas += 1
+                break
+
+    HuecoLiberado.objects.filter(pk__in=[h.pk for h in huecos]).update(procesado=True, lote=None)
+    metricas.incrementar('lista_espera', ofertas, resultado='ofrecida')
+    if len(huecos) > ofertas:
+        metricas.incrementar('lista_espera', len(huecos) - ofertas, resultado='sin_interesados')
+    return vencidas, len(huecos), ofertas
+
+
+# -----------------------
+#   RESPUESTA DEL CLIENTE
+# -----------------------
+
+def responder(espera, accion, ahora=None):
+    """'aceptar' o 'rechazar' una oferta, o 'salir' de la lista. Lanza ValidationError si no corresponde"""
+    from . import lotes
+    ahora = ahora or timezone.now()
+    with transaction.atomic():
+        espera = EsperaCita.objects.select_for_update().get(pk=espera.pk)
+        if accion == 'salir' and espera.estado == 'esperando':
+            espera.estado = 'cancelada'
+        elif accion in ('aceptar', 'rechazar') and espera.estado == 'ofrecida' and espera.vence_en > ahora:
+            if accion == 'aceptar':
+                espera.estado = 'aceptada'
+            else:
+                espera.estado = 'cancelada'
+                lotes.aplicar('cancelar', [espera.cita_id], por='cliente',
+                              motivo="Rechazó la oferta de la lista de espera")
+        else:
+            raise ValidationError("Esta solicitud de la lista de espera ya no está vigente.")
+        espera.save(update_fields=['estado'])
+    metricas.incrementar('lista_espera', resultado=espera.estado)
+    return espera
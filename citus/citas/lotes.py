@@ -0,0 +1,86 @@
+"""Cambios de estado de muchas citas a la vez.
+
+Una consulta trae y bloquea las citas, un solo UPDATE (o DELETE) aplica la
+transición y, como QuerySet.update() no emite señales, aquí se rehace lo
+que harían las señales de Cita: mapas de ocupación, estadísticas, avisos
+en vivo, la bandeja de notificaciones y las horas liberadas para la lista
+de espera, todo en la misma transacción.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from . import estadisticas, eventos, lista_espera, notificaciones, ocupacion
+from .models import Cita
+from .signals import resumenes_diferidos
+
+
+# Citas por operación; más que esto se hace en varias peticiones
+MAX_CITAS = 200
+
+# accion -> estado final (None = eliminar), estados de origen admitidos (None = cualquiera) y aviso
+ACCIONES = {
+    'confirmar': {'estado': 'confirmada', 'desde': ('pendiente',), 'aviso': None},
+    'completar': {'estado': 'completada', 'desde': Cita.ESTADOS_ACTIVOS, 'aviso': None},
+    'cancelar': {'estado': 'cancelada', 'desde': Cita.ESTADOS_ACTIVOS, 'aviso': 'cancelada'},
+    'eliminar': {'estado': None, 'desde': None, 'aviso': None},
+}
+
+
+def _actualizar_resumenes(citas, estado):
+    """Resúmenes de las citas (con su estado anterior) que pasan a `estado`"""
+    liberan = [c for c in citas if c.estado in Cita.ESTADOS_ACTIVOS and estado not in Cita.ESTADOS_ACTIVOS]
+    ocupacion.recalcular({(c.peluquero_id, c.fecha) for c in liberan})
+    estadisticas.recalcular_fechas({c.fecha for c in citas})
+    eventos.avisar_liberadas({c.fecha for c in liberan})
+    lista_espera.registrar_liberadas(liberan)
+
+
+def aplicar(accion, ids, peluquero=None, por=None, motivo=''):
+    """Aplica `accion` a las citas `ids` (solo las del `peluquero`, si se indica).
+
+    Devuelve un resumen {'accion', 'aplicadas', 'omitidas', 'no_encontradas'}:
+    omitidas son las que no admiten la transición desde su estado actual, no
+    encontradas las que no existen o son de otro peluquero. `por` y `motivo`
+    se usan en los avisos de cancelación, como en notificaciones.registrar.
+    """
+    regla = ACCIONES[accion]
+    ids = list(dict.fromkeys(ids))
+
+    with transaction.atomic():
+        citas = Cita.objects.filter(pk__in=ids)
+        if peluquero is not None:
+            citas = citas.filter(peluquero=peluquero)
+        if regla['aviso']:
+            # Los avisos nombran al cliente, al servicio y al peluquero
+            citas = citas.select_related('servicio', 'usuario', 'peluquero')
+        # En orden de id: bloqueos en un orden fijo y resultado estable
+        encontradas = list(citas.select_for_update(of=('self',)).order_by('pk'))
+        aplicables = [c for c in encontradas if regla['desde'] is None or c.estado in regla['desde']]
+        pks = [c.pk for c in aplicables]
+
+        if pks:
+            if regla['estado'] is None:
+                # delete() emite post_delete por cita: los resúmenes se rehacen una vez abajo
+                with resumenes_diferidos():
+                    Cita.objects.filter(pk__in=pks).delete()
+            else:
+                # update() no pasa por auto_now: la marca de modificación va a mano
+                cambios = {'estado': regla['estado'], 'actualizado_en': timezone.now()}
+                if accion == 'cancelar':
+                    cambios['motivo_cancelacion'] = motivo
+                Cita.objects.filter(pk__in=pks).update(**cambios)
+            _actualizar_resumenes(aplicables, regla['estado'])
+
+            if regla['aviso']:
+                for cita in aplicables:
+                    cita.estado = regla['estado']
+                notificaciones.registrar_lote(aplicables, regla['aviso'], por=por, motivo=motivo)
+
+    aplicadas = set(pks)
+    encontrados = {c.pk for c in encontradas}
+    return {
+        'accion': accion,
+        'aplicadas': pks,
+        'omitidas': [c.pk for c in encontradas if c.pk not in aplicadas],
+        'no_encontradas': [pk for pk in ids if pk not in encontrados],
+    }
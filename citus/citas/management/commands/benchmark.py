@@ -0,0 +1,77 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from citas.benchmark import datos, medicion
+from citas.cache_paginas import invalidar_paginas
+from citas.catalogo import invalidar_catalogo
+
+
+class Command(BaseCommand):
+    help = ("Siembra datos sintéticos en una base de prueba, mide las URL principales "
+            "(p50/p95/p99, consultas, memoria) y guarda la línea base en JSON")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--peluqueros', type=int, default=5)
+        parser.add_argument('--servicios', type=int, default=10)
+        parser.add_argument('--anios', type=float, default=1, help="Años de historial de citas")
+        parser.add_argument('--clientes', type=int, default=200)
+        parser.add_argument('--citas-por-dia', type=int, default=6, help="Citas por peluquero y día")
+        parser.add_argument('--repeticiones', type=int, default=50, help="Peticiones por escenario")
+        parser.add_argument('--escenarios', help="Lista separada por comas (por defecto, todos)")
+        parser.add_argument('--salida', default='benchmark.json', help="Archivo JSON de resultados")
+        parser.add_argument('--comparar', help="Línea base JSON contra la que comparar")
+        parser.add_argument('--tolerancia', type=float, default=20, help="Margen de p95 en %% antes de marcar regresión")
+
+    def handle(self, *args, **options):
+        parametros = {
+            campo: options[campo]
+            for campo in ('peluqueros', 'servicios', 'anios', 'clientes', 'citas_por_dia', 'repeticiones')
+        }
+        solo = options['escenarios'].split(',') if options['escenarios'] else None
+
+        # Base de prueba desechable: nunca se siembra sobre la base real
+        nombre_original = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write("Sembrando datos...")
+            sembrados = datos.sembrar(
+                peluqueros=options['peluqueros'], servicios=options['servicios'], anios=options['anios'],
+                clientes=options['clientes'], citas_por_dia=options['citas_por_dia'],
+            )
+            invalidar_paginas()
+            resultados = medicion.medir(sembrados, repeticiones=options['repeticiones'], solo=solo)
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+            teardown_test_environment()
+            # La caché pudo quedar con el catálogo de la base de prueba
+            invalidar_catalogo()
+            invalidar_paginas()
+
+        self.stdout.write(f"{'escenario':<14}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'consultas':>11}{'memoria KB':>12}")
+        for nombre, r in resultados.items():
+            self.stdout.write(
+                f"{nombre:<14}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['consultas']:>11}{r['memoria_kb']:>12}"
+            )
+
+        with open(options['salida'], 'w', encoding='utf-8') as f:
+            json.dump({
+                'generado': timezone.now().isoformat(),
+                'parametros': parametros,
+                'resultados': resultados,
+            }, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['salida']}"))
+
+        if options['comparar']:
+            with open(options['comparar'], encoding='utf-8') as f:
+                base = json.load(f)
+            if base.get('parametros') != parametros:
+                self.stderr.write("Aviso: la línea base se midió con otros parámetros")
+            regresiones = medicion.comparar(base['resultados'], resultados, options['tolerancia'])
+            if regresiones:
+                raise CommandError("Regresiones respecto de la línea base:\n" + "\n".join(regresiones))
+            self.stdout.write(self.style.SUCCESS("Sin regresiones respecto de la línea base"))
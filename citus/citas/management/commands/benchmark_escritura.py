@@ -0,0 +1,74 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from citas.benchmark import datos, escritura
+from citas.cache_paginas import invalidar_paginas
+from citas.catalogo import invalidar_catalogo
+
+
+# Modos de SQLite que se pueden comparar: (journal_mode, synchronous)
+MODOS_SQLITE = {
+    'delete': ('DELETE', 'FULL'),  # valores por defecto de SQLite
+    'wal': ('WAL', 'NORMAL'),
+}
+
+
+class Command(BaseCommand):
+    help = ("Mide reservas por segundo del flujo de /agendar/ con varios clientes simultáneos "
+            "y compara los modos de la base (SQLite DELETE/WAL o la configuración de PostgreSQL)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modos', help="Modos SQLite separados por comas (delete,wal); "
+                                            "con PostgreSQL se mide la configuración actual")
+        parser.add_argument('--reservas', type=int, default=400)
+        parser.add_argument('--hilos', type=int, default=8)
+        parser.add_argument('--peluqueros', type=int, default=5)
+        parser.add_argument('--salida', default='benchmark_escritura.json')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            modos = (options['modos'] or 'delete,wal').split(',')
+            desconocidos = set(modos) - set(MODOS_SQLITE)
+            if desconocidos:
+                raise CommandError(f"Modos desconocidos: {', '.join(sorted(desconocidos))}")
+        else:
+            modos = [connection.vendor]
+
+        resultados = {}
+        setup_test_environment()
+        try:
+            for modo in modos:
+                # Bajo carga casi todas las reservas superan el umbral de lentitud
+                ajustes = {'CITAS_PERFILADO_LENTO_MS': float('inf')}
+                if modo in MODOS_SQLITE:
+                    ajustes.update(zip(('CITAS_SQLITE_DIARIO', 'CITAS_SQLITE_SINCRONICO'), MODOS_SQLITE[modo]))
+                with override_settings(**ajustes):
+                    resultados[modo] = self.medir_modo(options)
+                r = resultados[modo]
+                self.stdout.write(
+                    f"{modo:<12}{r['reservas_por_segundo']:>8} reservas/s  p50 {r['p50_ms']} ms  "
+                    f"p95 {r['p95_ms']} ms  errores {r['errores']}"
+                )
+        finally:
+            teardown_test_environment()
+            invalidar_catalogo()
+            invalidar_paginas()
+
+        with open(options['salida'], 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['salida']}"))
+
+    def medir_modo(self, options):
+        # Base nueva por modo: journal_mode queda grabado en el archivo
+        nombre_original = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            sembrados = datos.sembrar(peluqueros=options['peluqueros'], servicios=3, anios=0.1, clientes=20)
+            invalidar_paginas()
+            connection.close()
+            return escritura.medir_reservas(sembrados, reservas=options['reservas'], hilos=options['hilos'])
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
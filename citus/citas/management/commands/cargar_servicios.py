@@ -0,0 +1,104 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from citas.catalogo import invalidar_catalogo
+from citas.models import PerfilUsuario, ServicioCorte
+from citas.signals import propagar_servicio
+
+
+SERVICIOS = [
+    # Cortes clásicos y modernos
+    {"nombre": "Corte Clasico", "precio": 10000, "duracion_minutos": 30},
+    {"nombre": "Corte Fade", "precio": 12000, "duracion_minutos": 40},
+    {"nombre": "Corte Low Fade", "precio": 12000, "duracion_minutos": 35},
+    {"nombre": "Corte Mid Fade", "precio": 12000, "duracion_minutos": 35},
+    {"nombre": "Corte High Fade", "precio": 13000, "duracion_minutos": 40},
+    {"nombre": "Corte Razor Fade", "precio": 14000, "duracion_minutos": 45},
+    {"nombre": "Corte Militar", "precio": 9000, "duracion_minutos": 30},
+    {"nombre": "Corte Buzz", "precio": 8000, "duracion_minutos": 30},
+    {"nombre": "Corte Pompadour", "precio": 14000, "duracion_minutos": 45},
+    {"nombre": "Corte Undercut", "precio": 14000, "duracion_minutos": 45},
+    {"nombre": "Corte Peaky Blinders", "precio": 15000, "duracion_minutos": 50},
+    {"nombre": "Corte Crop Texturizado", "precio": 13000, "duracion_minutos": 40},
+    {"nombre": "Corte Spiky Moderno", "precio": 13000, "duracion_minutos": 40},
+    {"nombre": "Corte Taper Fade", "precio": 13000, "duracion_minutos": 40},
+
+    # Barba y afeitado
+    {"nombre": "Perfilado de Barba", "precio": 9000, "duracion_minutos": 30},
+    {"nombre": "Afeitado Clasico", "precio": 10000, "duracion_minutos": 30},
+    {"nombre": "Arreglo Completo de Barba", "precio": 12000, "duracion_minutos": 40},
+    {"nombre": "Diseno de Barba", "precio": 11000, "duracion_minutos": 35},
+    {"nombre": "Afeitado Premium", "precio": 15000, "duracion_minutos": 45},
+
+    # Combos populares
+    {"nombre": "Corte + Barba", "precio": 18000, "duracion_minutos": 60},
+    {"nombre": "Corte + Afeitado Clasico", "precio": 19000, "duracion_minutos": 60},
+    {"nombre": "Corte + Diseno de Barba", "precio": 20000, "duracion_minutos": 60},
+    {"nombre": "Corte + Afeitado Premium", "precio": 21000, "duracion_minutos": 60},
+]
+
+# Campos que se sincronizan en servicios existentes (activo lo decide el admin)
+CAMPOS = ('precio', 'duracion_minutos')
+
+
+class Command(BaseCommand):
+    help = "Crea o actualiza los servicios base y el peluquero por defecto (se puede correr varias veces)"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.cargar_peluquero()
+            creados, actualizados = self.cargar_servicios()
+        self.stdout.write(self.style.SUCCESS(
+            f"Servicios creados: {creados}, actualizados: {actualizados}, sin cambios: "
+            f"{len(SERVICIOS) - creados - actualizados}"
+        ))
+
+    def cargar_peluquero(self):
+        peluquero, creado = User.objects.get_or_create(
+            username="admin_barber",
+            defaults={
+                "first_name": "Administrador",
+                "last_name": "Barber",
+                "email": "adminbarber@example.com",
+                "is_staff": True,
+                "is_active": True,
+            },
+        )
+        if creado:
+            peluquero.set_password("barber123")
+            peluquero.save()
+            self.stdout.write("Usuario 'admin_barber' creado (contraseña: barber123)")
+        PerfilUsuario.objects.update_or_create(
+            usuario=peluquero, defaults={"es_peluquero": True},
+            create_defaults={"telefono": "999999999", "es_peluquero": True},
+        )
+
+    def cargar_servicios(self):
+        """Upsert en bloque: una lectura, un bulk_create y un bulk_update.
+
+        Los servicios cambiados pasan después por la misma propagación que
+        post_save (hora_fin, ocupación y minutos de sus citas).
+        """
+        existentes = {s.nombre: s for s in ServicioCorte.objects.filter(nombre__in=[s["nombre"] for s in SERVICIOS])}
+        nuevos, cambiados = [], []
+        for datos in SERVICIOS:
+            valores = {campo: datos[campo] for campo in CAMPOS}
+            servicio = existentes.get(datos["nombre"])
+            if servicio is None:
+                nuevos.append(ServicioCorte(nombre=datos["nombre"], descripcion="", activo=True, **valores))
+            elif any(getattr(servicio, campo) != valor for campo, valor in valores.items()):
+                anterior = servicio.duracion_minutos
+                for campo, valor in valores.items():
+                    setattr(servicio, campo, valor)
+                cambiados.append((servicio, anterior))
+
+        ServicioCorte.objects.bulk_create(nuevos)
+        ServicioCorte.objects.bulk_update([servicio for servicio, _ in cambiados], CAMPOS)
+        # Las operaciones en bloque no emiten señales: el catálogo y lo que depende
+        # de la duración o el precio se actualizan a mano
+        if nuevos or cambiados:
+            invalidar_catalogo()
+        for servicio, duracion in cambiados:
+            propagar_servicio(servicio, duracion)
+        return len(nuevos), len(cambiados)
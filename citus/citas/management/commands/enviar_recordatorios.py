@@ -0,0 +1,25 @@
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from citas import recordatorios
+
+
+class Command(BaseCommand):
+    help = "Envía el recordatorio de las citas que empiezan dentro de las próximas horas"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horas', type=int, default=recordatorios.HORAS_ANTICIPACION,
+                            help="Anticipación del recordatorio en horas")
+        parser.add_argument('--lote', type=int, default=recordatorios.TAMANO_LOTE,
+                            help="Citas reclamadas y enviadas por lote")
+
+    def handle(self, *args, **options):
+        enviados = 0
+        # Una sola conexión SMTP para todos los lotes de la ejecución
+        with get_connection() as conexion:
+            while True:
+                lote, pks = recordatorios.reclamar_lote(horas=options['horas'], tamano=options['lote'])
+                if lote is None:
+                    break
+                enviados += recordatorios.enviar_lote(lote, pks, conexion)
+        self.stdout.write(self.style.SUCCESS(f"Recordatorios procesados: {enviados}"))
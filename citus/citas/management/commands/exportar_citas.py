@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from citas import intercambio
+from citas.models import Cita
+
+
+class Command(BaseCommand):
+    help = "Exporta las citas a CSV o JSONL leyendo la tabla por trozos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formato', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--salida', default='-', help="Archivo de salida ('-' para la salida estándar)")
+        parser.add_argument('--desde', help="Fecha inicial (YYYY-MM-DD)")
+        parser.add_argument('--hasta', help="Fecha final (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        citas = Cita.objects.all()
+        if options['desde']:
+            citas = citas.filter(fecha__gte=options['desde'])
+        if options['hasta']:
+            citas = citas.filter(fecha__lte=options['hasta'])
+
+        filas = intercambio.filas_exportacion(citas)
+        if options['salida'] == '-':
+            total = intercambio.escribir(filas, self.stdout, options['formato'])
+        else:
+            with open(options['salida'], 'w', encoding='utf-8', newline='') as salida:
+                total = intercambio.escribir(filas, salida, options['formato'])
+        self.stderr.write(self.style.SUCCESS(f"Citas exportadas: {total}"))
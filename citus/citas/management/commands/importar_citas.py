@@ -0,0 +1,58 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from citas import intercambio
+
+
+class Command(BaseCommand):
+    help = "Importa citas desde un archivo CSV o JSONL por lotes, con punto de control para reanudar"
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help="Archivo .csv o .jsonl")
+        parser.add_argument('--formato', choices=['csv', 'jsonl'],
+                            help="Formato del archivo (por defecto, según la extensión)")
+        parser.add_argument('--lote', type=int, default=intercambio.TAMANO_LOTE,
+                            help="Registros por transacción")
+        parser.add_argument('--checkpoint', help="Archivo del punto de control (por defecto <archivo>.checkpoint)")
+        parser.add_argument('--desde-cero', action='store_true',
+                            help="Ignorar el punto de control y empezar desde el primer registro")
+        parser.add_argument('--max-errores', type=int, default=20,
+                            help="Errores que se muestran por lote")
+
+    def handle(self, *args, **options):
+        archivo = options['archivo']
+        if not os.path.exists(archivo):
+            raise CommandError(f"No existe el archivo {archivo}")
+        formato = options['formato'] or ('csv' if archivo.endswith('.csv') else 'jsonl')
+        checkpoint = options['checkpoint'] or f"{archivo}.checkpoint"
+
+        saltar = 0
+        if os.path.exists(checkpoint) and not options['desde_cero']:
+            with open(checkpoint, encoding='utf-8') as f:
+                saltar = json.load(f)['registros']
+            self.stdout.write(f"Reanudando después del registro {saltar}")
+
+        importador = intercambio.Importador(batch_size=options['lote'])
+        creadas = conflictos = duplicadas = errores = 0
+        with open(archivo, encoding='utf-8', newline='') as f:
+            registros = intercambio.leer_registros(f, formato)
+            for ultimo, lote in intercambio.en_lotes(registros, options['lote'], saltar):
+                nuevas, choques, repetidas, fallas = importador.importar_lote(lote, ultimo - len(lote) + 1)
+                creadas, conflictos, duplicadas = creadas + nuevas, conflictos + choques, duplicadas + repetidas
+                errores += len(fallas) - choques
+                for numero, motivo in fallas[:options['max_errores']]:
+                    self.stderr.write(f"Registro {numero}: {motivo}")
+
+                # El punto de control se escribe después de confirmar el lote; si el
+                # proceso cae entre ambos, al reanudar el lote se omite como duplicado
+                with open(checkpoint, 'w', encoding='utf-8') as c:
+                    json.dump({'registros': ultimo}, c)
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f"Citas creadas: {creadas}, ya importadas: {duplicadas}, conflictos: {conflictos}, "
+            f"registros inválidos: {errores}"
+        ))
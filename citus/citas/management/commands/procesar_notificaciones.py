@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from citas import lista_espera, notificaciones
+
+
+class Command(BaseCommand):
+    help = ("Envía los avisos pendientes de la bandeja de salida (EventoNotificacion) y ofrece "
+            "a la lista de espera las horas liberadas por cancelaciones")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=notificaciones.TAMANO_LOTE,
+                            help="Eventos tomados por vuelta")
+        parser.add_argument('--concurrencia', type=int, default=4,
+                            help="Conexiones de correo simultáneas")
+        parser.add_argument('--max-intentos', type=int, default=notificaciones.MAX_INTENTOS,
+                            help="Intentos antes de marcar un aviso como fallido")
+        parser.add_argument('--continuo', action='store_true',
+                            help="Seguir esperando avisos nuevos en vez de terminar")
+        parser.add_argument('--intervalo', type=float, default=5,
+                            help="Segundos de espera cuando la bandeja está vacía (con --continuo)")
+
+    def handle(self, *args, **options):
+        enviados = fallidos = ofertas = 0
+        while True:
+            # Primero la lista de espera: sus ofertas se envían en la misma vuelta
+            vencidas, huecos, ofrecidas = lista_espera.procesar_lote(tamano=options['lote'])
+            ofertas += ofrecidas
+            ok, error = notificaciones.procesar_lote(
+                tamano=options['lote'],
+                concurrencia=max(1, options['concurrencia']),
+                max_intentos=options['max_intentos'],
+            )
+            enviados, fallidos = enviados + ok, fallidos + error
+            if ok or error or vencidas or huecos:
+                continue
+            if not options['continuo']:
+                break
+            time.sleep(options['intervalo'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Avisos enviados: {enviados}, con error: {fallidos}, horas ofrecidas a la lista de espera: {ofertas}"
+        ))
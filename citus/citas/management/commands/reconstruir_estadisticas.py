@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from citas import estadisticas
+from citas.models import Cita, EstadisticaDiaria
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el resumen diario de citas (EstadisticaDiaria) desde la tabla de citas"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help="Fecha inicial (YYYY-MM-DD)")
+        parser.add_argument('--hasta', help="Fecha final (YYYY-MM-DD)")
+        parser.add_argument('--lote', type=int, default=31, help="Días por transacción")
+
+    def handle(self, *args, **options):
+        filtro = {}
+        if options['desde']:
+            filtro['fecha__gte'] = options['desde']
+        if options['hasta']:
+            filtro['fecha__lte'] = options['hasta']
+
+        fechas = set(Cita.objects.filter(**filtro).order_by().values_list('fecha', flat=True).distinct())
+        fechas.update(EstadisticaDiaria.objects.filter(**filtro).values_list('fecha', flat=True).distinct())
+        fechas = sorted(fechas)
+        for i in range(0, len(fechas), options['lote']):
+            estadisticas.recalcular_fechas(fechas[i:i + options['lote']])
+        self.stdout.write(self.style.SUCCESS(f"Días recalculados: {len(fechas)}"))
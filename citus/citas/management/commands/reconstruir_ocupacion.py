@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from citas import ocupacion
+from citas.models import Cita, OcupacionDiaria
+
+
+class Command(BaseCommand):
+    help = "Reconstruye los mapas de ocupación por peluquero y día a partir de las citas"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help="Fecha inicial (YYYY-MM-DD)")
+        parser.add_argument('--hasta', help="Fecha final (YYYY-MM-DD)")
+        parser.add_argument('--lote', type=int, default=500, help="Días de peluquero por lote")
+
+    def handle(self, *args, **options):
+        filtro = {}
+        if options['desde']:
+            filtro['fecha__gte'] = options['desde']
+        if options['hasta']:
+            filtro['fecha__lte'] = options['hasta']
+
+        claves = set(Cita.objects.filter(**filtro).values_list('peluquero_id', 'fecha').distinct().order_by())
+        claves.update(OcupacionDiaria.objects.filter(**filtro).values_list('peluquero_id', 'fecha'))
+
+        claves = sorted(claves, key=lambda c: (c[1], c[0] or 0))
+        for i in range(0, len(claves), options['lote']):
+            ocupacion.recalcular(claves[i:i + options['lote']])
+        self.stdout.write(self.style.SUCCESS(f"Mapas recalculados: {len(claves)}"))
@@ -0,0 +1,171 @@
+"""Contadores e histogramas del proceso, exportables en formato de texto de Prometheus.
+
+Cada hilo escribe en su propia porción (sin locks en el camino caliente);
+la exportación suma las porciones al momento de la lectura. Cuando un hilo
+termina, su porción se suma a un total común y se descarta, así los hilos que
+crea y destruye el servidor no acumulan porciones. Los valores son
+por proceso: con varios workers, Prometheus agrega al consultar cada uno.
+"""
+import threading
+import weakref
+from bisect import bisect_left
+from collections import defaultdict
+
+
+PREFIJO = 'citus_'
+
+# Límites superiores de los histogramas (además de +Inf)
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LIMITES_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+AYUDA = {
+    'peticion_segundos': "Duración de las peticiones por nombre de URL",
+    'peticion_consultas': "Consultas SQL por petición y nombre de URL",
+    'embudo_reserva': "Embudo de reservas: disponibilidad, envío, reservada, inválida, conflicto",
+    'asignaciones': "Resultado de la asignación automática de peluquero",
+    'cache_pagina_aciertos': "Páginas servidas desde la caché",
+    'cache_pagina_fallos': "Páginas renderizadas por no estar en caché",
+    'cache_catalogo_aciertos': "Lecturas del catálogo servidas desde la caché",
+    'cache_catalogo_fallos': "Lecturas del catálogo que fueron a la base",
+    'cache_horario_aciertos': "Días de horario de peluquero servidos desde la caché",
+    'cache_horario_fallos': "Días de horario de peluquero compilados desde sus reglas",
+    'recordatorios_enviados': "Recordatorios de cita procesados",
+    'notificaciones_enviadas': "Avisos de la bandeja de salida enviados",
+    'notificaciones_fallidas': "Intentos fallidos de envío de avisos",
+    'eventos_huecos': "Avisos de horas ocupadas o liberadas publicados a los navegadores",
+    'lista_espera': "Lista de espera: horas ofrecidas, aceptadas, rechazadas, vencidas y sin interesados",
+}
+
+
+class _Dueno:
+    """Vive mientras viva el hilo (solo lo referencia su threading.local)"""
+    __slots__ = ('__weakref__',)
+
+
+class _Porcion(threading.local):
+    """Valores escritos por un hilo; se registra en _porciones la primera vez que se usa"""
+
+    def __init__(self):
+        self.contadores = defaultdict(float)
+        # clave -> [cuentas por límite..., +Inf, suma]
+        self.histogramas = {}
+        self.dueno = _Dueno()
+        with _registro_lock:
+            _porciones[id(self.dueno)] = (self.contadores, self.histogramas)
+        weakref.finalize(self.dueno, _jubilar, id(self.dueno))
+
+
+def _acumular(contadores, histogramas, sus_contadores, sus_histogramas):
+    # dict() copia de una vez bajo el GIL aunque el hilo dueño siga escribiendo
+    for clave, valor in dict(sus_contadores).items():
+        contadores[clave] += valor
+    for clave, cubetas in dict(sus_histogramas).items():
+        total = histogramas.setdefault(clave, [0] * len(cubetas))
+        for i, cuenta in enumerate(list(cubetas)):
+            total[i] += cuenta
+
+
+def _jubilar(clave):
+    """Al terminar un hilo, suma su porción a los totales comunes y la descarta"""
+    with _registro_lock:
+        _acumular(*_terminados, *_porciones.pop(clave))
+
+
+_registro_lock = threading.Lock()
+# id del dueño -> (contadores, histogramas) de cada hilo vivo
+_porciones = {}
+# Lo que escribieron los hilos que ya terminaron
+_terminados = (defaultdict(float), {})
+_local = _Porcion()
+_limites = {}
+
+
+def _clave(nombre, etiquetas):
+    return (nombre, tuple(sorted(etiquetas.items())))
+
+
+def incrementar(nombre, valor=1, **etiquetas):
+    _local.contadores[_clave(nombre, etiquetas)] += valor
+
+
+def observar(nombre, valor, limites=LIMITES_SEGUNDOS, **etiquetas):
+    """Registra `valor` en el histograma `nombre`"""
+    clave = _clave(nombre, etiquetas)
+    _limites.setdefault(nombre, limites)
+    cubetas = _local.histogramas.get(clave)
+    if cubetas is None:
+        cubetas = _local.histogramas[clave] = [0] * (len(limites) + 2)
+    cubetas[bisect_left(limites, valor)] += 1
+    cubetas[-1] += valor
+
+
+# -----------------------
+#   LECTURA
+# -----------------------
+
+def _sumar():
+    contadores, histogramas = defaultdict(float), {}
+    with _registro_lock:
+        # Bajo el lock: una porción no puede estar a la vez viva y en los totales
+        _acumular(contadores, histogramas, *_terminados)
+        porciones = list(_porciones.values())
+    for sus_contadores, sus_histogramas in porciones:
+        _acumular(contadores, histogramas, sus_contadores, sus_histogramas)
+    return contadores, histogramas
+
+
+def contadores():
+    """{nombre: total} de cada contador, sumando todas sus etiquetas"""
+    totales = defaultdict(float)
+    for (nombre, _), valor in _sumar()[0].items():
+        totales[nombre] += valor
+    return {nombre: int(valor) if valor == int(valor) else valor for nombre, valor in totales.items()}
+
+
+def _etiquetas(pares):
+    if not pares:
+        return ''
+    texto = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in pares
+    )
+    return '{' + texto + '}'
+
+
+def _numero(valor):
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+def exportar():
+    """Todos los valores en formato de texto de Prometheus (version 0.0.4)"""
+    contadores_, histogramas = _sumar()
+    lineas = []
+
+    por_nombre = defaultdict(list)
+    for (nombre, pares), valor in contadores_.items():
+        por_nombre[nombre].append((pares, valor))
+    for nombre in sorted(por_nombre):
+        metrica = f"{PREFIJO}{nombre}_total"
+        if nombre in AYUDA:
+            lineas.append(f"# HELP {metrica} {AYUDA[nombre]}")
+        lineas.append(f"# TYPE {metrica} counter")
+        for pares, valor in sorted(por_nombre[nombre]):
+            lineas.append(f"{metrica}{_etiquetas(pares)} {_numero(valor)}")
+
+    por_nombre = defaultdict(list)
+    for (nombre, pares), cubetas in histogramas.items():
+        por_nombre[nombre].append((pares, cubetas))
+    for nombre in sorted(por_nombre):
+        metrica = f"{PREFIJO}{nombre}"
+        if nombre in AYUDA:
+            lineas.append(f"# HELP {metrica} {AYUDA[nombre]}")
+        lineas.append(f"# TYPE {metrica} histogram")
+        limites = [_numero(l) for l in _limites[nombre]] + ['+Inf']
+        for pares, cubetas in sorted(por_nombre[nombre]):
+            acumulado = 0
+            for limite, cuenta in zip(limites, cubetas):
+                acumulado += cuenta
+                lineas.append(f"{metrica}_bucket{_etiquetas(pares + (('le', limite),))} {acumulado}")
+            lineas.append(f"{metrica}_sum{_etiquetas(pares)} {_numero(cubetas[-1])}")
+            lineas.append(f"{metrica}_count{_etiquetas(pares)} {acumulado}")
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def poblar_ocupacion(apps, schema_editor):
+    Cita = apps.get_model('citas', 'Cita')
+    OcupacionDiaria = apps.get_model('citas', 'OcupacionDiaria')
+    mapas = {}
+    citas = Cita.objects.filter(estado__in=['pendiente', 'confirmada']).values_list(
+        'peluquero_id', 'fecha', 'hora', 'servicio__duracion_minutos'
+    )
+    for peluquero_id, fecha, hora, duracion in citas.iterator():
+        inicio = (hora.hour * 60 + hora.minute) // 5
+        fin = min(-(-(hora.hour * 60 + hora.minute + duracion) // 5), 288)
+        clave = (peluquero_id, fecha)
+        mapas[clave] = mapas.get(clave, 0) | (((1 << (fin - inicio)) - 1) << inicio)
+    OcupacionDiaria.objects.bulk_create(
+        [OcupacionDiaria(peluquero_id=p, fecha=f, mapa=m.to_bytes(36, 'little')) for (p, f), m in mapas.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0005_cita_motivo_cancelacion_cita_motivo_reagendamiento'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcupacionDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('mapa', models.BinaryField(default=b'')),
+                ('peluquero', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ocupaciones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('peluquero', 'fecha')},
+            },
+        ),
+        migrations.RunPython(poblar_ocupacion, migrations.RunPython.noop),
+    ]
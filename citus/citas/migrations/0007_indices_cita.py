@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0006_ocupaciondiaria'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='cita',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['peluquero', 'fecha', 'hora'], name='cita_peluquero_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['usuario', 'fecha', 'hora'], name='cita_usuario_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(condition=models.Q(('estado__in', ('pendiente', 'confirmada'))), fields=['fecha', 'peluquero', 'hora'], name='cita_activa_fecha_idx'),
+        ),
+    ]
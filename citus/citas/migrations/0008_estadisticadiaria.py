@@ -0,0 +1,51 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def poblar_estadisticas(apps, schema_editor):
+    Cita = apps.get_model('citas', 'Cita')
+    EstadisticaDiaria = apps.get_model('citas', 'EstadisticaDiaria')
+    grupos = (
+        Cita.objects.order_by()
+        .values('fecha', 'peluquero_id', 'servicio_id', 'estado')
+        .annotate(
+            total=models.Count('id'),
+            ingresos=models.Sum('servicio__precio'),
+            minutos=models.Sum('servicio__duracion_minutos'),
+        )
+    )
+    EstadisticaDiaria.objects.bulk_create(
+        (EstadisticaDiaria(**g) for g in grupos.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0007_indices_cita'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadisticaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('confirmada', 'Confirmada'), ('completada', 'Completada'), ('cancelada', 'Cancelada')], max_length=20)),
+                ('total', models.IntegerField(default=0)),
+                ('ingresos', models.DecimalField(decimal_places=0, default=0, max_digits=12)),
+                ('minutos', models.IntegerField(default=0)),
+                ('peluquero', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='estadisticas', to=settings.AUTH_USER_MODEL)),
+                ('servicio', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='citas.serviciocorte')),
+            ],
+            options={
+                'unique_together': {('fecha', 'peluquero', 'servicio', 'estado')},
+            },
+        ),
+        migrations.RunPython(poblar_estadisticas, migrations.RunPython.noop),
+    ]
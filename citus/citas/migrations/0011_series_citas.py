@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0010_eventonotificacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SerieCita',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hora', models.TimeField()),
+                ('fecha_inicio', models.DateField()),
+                ('intervalo_semanas', models.PositiveSmallIntegerField(choices=[(1, 'Cada semana'), (2, 'Cada dos semanas'), (3, 'Cada tres semanas'), (4, 'Cada cuatro semanas')], default=2)),
+                ('hasta', models.DateField(blank=True, help_text='Última fecha posible (vacío = horizonte por defecto)', null=True)),
+                ('estado', models.CharField(choices=[('activa', 'Activa'), ('cancelada', 'Cancelada')], default='activa', max_length=20)),
+                ('notas', models.TextField(blank=True, null=True)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('peluquero', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='series_asignadas', to=settings.AUTH_USER_MODEL)),
+                ('servicio', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='citas.serviciocorte')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='cita',
+            name='serie',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='citas', to='citas.seriecita'),
+        ),
+    ]
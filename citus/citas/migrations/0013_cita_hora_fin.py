@@ -0,0 +1,69 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:02
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+RESTRICCION = 'cita_sin_solapes_excl'
+
+
+TAMANO_LOTE = 1000
+
+
+def poblar_hora_fin(apps, schema_editor):
+    Cita = apps.get_model('citas', 'Cita')
+    citas = Cita.objects.select_related('servicio').only('hora', 'servicio__duracion_minutos')
+    pendientes = []
+    for cita in citas.iterator(chunk_size=TAMANO_LOTE):
+        fin = datetime.datetime.combine(datetime.date.min, cita.hora) + datetime.timedelta(
+            minutes=cita.servicio.duracion_minutos
+        )
+        cita.hora_fin = fin.time() if fin.date() == datetime.date.min else datetime.time.max
+        pendientes.append(cita)
+        if len(pendientes) == TAMANO_LOTE:
+            Cita.objects.bulk_update(pendientes, ['hora_fin'])
+            pendientes = []
+    if pendientes:
+        Cita.objects.bulk_update(pendientes, ['hora_fin'])
+
+
+def _aplica(schema_editor):
+    return schema_editor.connection.vendor == 'postgresql' and getattr(settings, 'CITAS_RESTRICCION_SOLAPES', True)
+
+
+def crear_restriccion(apps, schema_editor):
+    if not _aplica(schema_editor):
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    schema_editor.execute(
+        f"""
+        ALTER TABLE citas_cita ADD CONSTRAINT {RESTRICCION} EXCLUDE USING gist (
+            peluquero_id WITH =,
+            tsrange(fecha + hora, fecha + hora_fin) WITH &&
+        ) WHERE (estado IN ('pendiente', 'confirmada') AND peluquero_id IS NOT NULL AND hora_fin IS NOT NULL)
+        """
+    )
+
+
+def quitar_restriccion(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'ALTER TABLE citas_cita DROP CONSTRAINT IF EXISTS {RESTRICCION}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0012_horarios'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cita',
+            name='hora_fin',
+            field=models.TimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(poblar_hora_fin, migrations.RunPython.noop),
+        migrations.RunPython(crear_restriccion, quitar_restriccion),
+    ]
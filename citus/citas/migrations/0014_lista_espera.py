@@ -0,0 +1,101 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0013_cita_hora_fin'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EsperaCita',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('desde', models.TimeField()),
+                ('hasta', models.TimeField()),
+                ('estado', models.CharField(choices=[('esperando', 'Esperando'), ('ofrecida', 'Horario ofrecido'), ('aceptada', 'Aceptada'), ('vencida', 'Oferta vencida'), ('cancelada', 'Cancelada')], default='esperando', max_length=20)),
+                ('vence_en', models.DateTimeField(blank=True, null=True)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Cliente en espera',
+                'verbose_name_plural': 'Lista de espera',
+                'ordering': ['creado_en', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='HuecoLiberado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('hora', models.TimeField()),
+                ('procesado', models.BooleanField(default=False)),
+                ('lote', models.CharField(blank=True, max_length=32, null=True)),
+                ('disponible_en', models.DateTimeField(default=django.utils.timezone.now)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        # Antes de quitar la clave única: es el único índice completo que empieza por fecha
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['fecha', 'hora', 'id'], name='cita_fecha_hora_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='cita',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='eventonotificacion',
+            name='tipo',
+            field=models.CharField(choices=[('reservada', 'Cita reservada'), ('cancelada', 'Cita cancelada'), ('reagendada', 'Cita reagendada'), ('oferta', 'Horario ofrecido de la lista de espera')], max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name='cita',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado__in', ('pendiente', 'confirmada'))), fields=('fecha', 'hora', 'peluquero'), name='cita_activa_unica', violation_error_message='El peluquero ya tiene una cita a esa hora.'),
+        ),
+        migrations.AddField(
+            model_name='esperacita',
+            name='cita',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='espera', to='citas.cita'),
+        ),
+        migrations.AddField(
+            model_name='esperacita',
+            name='peluquero',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='esperas_asignadas', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='esperacita',
+            name='servicio',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='citas.serviciocorte'),
+        ),
+        migrations.AddField(
+            model_name='esperacita',
+            name='usuario',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='esperas', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='huecoliberado',
+            name='peluquero',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='huecos_liberados', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='esperacita',
+            index=models.Index(condition=models.Q(('estado', 'esperando')), fields=['fecha', 'desde', 'hasta'], name='espera_fecha_ventana_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='esperacita',
+            index=models.Index(fields=['estado', 'vence_en'], name='espera_oferta_vence_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='huecoliberado',
+            index=models.Index(condition=models.Q(('procesado', False)), fields=['disponible_en'], name='hueco_pendiente_idx'),
+        ),
+    ]
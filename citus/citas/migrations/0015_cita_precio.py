@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+def poblar_precio(apps, schema_editor):
+    # Las citas existentes quedan con el precio actual de su servicio: el mismo
+    # con que ya estaban calculadas las estadísticas
+    Cita = apps.get_model('citas', 'Cita')
+    ServicioCorte = apps.get_model('citas', 'ServicioCorte')
+    Cita.objects.update(
+        precio=models.Subquery(ServicioCorte.objects.filter(pk=models.OuterRef('servicio_id')).values('precio')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0014_lista_espera'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cita',
+            name='precio',
+            field=models.DecimalField(blank=True, decimal_places=0, editable=False, max_digits=10, null=True),
+        ),
+        migrations.RunPython(poblar_precio, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 22:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0015_cita_precio'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='cita',
+            options={'ordering': ['-fecha', '-hora']},
+        ),
+    ]
@@ -25,6 +25,16 @@ class ServicioCorte(models.Model):
         return f"{self.nombre} - ${self.precio}"
 
 
+# Estados que ocupan la agenda del peluquero
+ESTADOS_ACTIVOS = ('pendiente', 'confirmada')
+
+# Anticipación mínima para que el cliente cancele su cita
+PLAZO_CANCELACION = datetime.timedelta(hours=2)
+
+# Marcas del despachador de recordatorios (se limpian al mover la cita)
+CAMPOS_RECORDATORIO = ('recordatorio_lote', 'recordatorio_reclamado_en', 'recordatorio_enviado_en')
+
+
 class Cita(models.Model):
     ESTADOS = [
         ('pendiente', 'Pendiente'),
@@ -32,6 +42,7 @@ class Cita(models.Model):
         ('completada', 'Completada'),
         ('cancelada', 'Cancelada'),
     ]
+    ESTADOS_ACTIVOS = ESTADOS_ACTIVOS
 
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='citas')
     servicio = models.ForeignKey(ServicioCorte, on_delete=models.PROTECT)
@@ -47,22 +58,105 @@ class Cita(models.Model):
 
     peluquero = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='citas_asignadas')
     notas = models.TextField(blank=True, null=True)
+    # Serie recurrente que generó la cita (None = reserva suelta)
+    serie = models.ForeignKey('SerieCita', on_delete=models.SET_NULL, null=True, blank=True, related_name='citas')
 
     creado_en = models.DateTimeField(auto_now_add=True)
     actualizado_en = models.DateTimeField(auto_now=True)
     motivo_cancelacion = models.TextField(blank=True, null=True)
     motivo_reagendamiento = models.TextField(blank=True, null=True)
 
+    # Recordatorio 24 horas antes: lote que lo reclamó y momento del envío
+    recordatorio_lote = models.CharField(max_length=32, blank=True, null=True, editable=False)
+    recordatorio_reclamado_en = models.DateTimeField(blank=True, null=True, editable=False)
+    recordatorio_enviado_en = models.DateTimeField(blank=True, null=True, editable=False)
+
+    # Fin según la duración del servicio; respalda la restricción de solapes en PostgreSQL
+    hora_fin = models.TimeField(blank=True, null=True, editable=False)
+    # Precio del servicio al reservar: un cambio posterior del catálogo no altera lo ya cobrado
+    precio = models.DecimalField(max_digits=10, decimal_places=0, blank=True, null=True, editable=False)
 
     class Meta:
+        # Por defecto las más recientes primero; las consultas frecuentes piden su propio orden
         ordering = ['-fecha', '-hora']
-        unique_together = ['fecha', 'hora', 'peluquero']
+        constraints = [
+            # Una cancelada no retiene su hora: se puede volver a reservar (p. ej. la lista de espera)
+            models.UniqueConstraint(
+                fields=['fecha', 'hora', 'peluquero'],
+                name='cita_activa_unica',
+                condition=models.Q(estado__in=ESTADOS_ACTIVOS),
+                violation_error_message="El peluquero ya tiene una cita a esa hora.",
+            ),
+        ]
+        indexes = [
+            # Panel admin (orden por fecha, hora e id) y resúmenes por fecha en cualquier estado
+            models.Index(fields=['fecha', 'hora', 'id'], name='cita_fecha_hora_idx'),
+            # Agenda y paneles: citas de un peluquero o cliente ordenadas por fecha y hora
+            models.Index(fields=['peluquero', 'fecha', 'hora'], name='cita_peluquero_fecha_idx'),
+            models.Index(fields=['usuario', 'fecha', 'hora'], name='cita_usuario_fecha_idx'),
+            # Disponibilidad y asignación: solo las citas que ocupan agenda
+            models.Index(
+                fields=['fecha', 'peluquero', 'hora'],
+                name='cita_activa_fecha_idx',
+                condition=models.Q(estado__in=ESTADOS_ACTIVOS),
+            ),
+            # Recordatorios: solo las citas activas a las que aún no se les avisó
+            models.Index(
+                fields=['fecha', 'hora'],
+                name='cita_recordatorio_pend_idx',
+                condition=models.Q(estado__in=ESTADOS_ACTIVOS, recordatorio_enviado_en__isnull=True),
+            ),
+        ]
 
     def clean(self):
-        if self.peluquero and Cita.objects.exclude(id=self.id).filter(
-            fecha=self.fecha, hora=self.hora, peluquero=self.peluquero
-        ).exists():
-            raise ValidationError("El peluquero ya tiene una cita a esa hora.")
+        # Choque con cualquier cita activa del peluquero que se cruce según las
+        # duraciones de ambos servicios (la misma hora exacta la cubre cita_activa_unica)
+        from .solapes import choques, describir
+        otras = choques(self)
+        if otras:
+            raise ValidationError(describir(otras))
+
+    def calcular_hora_fin(self):
+        """Hora de término según el servicio (catálogo en caché; hasta medianoche como máximo)"""
+        if self.hora is None or self.servicio_id is None:
+            return None
+        from .solapes import duracion, hora_fin
+        return hora_fin(self.hora, duracion(self))
+
+    def calcular_precio(self):
+        """Precio vigente del servicio según el catálogo (no una copia cargada antes de un cambio)"""
+        if self.servicio_id is None:
+            return None
+        from .catalogo import obtener_servicio
+        return obtener_servicio(self.servicio_id).precio
+
+    def save(self, *args, **kwargs):
+        # Los campos a escribir los decide quien guarda (update_fields); aquí
+        # solo se suman los que dependen de ellos.
+        original = getattr(self, '_original', None) or {}
+        if 'hora' in self.__dict__ and 'servicio_id' in self.__dict__:
+            self.hora_fin = self.calcular_hora_fin()
+        # El precio se fija al reservar y solo cambia si la cita pasa a otro servicio
+        if 'servicio_id' in self.__dict__:
+            otro_servicio = original.get('servicio_id') not in (None, self.servicio_id)
+            if otro_servicio or ('precio' in self.__dict__ and self.precio is None):
+                self.precio = self.calcular_precio()
+
+        campos = kwargs.get('update_fields')
+        campos = None if campos is None else set(campos)
+        # Con otra fecha u hora la cita necesita un recordatorio nuevo
+        antes = (original.get('fecha'), original.get('hora'))
+        ahora = (self.__dict__.get('fecha'), self.__dict__.get('hora'))
+        movida = None not in antes and None not in ahora and antes != ahora
+        if movida and (campos is None or {'fecha', 'hora'} & campos):
+            self.recordatorio_lote = self.recordatorio_reclamado_en = self.recordatorio_enviado_en = None
+            if campos is not None:
+                campos.update(CAMPOS_RECORDATORIO)
+        if campos is not None and {'hora', 'servicio', 'servicio_id'} & campos:
+            campos.update({'hora_fin', 'precio'})
+        if campos is not None:
+            kwargs['update_fields'] = campos
+        super().save(*args, **kwargs)
 
     def __str__(self):
         cliente = self.usuario.username if self.usuario else f"{self.nombre_cliente} {self.apellido_cliente}"
@@ -70,9 +164,243 @@ class Cita(models.Model):
 
     @property
     def puede_cancelar(self):
+        """Para una sola cita; en listados usar historial.anotar_cancelable"""
         if self.estado in ['completada', 'cancelada']:
             return False
         fecha_hora_cita = timezone.make_aware(
             timezone.datetime.combine(self.fecha, self.hora)
         )
-        return (fecha_hora_cita - timezone.now()).total_seconds() > 7200
+        return fecha_hora_cita - timezone.now() > PLAZO_CANCELACION
+
+
+class SerieCita(models.Model):
+    """Cita recurrente: el mismo servicio y hora cada `intervalo_semanas` semanas.
+
+    Sus ocurrencias son citas normales (Cita.serie); citas.series las crea,
+    edita y cancela en lote.
+    """
+    ESTADOS = [
+        ('activa', 'Activa'),
+        ('cancelada', 'Cancelada'),
+    ]
+    INTERVALOS = [
+        (1, 'Cada semana'),
+        (2, 'Cada dos semanas'),
+        (3, 'Cada tres semanas'),
+        (4, 'Cada cuatro semanas'),
+    ]
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='series')
+    peluquero = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='series_asignadas')
+    servicio = models.ForeignKey(ServicioCorte, on_delete=models.PROTECT)
+    hora = models.TimeField()
+    fecha_inicio = models.DateField()
+    intervalo_semanas = models.PositiveSmallIntegerField(choices=INTERVALOS, default=2)
+    hasta = models.DateField(null=True, blank=True, help_text="Última fecha posible (vacío = horizonte por defecto)")
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='activa')
+    notas = models.TextField(blank=True, null=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.usuario.username} - {self.servicio.nombre} ({self.get_intervalo_semanas_display().lower()} a las {self.hora:%H:%M})"
+
+
+class HorarioSemanal(models.Model):
+    """Regla semanal de un peluquero: un turno de atención o un descanso dentro del día.
+
+    Un peluquero sin turnos atiende en el horario del local; con turnos,
+    solo en ellos (un día sin turnos es libre).
+    """
+    DIAS = [
+        (0, 'Lunes'), (1, 'Martes'), (2, 'Miércoles'), (3, 'Jueves'),
+        (4, 'Viernes'), (5, 'Sábado'), (6, 'Domingo'),
+    ]
+    TIPOS = [
+        ('turno', 'Turno'),
+        ('descanso', 'Descanso'),
+    ]
+
+    peluquero = models.ForeignKey(User, on_delete=models.CASCADE, related_name='horarios')
+    dia_semana = models.PositiveSmallIntegerField(choices=DIAS)
+    hora_inicio = models.TimeField()
+    hora_fin = models.TimeField()
+    tipo = models.CharField(max_length=10, choices=TIPOS, default='turno')
+
+    class Meta:
+        ordering = ['peluquero', 'dia_semana', 'hora_inicio']
+        verbose_name = 'Horario semanal'
+        verbose_name_plural = 'Horarios semanales'
+
+    def clean(self):
+        if self.hora_inicio and self.hora_fin and self.hora_fin <= self.hora_inicio:
+            raise ValidationError("La hora de término debe ser posterior a la de inicio.")
+
+    def __str__(self):
+        return f"{self.peluquero} - {self.get_dia_semana_display()} {self.hora_inicio:%H:%M}-{self.hora_fin:%H:%M} ({self.get_tipo_display()})"
+
+
+class Ausencia(models.Model):
+    """Vacaciones, permisos o feriados entre dos fechas (sin peluquero = todo el local)"""
+    peluquero = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='ausencias')
+    desde = models.DateField()
+    hasta = models.DateField()
+    # Vacías = el día completo
+    hora_inicio = models.TimeField(null=True, blank=True)
+    hora_fin = models.TimeField(null=True, blank=True)
+    motivo = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['peluquero', 'desde', 'hasta'], name='ausencia_peluquero_idx')]
+
+    def clean(self):
+        if self.desde and self.hasta and self.hasta < self.desde:
+            raise ValidationError("La fecha final no puede ser anterior a la inicial.")
+        if (self.hora_inicio is None) != (self.hora_fin is None):
+            raise ValidationError("Indica ambas horas o ninguna (día completo).")
+        if self.hora_inicio and self.hora_fin and self.hora_fin <= self.hora_inicio:
+            raise ValidationError("La hora de término debe ser posterior a la de inicio.")
+
+    def __str__(self):
+        quien = self.peluquero or 'Local'
+        return f"{quien}: {self.motivo or 'Ausencia'} ({self.desde} a {self.hasta})"
+
+
+class OcupacionDiaria(models.Model):
+    """Mapa de bits de la agenda de un peluquero en un día (un bit por bloque de 5 minutos)"""
+    peluquero = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='ocupaciones')
+    fecha = models.DateField()
+    mapa = models.BinaryField(default=b'')
+
+    class Meta:
+        unique_together = ['peluquero', 'fecha']
+
+    def __str__(self):
+        return f"{self.peluquero} - {self.fecha}"
+
+
+class EstadisticaDiaria(models.Model):
+    """Resumen de citas por día, peluquero, servicio y estado (alimenta los reportes)"""
+    fecha = models.DateField()
+    peluquero = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='estadisticas')
+    servicio = models.ForeignKey(ServicioCorte, on_delete=models.PROTECT)
+    estado = models.CharField(max_length=20, choices=Cita.ESTADOS)
+    total = models.IntegerField(default=0)
+    ingresos = models.DecimalField(max_digits=12, decimal_places=0, default=0)
+    minutos = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['fecha', 'peluquero', 'servicio', 'estado']
+
+    def __str__(self):
+        return f"{self.fecha} {self.peluquero} {self.servicio.nombre} {self.estado}: {self.total}"
+
+
+class EventoNotificacion(models.Model):
+    """Bandeja de salida: avisos escritos junto con el cambio de la cita y enviados por un worker"""
+    TIPOS = [
+        ('reservada', 'Cita reservada'),
+        ('cancelada', 'Cita cancelada'),
+        ('reagendada', 'Cita reagendada'),
+        ('oferta', 'Horario ofrecido de la lista de espera'),
+    ]
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('enviando', 'Enviando'),
+        ('enviada', 'Enviada'),
+        ('fallida', 'Fallida'),
+    ]
+
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    cita = models.ForeignKey(Cita, on_delete=models.SET_NULL, null=True, blank=True, related_name='notificaciones')
+    destinatario = models.EmailField()
+    asunto = models.CharField(max_length=200)
+    cuerpo = models.TextField()
+
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente')
+    intentos = models.PositiveIntegerField(default=0)
+    # Próximo intento; mientras está 'enviando' es el fin del plazo del worker que la tomó
+    disponible_en = models.DateTimeField(default=timezone.now)
+    lote = models.CharField(max_length=32, blank=True, null=True)
+    ultimo_error = models.TextField(blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+    enviado_en = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['estado', 'disponible_en'], name='notificacion_cola_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} → {self.destinatario} ({self.estado})"
+
+
+class EsperaCita(models.Model):
+    """Cliente en lista de espera para un servicio en una fecha, dentro de una ventana horaria.
+
+    Cuando se libera una hora que calza, el worker (citas.lista_espera) le
+    reserva una cita retenida hasta `vence_en`; si no la acepta a tiempo se
+    cancela y pasa al siguiente de la lista.
+    """
+    ESTADOS = [
+        ('esperando', 'Esperando'),
+        ('ofrecida', 'Horario ofrecido'),
+        ('aceptada', 'Aceptada'),
+        ('vencida', 'Oferta vencida'),
+        ('cancelada', 'Cancelada'),
+    ]
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='esperas')
+    servicio = models.ForeignKey(ServicioCorte, on_delete=models.PROTECT)
+    # Vacío = cualquier peluquero
+    peluquero = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='esperas_asignadas')
+    fecha = models.DateField()
+    desde = models.TimeField()
+    hasta = models.TimeField()
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='esperando')
+    # Cita retenida mientras la oferta está vigente (y la definitiva si se acepta)
+    cita = models.OneToOneField(Cita, on_delete=models.SET_NULL, null=True, blank=True, related_name='espera')
+    vence_en = models.DateTimeField(null=True, blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['creado_en', 'id']
+        verbose_name = 'Cliente en espera'
+        verbose_name_plural = 'Lista de espera'
+        indexes = [
+            # Emparejamiento: quienes esperan en una fecha, por ventana horaria
+            models.Index(
+                fields=['fecha', 'desde', 'hasta'],
+                name='espera_fecha_ventana_idx',
+                condition=models.Q(estado='esperando'),
+            ),
+            models.Index(fields=['estado', 'vence_en'], name='espera_oferta_vence_idx'),
+        ]
+
+    def clean(self):
+        if self.desde and self.hasta and self.hasta <= self.desde:
+            raise ValidationError("La hora final de la ventana debe ser posterior a la inicial.")
+
+    def __str__(self):
+        return f"{self.usuario.username} - {self.servicio.nombre} ({self.fecha} {self.desde:%H:%M}-{self.hasta:%H:%M})"
+
+
+class HuecoLiberado(models.Model):
+    """Bandeja de horas liberadas por cancelaciones: se escribe con el cambio de la cita y la procesa el worker"""
+    peluquero = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='huecos_liberados')
+    fecha = models.DateField()
+    hora = models.TimeField()
+    procesado = models.BooleanField(default=False)
+    # Mientras un worker lo tiene tomado: su lote y el fin de su plazo
+    lote = models.CharField(max_length=32, blank=True, null=True)
+    disponible_en = models.DateTimeField(default=timezone.now)
+    creado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['disponible_en'], name='hueco_pendiente_idx', condition=models.Q(procesado=False),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.peluquero} - {self.fecha} {self.hora:%H:%M}"
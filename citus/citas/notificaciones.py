@@ -0,0 +1,203 @@
+import datetime
+import random
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metricas
+from .models import EventoNotificacion
+
+
+TAMANO_LOTE = 200
+MAX_INTENTOS = 6
+# Reintentos: 30 s, 1 min, 2 min, ... hasta una hora, con algo de azar
+ESPERA_BASE = datetime.timedelta(seconds=30)
+ESPERA_MAXIMA = datetime.timedelta(hours=1)
+# Plazo de un worker para enviar lo que tomó; vencido, otro lo puede retomar
+PLAZO_ENVIO = datetime.timedelta(minutes=10)
+
+ASUNTOS = {
+    'reservada': "Nueva cita en Citus Peluquería",
+    'cancelada': "Cita cancelada en Citus Peluquería",
+    'reagendada': "Cita reagendada en Citus Peluquería",
+    'oferta': "Se liberó un horario para ti en Citus Peluquería",
+}
+
+
+# -----------------------
+#   REGISTRO (dentro de la transacción de la cita)
+# -----------------------
+
+def _correo_cliente(cita):
+    if cita.correo_cliente:
+        return cita.correo_cliente
+    return cita.usuario.email if cita.usuario_id else ''
+
+
+def _correo_peluquero(cita):
+    return cita.peluquero.email if cita.peluquero_id else ''
+
+
+def _cuerpo(cita, tipo, motivo):
+    cliente = cita.nombre_cliente or (cita.usuario.username if cita.usuario_id else '')
+    lineas = [
+        f"{ASUNTOS[tipo]}.",
+        "",
+        f"Cliente: {cliente}",
+        f"Servicio: {cita.servicio.nombre}",
+        f"Fecha: {cita.fecha:%d/%m/%Y} a las {cita.hora:%H:%M}",
+    ]
+    if motivo:
+        # En una oferta de la lista de espera el texto es el plazo para confirmarla
+        lineas.append(motivo if tipo == 'oferta' else f"Motivo: {motivo}")
+    return "\n".join(lineas)
+
+
+def _eventos(cita, tipo, por, motivo):
+    destinatarios = []
+    if por != 'cliente':
+        destinatarios.append(_correo_cliente(cita))
+    if por != 'peluquero':
+        destinatarios.append(_correo_peluquero(cita))
+
+    cuerpo = _cuerpo(cita, tipo, motivo)
+    return [
+        EventoNotificacion(
+            tipo=tipo, cita=cita, destinatario=correo, asunto=ASUNTOS[tipo], cuerpo=cuerpo,
+        )
+        for correo in dict.fromkeys(destinatarios) if correo
+    ]
+
+
+def registrar(cita, tipo, por=None, motivo=''):
+    """Encola el aviso de un cambio de la cita para la otra parte.
+
+    `por` es quien hizo el cambio ('cliente' o 'peluquero'); esa parte no se
+    avisa a sí misma. Una reserva se avisa a ambos. Debe llamarse dentro de la
+    misma transacción que guarda la cita: si la transacción se revierte, el
+    aviso tampoco existe.
+    """
+    return EventoNotificacion.objects.bulk_create(_eventos(cita, tipo, por, motivo))
+
+
+def registrar_lote(citas, tipo, por=None, motivo=''):
+    """Como registrar, para muchas citas con un solo INSERT (cambios en lote)"""
+    return EventoNotificacion.objects.bulk_create([e for cita in citas for e in _eventos(cita, tipo, por, motivo)])
+
+
+# -----------------------
+#   WORKER
+# -----------------------
+
+def reclamar(tamano=TAMANO_LOTE, ahora=None):
+    """Toma hasta `tamano` eventos listos (o abandonados por un worker caído).
+
+    El UPDATE condicionado impide que dos workers tomen el mismo evento.
+    """
+    ahora = ahora or timezone.now()
+    listos = EventoNotificacion.objects.filter(
+        Q(estado='pendiente') | Q(estado='enviando'), disponible_en__lte=ahora,
+    )
+    while True:
+        pks = list(listos.order_by('disponible_en', 'id').values_list('pk', flat=True)[:tamano])
+        if not pks:
+            return []
+        lote = uuid.uuid4().hex
+        if listos.filter(pk__in=pks).update(estado='enviando', lote=lote, disponible_en=ahora + PLAZO_ENVIO):
+            return list(EventoNotificacion.objects.filter(pk__in=pks, lote=lote).order_by('id'))
+
+
+def agrupar(eventos):
+    """Un solo correo por destinatario con todos sus avisos del lote"""
+    grupos = defaultdict(list)
+    for evento in eventos:
+        grupos[evento.destinatario].append(evento)
+    return grupos
+
+
+def _mensaje(destinatario, eventos):
+    if len(eventos) == 1:
+        asunto, cuerpo = eventos[0].asunto, eventos[0].cuerpo
+    else:
+        asunto = f"Tienes {len(eventos)} novedades en Citus Peluquería"
+        cuerpo = "\n\n----------\n\n".join(e.cuerpo for e in eventos)
+    return EmailMessage(asunto, cuerpo, settings.DEFAULT_FROM_EMAIL, [destinatario])
+
+
+def _enviar_grupos(grupos):
+    """Envía varios grupos por una sola conexión; devuelve {destinatario: error o None}.
+
+    Solo habla con el servidor de correo: no toca la base, así puede correr
+    en un hilo aparte.
+    """
+    resultado = {}
+    conexion = get_connection()
+    try:
+        conexion.open()
+        for destinatario, eventos in grupos:
+            try:
+                conexion.send_messages([_mensaje(destinatario, eventos)])
+                resultado[destinatario] = None
+            except Exception as e:
+                resultado[destinatario] = repr(e)
+    except Exception as e:
+        # Sin conexión: fallan todos los grupos que quedaban
+        for destinatario, _ in grupos:
+            resultado.setdefault(destinatario, repr(e))
+    finally:
+        conexion.close()
+    return resultado
+
+
+def espera(intentos):
+    segundos = min(ESPERA_BASE.total_seconds() * 2 ** (intentos - 1), ESPERA_MAXIMA.total_seconds())
+    return datetime.timedelta(seconds=segundos * random.uniform(0.8, 1.2))
+
+
+def procesar_lote(tamano=TAMANO_LOTE, concurrencia=4, max_intentos=MAX_INTENTOS):
+    """Toma un lote, lo envía con hasta `concurrencia` conexiones y registra el resultado.
+
+    Devuelve (enviados, fallidos) de los eventos que seguían en su lote;
+    (0, 0) si no había nada que enviar.
+    """
+    eventos = reclamar(tamano)
+    if not eventos:
+        return 0, 0
+
+    grupos = list(agrupar(eventos).items())
+    partes = [grupos[i::concurrencia] for i in range(concurrencia) if grupos[i::concurrencia]]
+    resultado = {}
+    with ThreadPoolExecutor(max_workers=len(partes)) as pool:
+        for parcial in pool.map(_enviar_grupos, partes):
+            resultado.update(parcial)
+
+    # Cada UPDATE exige que el evento siga en este lote: si el plazo venció y
+    # otro worker lo retomó, el resultado de este no pisa el suyo
+    del_lote = EventoNotificacion.objects.filter(lote=eventos[0].lote)
+    ahora = timezone.now()
+    enviados = del_lote.filter(
+        pk__in=[e.pk for e in eventos if resultado.get(e.destinatario) is None],
+    ).update(estado='enviada', enviado_en=ahora, lote=None)
+
+    # Un UPDATE por destinatario e intento: comparten error y espera
+    fallos = defaultdict(list)
+    for evento in eventos:
+        if resultado.get(evento.destinatario) is not None:
+            fallos[(evento.destinatario, evento.intentos + 1)].append(evento.pk)
+    fallidos = 0
+    for (destinatario, intentos), pks in fallos.items():
+        cambios = {'intentos': intentos, 'ultimo_error': resultado[destinatario], 'lote': None}
+        if intentos >= max_intentos:
+            cambios['estado'] = 'fallida'
+        else:
+            cambios.update(estado='pendiente', disponible_en=ahora + espera(intentos))
+        fallidos += del_lote.filter(pk__in=pks).update(**cambios)
+
+    metricas.incrementar('notificaciones_enviadas', enviados)
+    metricas.incrementar('notificaciones_fallidas', fallidos)
+    return enviados, fallidos
@@ -0,0 +1,120 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Cita, OcupacionDiaria
+
+
+# Un bit por bloque de 5 minutos: 288 bits (36 bytes) por peluquero y día
+BLOQUE_MINUTOS = 5
+BLOQUES_DIA = 24 * 60 // BLOQUE_MINUTOS
+BYTES_MAPA = BLOQUES_DIA // 8
+
+
+def mascara(inicio, fin):
+    """Bits que cubren los minutos [inicio, fin) del día"""
+    primero = inicio // BLOQUE_MINUTOS
+    ultimo = min(-(-fin // BLOQUE_MINUTOS), BLOQUES_DIA)
+    if ultimo <= primero:
+        return 0
+    return ((1 << (ultimo - primero)) - 1) << primero
+
+
+def cabe(mapa, inicio, duracion):
+    return not mapa & mascara(inicio, inicio + duracion)
+
+
+def a_bytes(mapa):
+    return mapa.to_bytes(BYTES_MAPA, 'little')
+
+
+def de_bytes(datos):
+    return int.from_bytes(bytes(datos or b''), 'little')
+
+
+def _filtro_claves(claves):
+    filtro = Q()
+    por_peluquero = defaultdict(set)
+    for peluquero_id, fecha in claves:
+        por_peluquero[peluquero_id].add(fecha)
+    for peluquero_id, fechas in por_peluquero.items():
+        if peluquero_id is None:
+            filtro |= Q(peluquero__isnull=True, fecha__in=fechas)
+        else:
+            filtro |= Q(peluquero_id=peluquero_id, fecha__in=fechas)
+    return filtro
+
+
+def _bloquear(filtro):
+    """Filas de ocupación de las claves, bloqueadas en orden fijo (el mismo candado que reservas)"""
+    filas = OcupacionDiaria.objects.select_for_update().filter(filtro).order_by('peluquero_id', 'fecha')
+    return {(o.peluquero_id, o.fecha): o for o in filas}
+
+
+def bloquear(claves):
+    """Bloquea hasta el fin de la transacción las agendas (peluquero_id, fecha), creando las filas que falten.
+
+    Es el candado de reservas.bloquear_agenda para muchas agendas a la vez.
+    Devuelve {clave: OcupacionDiaria}.
+    """
+    claves = {c for c in claves if c[1] is not None}
+    if not claves:
+        return {}
+    filtro = _filtro_claves(claves)
+    existentes = _bloquear(filtro)
+    faltan = claves - existentes.keys()
+    if faltan:
+        # Dos procesos pueden crear la misma fila a la vez: el segundo la encuentra al bloquear
+        OcupacionDiaria.objects.bulk_create(
+            [OcupacionDiaria(peluquero_id=p, fecha=f) for p, f in faltan], ignore_conflicts=True,
+        )
+        existentes = _bloquear(filtro)
+    return existentes
+
+
+def recalcular(claves):
+    """Reconstruye el mapa de los pares (peluquero_id, fecha) indicados desde sus citas.
+
+    Bloquea primero las filas de ocupación (creando las que falten) y recién
+    entonces lee las citas: una reserva concurrente espera al candado o ya
+    está confirmada cuando se arma el mapa, así ninguna escritura pisa a otra.
+    """
+    claves = {c for c in claves if c[1] is not None}
+    if not claves:
+        return
+    filtro = _filtro_claves(claves)
+
+    # Sin savepoint: dentro de una reserva el candado ya es parte de su transacción
+    with transaction.atomic(savepoint=False):
+        existentes = bloquear(claves)
+
+        mapas = dict.fromkeys(claves, 0)
+        citas = Cita.objects.filter(filtro, estado__in=Cita.ESTADOS_ACTIVOS).order_by()
+        for peluquero_id, fecha, hora, duracion in citas.values_list(
+            'peluquero_id', 'fecha', 'hora', 'servicio__duracion_minutos'
+        ):
+            inicio = hora.hour * 60 + hora.minute
+            mapas[(peluquero_id, fecha)] |= mascara(inicio, inicio + duracion)
+
+        cambiados = []
+        for clave, mapa in mapas.items():
+            fila = existentes[clave]
+            if de_bytes(fila.mapa) != mapa:
+                fila.mapa = a_bytes(mapa)
+                cambiados.append(fila)
+        if cambiados:
+            OcupacionDiaria.objects.bulk_update(cambiados, ['mapa'])
+
+
+def _consulta_rango(desde, hasta):
+    return OcupacionDiaria.objects.filter(fecha__range=(desde, hasta)).values_list('peluquero_id', 'fecha', 'mapa')
+
+
+def mapas_rango(desde, hasta):
+    """{(peluquero_id, fecha): mapa} para todas las filas del rango, en una consulta"""
+    return {(p, f): de_bytes(m) for p, f, m in _consulta_rango(desde, hasta)}
+
+
+async def amapas_rango(desde, hasta):
+    return {(p, f): de_bytes(m) async for p, f, m in _consulta_rango(desde, hasta)}
@@ -0,0 +1,59 @@
+import datetime
+
+from django.db.models import Q
+from django.utils.encoding import force_str
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+
+TAMANO_PAGINA = 20
+
+
+def codificar_cursor(cita):
+    valor = f"{cita.fecha.isoformat()}|{cita.hora.strftime('%H:%M:%S')}|{cita.pk}"
+    return urlsafe_base64_encode(valor.encode())
+
+
+def decodificar_cursor(valor):
+    """(fecha, hora, id) del cursor, o None si no es válido"""
+    try:
+        fecha, hora, pk = force_str(urlsafe_base64_decode(valor)).split('|')
+        return (
+            datetime.date.fromisoformat(fecha),
+            datetime.time.fromisoformat(hora),
+            int(pk),
+        )
+    except (TypeError, ValueError, UnicodeDecodeError):
+        return None
+
+
+def _pagina(queryset, cursor, tamano, descendente):
+    orden = ('-fecha', '-hora', '-id') if descendente else ('fecha', 'hora', 'id')
+    posicion = decodificar_cursor(cursor) if cursor else None
+    if posicion:
+        fecha, hora, pk = posicion
+        op = 'lt' if descendente else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'fecha__{op}e': fecha}),
+            Q(**{f'fecha__{op}': fecha}) | Q(**{f'hora__{op}': hora}) | Q(hora=hora, **{f'id__{op}': pk}),
+        )
+    return queryset.order_by(*orden)[:tamano + 1]
+
+
+def _cortar(citas, tamano):
+    siguiente = codificar_cursor(citas[tamano - 1]) if len(citas) > tamano else None
+    return citas[:tamano], siguiente
+
+
+def paginar_citas(queryset, cursor=None, tamano=TAMANO_PAGINA, descendente=False):
+    """Página de citas por keyset sobre (fecha, hora, id).
+
+    A diferencia de OFFSET, el costo no crece con el número de página: el
+    cursor se traduce en un rango sobre el índice (…, fecha, hora).
+    Devuelve (citas, siguiente_cursor); el cursor es None en la última página.
+    """
+    return _cortar(list(_pagina(queryset, cursor, tamano, descendente)), tamano)
+
+
+async def apaginar_citas(queryset, cursor=None, tamano=TAMANO_PAGINA, descendente=False):
+    citas = [c async for c in _pagina(queryset, cursor, tamano, descendente)]
+    return _cortar(citas, tamano)
@@ -0,0 +1,245 @@
+import contextvars
+import logging
+import re
+import time
+from collections import Counter
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template as PlantillaDjango
+
+from . import metricas
+
+
+logger = logging.getLogger('citas.perfilado')
+
+# Una misma forma de consulta repetida estas veces en una petición se reporta como N+1
+UMBRAL_REPETICIONES = 5
+
+_perfil_actual = contextvars.ContextVar('perfil_actual', default=None)
+
+
+class Perfil:
+    """Consultas, tiempos y plantillas de una petición.
+
+    Sin `detallado` solo se cuentan consultas y tiempos (para las métricas);
+    las formas de las consultas y las plantillas se miden con CITAS_PERFILADO.
+    """
+
+    def __init__(self, detallado=True):
+        self.detallado = detallado
+        self.inicio = time.perf_counter()
+        self.total_ms = 0.0
+        self.consultas = 0
+        self.sql_ms = 0.0
+        self.plantillas_ms = 0.0
+        self.plantillas_abiertas = 0
+        # Por texto SQL tal cual: se normaliza al reportar, no en cada consulta
+        self.formas = Counter()
+        self.vista = None
+        self.presupuesto = None
+
+    def repetidas(self, umbral=UMBRAL_REPETICIONES):
+        """[(forma, veces)] de las consultas que se repiten al menos `umbral` veces"""
+        formas = Counter()
+        for sql, veces in self.formas.items():
+            formas[forma_consulta(sql)] += veces
+        return [(forma, veces) for forma, veces in formas.most_common() if veces >= umbral]
+
+    @property
+    def excede_presupuesto(self):
+        return self.presupuesto is not None and self.consultas > self.presupuesto
+
+    def server_timing(self):
+        partes = [
+            f'db;dur={self.sql_ms:.1f};desc="{self.consultas} consultas"',
+            f'tpl;dur={self.plantillas_ms:.1f}',
+            f'total;dur={self.total_ms:.1f}',
+        ]
+        if self.repetidas():
+            partes.append(f'nmas1;desc="{len(self.repetidas())} consultas repetidas"')
+        return ', '.join(partes)
+
+
+# -----------------------
+#   INSTRUMENTACIÓN
+# -----------------------
+
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTAS = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+
+
+def forma_consulta(sql):
+    """SQL sin literales ni largos de listas IN: las consultas N+1 comparten forma"""
+    return _LISTAS.sub('(…)', _LITERALES.sub('?', sql))
+
+
+def _medir_consulta(execute, sql, params, many, context):
+    perfil = _perfil_actual.get()
+    if perfil is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        perfil.sql_ms += (time.perf_counter() - inicio) * 1000
+        perfil.consultas += 1
+        if perfil.detallado:
+            perfil.formas[sql] += 1
+
+
+def instalar_medicion(sender, connection, **kwargs):
+    """Deja _medir_consulta fijo en cada conexión nueva (señal connection_created).
+
+    Sin perfil activo no hace nada. Con vistas asíncronas las consultas corren
+    en otro hilo (y otra conexión) que el middleware, así que no basta con
+    envolver la conexión del hilo de la petición.
+    """
+    if _medir_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_medir_consulta)
+
+
+class PlantillaMedida(PlantillaDjango):
+    def render(self, context=None, request=None):
+        perfil = _perfil_actual.get()
+        # Los widgets de formularios y render_to_string anidados se renderizan
+        # dentro de otra plantilla: solo se cronometra la más externa
+        if perfil is None or not perfil.detallado or perfil.plantillas_abiertas:
+            return super().render(context, request)
+        perfil.plantillas_abiertas += 1
+        inicio = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            perfil.plantillas_abiertas -= 1
+            perfil.plantillas_ms += (time.perf_counter() - inicio) * 1000
+
+
+class PlantillasMedidas(DjangoTemplates):
+    """Motor de plantillas de Django que cronometra cada render (BACKEND en TEMPLATES)"""
+
+    def from_string(self, template_code):
+        return PlantillaMedida(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return PlantillaMedida(super().get_template(template_name).template, self)
+
+
+def presupuesto_consultas(maximo):
+    """Declara cuántas consultas SQL puede hacer la vista en una petición.
+
+    El middleware lo compara con lo medido (y lo registra si se excede);
+    PresupuestoConsultasMixin lo convierte en una falla de los tests.
+    """
+    def decorador(vista):
+        if iscoroutinefunction(vista):
+            @wraps(vista)
+            async def envoltura(*args, **kwargs):
+                return await vista(*args, **kwargs)
+        else:
+            @wraps(vista)
+            def envoltura(*args, **kwargs):
+                return vista(*args, **kwargs)
+        envoltura.presupuesto_consultas = maximo
+        return envoltura
+    return decorador
+
+
+# -----------------------
+#   MIDDLEWARE
+# -----------------------
+
+class PerfiladoMiddleware:
+    """Mide cada petición: consultas, tiempo SQL, plantillas y consultas repetidas.
+
+    La duración y las consultas alimentan siempre los histogramas de
+    citas.metricas. Deja el perfil en `respuesta.perfil`, agrega la cabecera
+    Server-Timing si CITAS_PERFILADO_CABECERAS está activo y registra las
+    peticiones lentas o fuera de presupuesto en el logger 'citas.perfilado';
+    las consultas repetidas (N+1) y el tiempo de plantillas solo se miden con
+    CITAS_PERFILADO.
+    Funciona igual bajo WSGI y ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.detallado = getattr(settings, 'CITAS_PERFILADO', settings.DEBUG)
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+        self.cabeceras = getattr(settings, 'CITAS_PERFILADO_CABECERAS', settings.DEBUG)
+        self.lento_ms = getattr(settings, 'CITAS_PERFILADO_LENTO_MS', 500)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        perfil = Perfil(self.detallado)
+        request.perfil = perfil
+        marca = _perfil_actual.set(perfil)
+        try:
+            respuesta = self.get_response(request)
+        finally:
+            _perfil_actual.reset(marca)
+        return self.terminar(request, perfil, respuesta)
+
+    async def __acall__(self, request):
+        perfil = Perfil(self.detallado)
+        request.perfil = perfil
+        marca = _perfil_actual.set(perfil)
+        try:
+            respuesta = await self.get_response(request)
+        finally:
+            _perfil_actual.reset(marca)
+        return self.terminar(request, perfil, respuesta)
+
+    def terminar(self, request, perfil, respuesta):
+        perfil.total_ms = (time.perf_counter() - perfil.inicio) * 1000
+
+        ruta = getattr(request, 'resolver_match', None)
+        vista = (ruta.url_name if ruta else None) or 'sin_ruta'
+        metricas.observar('peticion_segundos', perfil.total_ms / 1000, vista=vista)
+        metricas.observar('peticion_consultas', perfil.consultas, limites=metricas.LIMITES_CONSULTAS, vista=vista)
+        respuesta.perfil = perfil
+        if self.cabeceras:
+            respuesta['Server-Timing'] = perfil.server_timing()
+        self.registrar(request, perfil)
+        return respuesta
+
+    def process_view(self, request, vista, args, kwargs):
+        request.perfil.vista = f"{vista.__module__}.{getattr(vista, '__name__', repr(vista))}"
+        request.perfil.presupuesto = getattr(vista, 'presupuesto_consultas', None)
+
+    def registrar(self, request, perfil):
+        if perfil.total_ms >= self.lento_ms:
+            logger.warning("Petición lenta %s %s: %.0f ms, %d consultas (%.0f ms SQL, %.0f ms plantillas)",
+                           request.method, request.path, perfil.total_ms, perfil.consultas,
+                           perfil.sql_ms, perfil.plantillas_ms)
+        for forma, veces in perfil.repetidas():
+            logger.warning("Posible N+1 en %s: %d veces %s", request.path, veces, forma[:300])
+        if perfil.excede_presupuesto:
+            logger.warning("%s excedió su presupuesto: %d consultas de %d",
+                           perfil.vista, perfil.consultas, perfil.presupuesto)
+
+
+# -----------------------
+#   TESTS
+# -----------------------
+
+class PresupuestoConsultasMixin:
+    """Para TestCase: falla si una respuesta excede el presupuesto de su vista o tiene N+1"""
+
+    def assertDentroDelPresupuesto(self, respuesta):
+        perfil = getattr(respuesta, 'perfil', None)
+        if perfil is None:
+            self.fail("La respuesta no pasó por PerfiladoMiddleware")
+        if perfil.presupuesto is None:
+            self.fail(f"{perfil.vista} no declara @presupuesto_consultas")
+        if perfil.excede_presupuesto:
+            self.fail(f"{perfil.vista} hizo {perfil.consultas} consultas; su presupuesto es {perfil.presupuesto}")
+        repetidas = perfil.repetidas()
+        if repetidas:
+            self.fail(f"{perfil.vista} repite consultas (N+1): {repetidas[0][1]} veces {repetidas[0][0]}")
+        return perfil
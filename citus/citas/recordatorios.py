@@ -0,0 +1,119 @@
+import datetime
+import uuid
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metricas
+from .models import Cita
+
+
+HORAS_ANTICIPACION = 24
+TAMANO_LOTE = 500
+# Mensajes por llamada a send_messages dentro de un lote
+TAMANO_ENVIO = 50
+# Un lote reclamado que no terminó en este tiempo (proceso caído) se vuelve a reclamar
+VENCIMIENTO_RECLAMO = datetime.timedelta(minutes=15)
+
+ASUNTO = "Recordatorio de tu cita en Citus Peluquería"
+
+
+def pendientes(ahora=None, horas=HORAS_ANTICIPACION):
+    """Citas activas que empiezan dentro de las próximas `horas` y aún no tienen recordatorio.
+
+    Las fechas y horas de las citas son locales; la ventana se traduce en un
+    rango sobre (fecha, hora) que resuelve el índice parcial de recordatorios.
+    """
+    ahora = timezone.localtime(ahora)
+    fin = ahora + datetime.timedelta(hours=horas)
+    return Cita.objects.filter(
+        Q(fecha__gt=ahora.date()) | Q(hora__gt=ahora.time()),
+        Q(fecha__lt=fin.date()) | Q(hora__lte=fin.time()),
+        Q(recordatorio_lote__isnull=True) | Q(recordatorio_reclamado_en__lt=ahora - VENCIMIENTO_RECLAMO),
+        fecha__range=(ahora.date(), fin.date()),
+        estado__in=Cita.ESTADOS_ACTIVOS,
+        recordatorio_enviado_en__isnull=True,
+    )
+
+
+def reclamar_lote(ahora=None, horas=HORAS_ANTICIPACION, tamano=TAMANO_LOTE):
+    """Marca hasta `tamano` citas pendientes con un lote propio.
+
+    El UPDATE vuelve a exigir que la cita siga libre, así dos ejecuciones
+    simultáneas nunca se quedan con la misma cita. Devuelve (lote, pks), donde
+    pks acota por clave primaria las citas candidatas del lote, o (None, [])
+    cuando no queda nada por enviar.
+    """
+    ahora = ahora or timezone.now()
+    candidatas = pendientes(ahora, horas)
+    while True:
+        pks = list(candidatas.order_by('fecha', 'hora', 'id').values_list('pk', flat=True)[:tamano])
+        if not pks:
+            return None, []
+        lote = uuid.uuid4().hex
+        if candidatas.filter(pk__in=pks).update(recordatorio_lote=lote, recordatorio_reclamado_en=ahora):
+            return lote, pks
+        # Otra ejecución ganó todas las candidatas; se prueba con las siguientes
+
+
+def destinatario(cita):
+    if cita.correo_cliente:
+        return cita.correo_cliente
+    return cita.usuario.email if cita.usuario else ''
+
+
+def mensaje(cita):
+    nombre = cita.nombre_cliente or (cita.usuario.first_name or cita.usuario.username if cita.usuario else '')
+    cuerpo = (
+        f"Hola {nombre}:\n\n"
+        f"Te recordamos tu cita de {cita.servicio.nombre} el {cita.fecha:%d/%m/%Y} "
+        f"a las {cita.hora:%H:%M}.\n\n"
+        "Si no puedes asistir, cancela o reagenda desde tu panel.\n\n"
+        "Citus Peluquería"
+    )
+    return EmailMessage(ASUNTO, cuerpo, settings.DEFAULT_FROM_EMAIL, [destinatario(cita)])
+
+
+def enviar_lote(lote, pks, conexion, tamano=TAMANO_ENVIO):
+    """Envía los recordatorios de un lote por tramos y marca cada tramo apenas sale.
+
+    Cada tramo va en una sola llamada a send_messages. Las marcas exigen que
+    la cita siga en este lote y renuevan el reclamo de las que faltan, así un
+    envío largo no vence su lote ni otra ejecución manda lo mismo de nuevo. Si
+    otra ejecución retomó el lote, se deja de enviar; si el envío falla, se
+    liberan las citas del tramo y las siguientes para un próximo intento.
+    """
+    del_lote = Cita.objects.filter(pk__in=pks, recordatorio_lote=lote)
+    citas = list(
+        del_lote
+        .select_related('usuario', 'servicio')
+        .only(
+            'fecha', 'hora', 'nombre_cliente', 'correo_cliente', 'servicio__nombre',
+            'usuario__username', 'usuario__first_name', 'usuario__email',
+        )
+        .order_by('fecha', 'hora', 'id')
+    )
+    enviadas = 0
+    try:
+        for inicio in range(0, len(citas), tamano):
+            tramo = citas[inicio:inicio + tamano]
+            # Las citas sin correo se marcan igual: no hay a quién avisarle
+            mensajes = [mensaje(cita) for cita in tramo if destinatario(cita)]
+            if mensajes:
+                conexion.send_messages(mensajes)
+            ahora = timezone.now()
+            marcadas = del_lote.filter(pk__in=[c.pk for c in tramo]).update(recordatorio_enviado_en=ahora)
+            enviadas += marcadas
+            if marcadas < len(tramo):
+                break  # el lote venció y otra ejecución lo retomó: lo que queda es suyo
+            del_lote.filter(recordatorio_enviado_en__isnull=True).update(recordatorio_reclamado_en=ahora)
+    except Exception:
+        del_lote.filter(recordatorio_enviado_en__isnull=True).update(
+            recordatorio_lote=None, recordatorio_reclamado_en=None,
+        )
+        raise
+    finally:
+        metricas.incrementar('recordatorios_enviados', enviadas)
+    return enviadas
@@ -0,0 +1,70 @@
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from . import metricas, notificaciones
+from .asignacion import asignar_peluquero
+from .disponibilidad import peluquero_libre
+from .models import OcupacionDiaria
+
+
+MAX_INTENTOS = 5
+
+
+def bloquear_agenda(peluquero_id, fecha):
+    """Bloquea la fila de ocupación del peluquero en ese día hasta el fin de la transacción"""
+    OcupacionDiaria.objects.get_or_create(peluquero_id=peluquero_id, fecha=fecha)
+    OcupacionDiaria.objects.select_for_update().get(peluquero_id=peluquero_id, fecha=fecha)
+
+
+def reservar_cita(cita, preferido=None, estrategia=None):
+    """Asigna un peluquero y guarda la cita sin dobles reservas.
+
+    Cada intento corre en su propia transacción: elige un peluquero libre,
+    bloquea su agenda del día, vuelve a comprobar el hueco y guarda. Si otra
+    reserva ganó la carrera se reintenta con el siguiente peluquero libre.
+    El aviso de la reserva se encola en la misma transacción que la cita.
+    Los errores de validación (sin peluqueros libres, datos inválidos) se
+    propagan como ValidationError.
+    """
+    descartados = set()
+    for _ in range(MAX_INTENTOS):
+        try:
+            with transaction.atomic():
+                peluquero_id = asignar_peluquero(
+                    cita, preferido=preferido, estrategia=estrategia, excluir=descartados
+                )
+                if peluquero_id is not None:
+                    bloquear_agenda(peluquero_id, cita.fecha)
+                    if not peluquero_libre(peluquero_id, cita.fecha, cita.hora,
+                                           cita.servicio.duracion_minutos, excluir=cita.pk):
+                        descartados.add(peluquero_id)
+                        continue
+                cita.full_clean()
+                cita.save()
+                notificaciones.registrar(cita, 'reservada')
+            metricas.incrementar('embudo_reserva', etapa='reservada')
+            return cita
+        except IntegrityError:
+            metricas.incrementar('embudo_reserva', etapa='conflicto')
+            descartados.add(cita.peluquero_id)
+    raise ValidationError("No fue posible reservar ese horario, intenta con otra hora.")
+
+
+def reagendar_cita(cita, por=None, motivo=''):
+    """Guarda la nueva fecha u hora de la cita sin solaparla con otra del peluquero.
+
+    Bloquea la agenda del peluquero en el día de destino y valida dentro de
+    la transacción (Cita.clean compara los intervalos según la duración de
+    los servicios), así dos reagendamientos simultáneos no pueden cruzarse.
+    El aviso 'reagendada' se encola junto con el cambio. Lanza ValidationError.
+    """
+    try:
+        with transaction.atomic():
+            if cita.peluquero_id is not None:
+                bloquear_agenda(cita.peluquero_id, cita.fecha)
+            cita.full_clean()
+            cita.save()
+            notificaciones.registrar(cita, 'reagendada', por=por, motivo=motivo)
+    except IntegrityError:
+        raise ValidationError("Ese horario acaba de ocuparse, intenta con otra hora.")
+    return cita
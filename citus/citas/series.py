@@ -0,0 +1,242 @@
+"""Citas recurrentes (SerieCita).
+
+Una serie se expande en sus fechas hasta `hasta` o el horizonte, todas se
+comparan con la agenda del peluquero en una sola consulta por rango de
+fechas y las ocurrencias libres se insertan con un bulk_create. Como
+bulk_create() y update() no emiten señales, aquí se rehacen los resúmenes
+(ocupación, estadísticas, avisos en vivo y bandeja de notificaciones),
+igual que en citas.lotes.
+"""
+import datetime
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from . import estadisticas, eventos, horarios, lista_espera, lotes, metricas, notificaciones, ocupacion
+from .disponibilidad import (
+    HORA_CIERRE, a_minutos, fusionar_intervalos, ids_peluqueros, inicios_del_dia, inicios_libres,
+    minimo_reservable,
+)
+from .models import Cita, OcupacionDiaria
+from .signals import recordar_cita
+from .solapes import hora_fin
+
+
+# Hasta dónde se expande una serie sin fecha de término (unos seis meses)
+HORIZONTE_SEMANAS = 26
+
+
+class ConflictoSerie(ValidationError):
+    """Ocurrencias que chocan con la agenda; `fechas` las lista en orden"""
+
+    def __init__(self, fechas):
+        self.fechas = sorted(fechas)
+        listado = ', '.join(f"{f:%d/%m/%Y}" for f in self.fechas)
+        super().__init__(f"El horario ya está ocupado el {listado}.")
+
+
+def fechas_serie(serie):
+    """Fechas de las ocurrencias: desde fecha_inicio, cada intervalo_semanas, hasta `hasta` o el horizonte"""
+    limite = serie.fecha_inicio + datetime.timedelta(weeks=HORIZONTE_SEMANAS)
+    if serie.hasta:
+        limite = min(limite, serie.hasta)
+    paso = datetime.timedelta(weeks=serie.intervalo_semanas)
+    fechas, fecha = [], serie.fecha_inicio
+    while fecha <= limite:
+        fechas.append(fecha)
+        fecha += paso
+    return fechas
+
+
+def _validar_horario(hora, duracion):
+    inicio = a_minutos(hora)
+    if inicio not in inicios_del_dia() or inicio + duracion > a_minutos(HORA_CIERRE):
+        raise ValidationError("La hora elegida está fuera del horario de atención.")
+
+
+def _bloquear_agendas(peluquero_id, fechas):
+    """Bloquea la ocupación del peluquero en todas las fechas con dos consultas (ver reservas.bloquear_agenda)"""
+    if peluquero_id is None:
+        return
+    OcupacionDiaria.objects.bulk_create(
+        [OcupacionDiaria(peluquero_id=peluquero_id, fecha=f) for f in fechas], ignore_conflicts=True
+    )
+    list(OcupacionDiaria.objects.select_for_update().filter(peluquero_id=peluquero_id, fecha__in=fechas).order_by('fecha'))
+
+
+def conflictos(peluqueros, fechas, hora, duracion, excluir=()):
+    """{peluquero_id: {fechas en que [hora, hora + duracion) choca}} con una sola consulta.
+
+    Choca una cita activa que se cruce con el servicio o una hora en que el
+    peluquero no atiende según citas.horarios.
+    """
+    citas = Cita.objects.filter(
+        estado__in=Cita.ESTADOS_ACTIVOS, fecha__range=(min(fechas), max(fechas)),
+    )
+    if peluqueros == [None]:
+        citas = citas.filter(peluquero__isnull=True)
+    else:
+        citas = citas.filter(peluquero_id__in=peluqueros)
+    if excluir:
+        citas = citas.exclude(pk__in=excluir)
+
+    buscadas = set(fechas)
+    resultado = {p: set() for p in peluqueros}
+    ocupacion_dia = defaultdict(list)
+    for peluquero_id, fecha, h, d in citas.order_by().values_list(
+        'peluquero_id', 'fecha', 'hora', 'servicio__duracion_minutos'
+    ):
+        if fecha in buscadas:
+            ocupacion_dia[(peluquero_id, fecha)].append((a_minutos(h), a_minutos(h) + d))
+
+    # Los días en que el peluquero no atiende a esa hora también chocan
+    for clave, intervalos in horarios.bloqueos(fechas, peluqueros).items():
+        ocupacion_dia[clave].extend(intervalos)
+
+    inicio, cierre = a_minutos(hora), a_minutos(HORA_CIERRE)
+    for (peluquero_id, fecha), intervalos in ocupacion_dia.items():
+        if not inicios_libres(fusionar_intervalos(intervalos), [inicio], duracion, cierre):
+            resultado[peluquero_id].add(fecha)
+    return resultado
+
+
+def _ocurrencia(serie, fecha, telefono):
+    usuario = serie.usuario
+    return Cita(
+        serie=serie, usuario=usuario, servicio=serie.servicio, peluquero=serie.peluquero,
+        fecha=fecha, hora=serie.hora, hora_fin=hora_fin(serie.hora, serie.servicio.duracion_minutos),
+        precio=serie.servicio.precio, estado='pendiente', notas=serie.notas,
+        nombre_cliente=usuario.username, correo_cliente=usuario.email, telefono_cliente=telefono,
+    )
+
+
+def pendientes(serie):
+    """Ocurrencias activas que aún no llegan: las que editar o cancelar la serie modifica"""
+    ahora = timezone.localtime()
+    return serie.citas.filter(
+        Q(fecha__gt=ahora.date()) | Q(fecha=ahora.date(), hora__gte=ahora.time()),
+        estado__in=Cita.ESTADOS_ACTIVOS,
+    )
+
+
+# -----------------------
+#   CREACIÓN
+# -----------------------
+
+def crear_serie(serie, omitir_conflictos=False):
+    """Guarda la serie y reserva todas sus ocurrencias de una vez.
+
+    Si alguna fecha choca con la agenda lanza ConflictoSerie sin guardar
+    nada; con `omitir_conflictos` reserva solo las fechas libres. Sin
+    peluquero elegido se asigna el que tenga menos choques en toda la serie.
+    Devuelve {'citas': [...], 'omitidas': [fechas]}.
+    """
+    duracion = serie.servicio.duracion_minutos
+    _validar_horario(serie.hora, duracion)
+    if a_minutos(serie.hora) < minimo_reservable(serie.fecha_inicio):
+        raise ValidationError("La serie debe comenzar en una fecha y hora futuras.")
+    fechas = fechas_serie(serie)
+    if not fechas:
+        raise ValidationError("La fecha de término es anterior a la de inicio.")
+
+    perfil = getattr(serie.usuario, 'perfilusuario', None)
+    telefono = (perfil.telefono if perfil else '') or ''
+
+    with transaction.atomic():
+        if serie.peluquero_id is None:
+            candidatos = ids_peluqueros()
+            choques = conflictos(candidatos, fechas, serie.hora, duracion)
+            elegido = min(candidatos, key=lambda p: (len(choques[p]), p or 0))
+            if elegido is not None:
+                serie.peluquero = User.objects.get(pk=elegido)
+        _bloquear_agendas(serie.peluquero_id, fechas)
+        ocupadas = conflictos([serie.peluquero_id], fechas, serie.hora, duracion)[serie.peluquero_id]
+        libres = [f for f in fechas if f not in ocupadas]
+        if not libres or (ocupadas and not omitir_conflictos):
+            metricas.incrementar('embudo_reserva', etapa='conflicto')
+            raise ConflictoSerie(ocupadas)
+
+        serie.save()
+        citas = Cita.objects.bulk_create([_ocurrencia(serie, f, telefono) for f in libres])
+        for cita in citas:
+            recordar_cita(Cita, cita)
+        ocupacion.recalcular({(serie.peluquero_id, f) for f in libres})
+        estadisticas.recalcular_fechas(libres)
+        eventos.avisar_ocupadas(libres)
+        notificaciones.registrar_lote(citas, 'reservada')
+
+    metricas.incrementar('embudo_reserva', valor=len(citas), etapa='reservada')
+    return {'citas': citas, 'omitidas': sorted(ocupadas)}
+
+
+# -----------------------
+#   EDICIÓN Y CANCELACIÓN
+# -----------------------
+
+def actualizar_serie(serie, por=None):
+    """Guarda la serie y lleva su hora, servicio y notas a las ocurrencias pendientes.
+
+    Un solo UPDATE para todas; si el nuevo horario choca en alguna fecha
+    lanza ConflictoSerie sin cambiar nada. Las citas que cambian de hora o
+    servicio se avisan como 'reagendada'. Devuelve las citas actualizadas.
+    """
+    duracion = serie.servicio.duracion_minutos
+    with transaction.atomic():
+        citas = list(
+            pendientes(serie).select_related('usuario', 'peluquero').select_for_update(of=('self',))
+            .order_by('fecha', 'hora', 'id')
+        )
+        fechas = [c.fecha for c in citas]
+        if citas:
+            _validar_horario(serie.hora, duracion)
+            _bloquear_agendas(serie.peluquero_id, fechas)
+            ocupadas = conflictos(
+                [serie.peluquero_id], fechas, serie.hora, duracion, excluir=[c.pk for c in citas]
+            )[serie.peluquero_id]
+            if ocupadas:
+                raise ConflictoSerie(ocupadas)
+        serie.save()
+        if not citas:
+            return []
+
+        movidas = [c for c in citas if c.hora != serie.hora or c.servicio_id != serie.servicio_id]
+        lista_espera.registrar_liberadas([c for c in citas if c.hora != serie.hora])
+        fin = hora_fin(serie.hora, duracion)
+        Cita.objects.filter(pk__in=[c.pk for c in citas]).update(
+            hora=serie.hora, hora_fin=fin, servicio=serie.servicio, notas=serie.notas,
+            # Como en Cita.save: el precio fijado solo cambia junto con el servicio
+            precio=Case(When(servicio=serie.servicio, then=F('precio')), default=Value(serie.servicio.precio)),
+        )
+        otra_hora = [c.pk for c in citas if c.hora != serie.hora]
+        if otra_hora:
+            # Como en Cita.save: con otra hora la cita necesita un recordatorio nuevo
+            Cita.objects.filter(pk__in=otra_hora).update(
+                recordatorio_lote=None, recordatorio_reclamado_en=None, recordatorio_enviado_en=None,
+            )
+        for cita in citas:
+            if cita.servicio_id != serie.servicio_id:
+                cita.precio = serie.servicio.precio
+            cita.hora, cita.hora_fin, cita.servicio, cita.notas = serie.hora, fin, serie.servicio, serie.notas
+            recordar_cita(Cita, cita)
+
+        if movidas:
+            cambiadas = {c.fecha for c in movidas}
+            ocupacion.recalcular({(serie.peluquero_id, f) for f in cambiadas})
+            estadisticas.recalcular_fechas(cambiadas)
+            eventos.avisar_liberadas(cambiadas)
+            eventos.avisar_ocupadas(cambiadas)
+            notificaciones.registrar_lote(movidas, 'reagendada', por=por)
+    return citas
+
+
+def cancelar_serie(serie, por=None, motivo=''):
+    """Cancela la serie y sus ocurrencias pendientes con un solo UPDATE (citas.lotes)"""
+    with transaction.atomic():
+        serie.estado = 'cancelada'
+        serie.save(update_fields=['estado'])
+        ids = list(pendientes(serie).order_by().values_list('pk', flat=True))
+        return lotes.aplicar('cancelar', ids, por=por, motivo=motivo)
@@ -1,7 +1,18 @@
+import contextvars
+from contextlib import contextmanager
+
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.db import transaction
 from django.dispatch import receiver
-from .models import PerfilUsuario
+from django.utils import timezone
+from . import estadisticas, eventos, horarios, lista_espera, ocupacion, solapes
+from .basedatos import configurar_sqlite
+from .cache_paginas import invalidar_paginas
+from .catalogo import invalidar_catalogo
+from .models import Ausencia, Cita, HorarioSemanal, PerfilUsuario, ServicioCorte
+from .perfilado import instalar_medicion
 
 
 @receiver(post_save, sender=User)
@@ -15,3 +26,175 @@ def crear_perfil_usuario(sender, instance, created, **kwargs):
 def guardar_perfil_usuario(sender, instance, **kwargs):
     """Guarda el perfil asociado al actualizar un usuario."""
     PerfilUsuario.objects.get_or_create(usuario=instance)
+
+
+# -----------------------
+#   CONEXIONES A LA BASE
+# -----------------------
+
+connection_created.connect(configurar_sqlite, dispatch_uid='citas_configurar_sqlite')
+connection_created.connect(instalar_medicion, dispatch_uid='citas_instalar_medicion')
+
+
+# -----------------------
+#   CATÁLOGO DE SERVICIOS
+# -----------------------
+
+@receiver(post_save, sender=ServicioCorte)
+@receiver(post_delete, sender=ServicioCorte)
+def invalidar_catalogo_servicios(sender, **kwargs):
+    """Descarta la foto del catálogo cuando cambia algún servicio."""
+    invalidar_catalogo()
+
+
+@receiver(post_init, sender=ServicioCorte)
+def recordar_servicio(sender, instance, **kwargs):
+    """Duración con que se cargó el servicio."""
+    instance._original = instance.__dict__.get('duracion_minutos') if instance.pk else None
+
+
+def _actualizar_hora_fin(servicio):
+    """Con otra duración, las citas activas por venir terminan a otra hora (ver Cita.hora_fin).
+
+    También cambia lo que ocupan en la agenda: se reconstruyen los mapas de
+    ocupación de esos peluqueros y días en la misma transacción.
+    """
+    citas = Cita.objects.filter(servicio=servicio, estado__in=Cita.ESTADOS_ACTIVOS, fecha__gte=timezone.localdate())
+    with transaction.atomic():
+        # Un UPDATE por hora de inicio distinta (a lo más las horas de un día)
+        for hora in citas.order_by().values_list('hora', flat=True).distinct():
+            citas.filter(hora=hora).update(hora_fin=solapes.hora_fin(hora, servicio.duracion_minutos))
+        ocupacion.recalcular(set(citas.order_by().values_list('peluquero_id', 'fecha').distinct()))
+
+
+def propagar_servicio(servicio, duracion):
+    """Lleva un cambio de duración (valor previo) a las citas, la ocupación y las estadísticas.
+
+    Un cambio de precio no se propaga: cada cita guarda el precio con que se
+    reservó. Para cambios en bloque que no emiten post_save (cargar_servicios).
+    """
+    if duracion != servicio.duracion_minutos:
+        _actualizar_hora_fin(servicio)
+        estadisticas.actualizar_minutos(servicio)
+
+
+@receiver(post_save, sender=ServicioCorte)
+def propagar_cambio_servicio(sender, instance, created=False, raw=False, **kwargs):
+    anterior = instance._original
+    instance._original = instance.duracion_minutos
+    if not (created or raw or anterior is None):
+        propagar_servicio(instance, anterior)
+
+
+@receiver(post_save, sender=PerfilUsuario)
+def invalidar_paginas_cacheadas(sender, instance, **kwargs):
+    """La navegación y la lista de peluqueros dependen de los perfiles."""
+    invalidar_paginas()
+
+
+# -----------------------
+#   HORARIOS Y AUSENCIAS
+# -----------------------
+
+@receiver(post_init, sender=HorarioSemanal)
+@receiver(post_init, sender=Ausencia)
+def recordar_regla_horario(sender, instance, **kwargs):
+    """Peluquero y fechas con que se cargó la regla: al cambiarla se invalidan también esos."""
+    instance._original = (instance.peluquero_id, getattr(instance, 'desde', None), getattr(instance, 'hasta', None))
+
+
+@receiver(post_save, sender=HorarioSemanal)
+@receiver(post_delete, sender=HorarioSemanal)
+def invalidar_horario_semanal(sender, instance, **kwargs):
+    for peluquero_id in {instance._original[0], instance.peluquero_id}:
+        if peluquero_id is not None:
+            horarios.invalidar_peluquero(peluquero_id)
+
+
+@receiver(post_save, sender=Ausencia)
+@receiver(post_delete, sender=Ausencia)
+def invalidar_ausencia(sender, instance, **kwargs):
+    """Solo se descartan los días de la ausencia (de todos los peluqueros si es un feriado)."""
+    for peluquero_id, desde, hasta in {instance._original, (instance.peluquero_id, instance.desde, instance.hasta)}:
+        if desde is not None and hasta is not None:
+            horarios.invalidar_fechas(peluquero_id, desde, hasta)
+
+
+# -----------------------
+#   ESTADO ORIGINAL DE LA CITA
+# -----------------------
+
+CAMPOS_SEGUIDOS = ('fecha', 'hora', 'peluquero_id', 'servicio_id', 'estado', 'precio')
+CAMPOS_ESTADISTICA = ('fecha', 'peluquero_id', 'servicio_id', 'estado', 'precio')
+
+
+def _valores(cita):
+    # Se lee de __dict__ para no disparar consultas en campos diferidos (.only())
+    return {campo: cita.__dict__.get(campo) for campo in CAMPOS_SEGUIDOS}
+
+
+def _clave_estadistica(valores):
+    return {campo: valores[campo] for campo in CAMPOS_ESTADISTICA}
+
+
+@receiver(post_init, sender=Cita)
+def recordar_cita(sender, instance, **kwargs):
+    """Guarda los valores con que se cargó la cita para detectar cambios al guardar."""
+    instance._original = _valores(instance) if instance.pk else None
+
+
+@receiver(pre_save, sender=Cita)
+def completar_original(sender, instance, raw=False, **kwargs):
+    """Si la cita se cargó con campos diferidos, lee de la base los que faltan."""
+    original = instance._original
+    if raw or original is None or all(campo in instance.__dict__ for campo in CAMPOS_SEGUIDOS):
+        return
+    instance._original = Cita.objects.filter(pk=instance.pk).values(*CAMPOS_SEGUIDOS).first()
+
+
+_diferidos = contextvars.ContextVar('resumenes_diferidos', default=False)
+
+
+@contextmanager
+def resumenes_diferidos():
+    """Dentro del bloque las señales de Cita no tocan los resúmenes ni publican avisos.
+
+    Para operaciones en lote (p. ej. QuerySet.delete(), que emite una señal
+    por cita): quien las hace recalcula todo una vez al final.
+    """
+    marca = _diferidos.set(True)
+    try:
+        yield
+    finally:
+        _diferidos.reset(marca)
+
+
+@receiver(post_save, sender=Cita)
+def actualizar_resumenes_al_guardar(sender, instance, raw=False, **kwargs):
+    """Mantiene al día la ocupación y las estadísticas afectadas por la cita."""
+    original, actual = instance._original, _valores(instance)
+    if raw or original == actual or _diferidos.get():
+        return
+    claves = {(actual['peluquero_id'], actual['fecha'])}
+    if original:
+        claves.add((original['peluquero_id'], original['fecha']))
+    ocupacion.recalcular(claves)
+    eventos.avisar_cambio(original, actual)
+    lista_espera.registrar_cambio(original, actual)
+
+    if original is None or _clave_estadistica(original) != _clave_estadistica(actual):
+        if original:
+            estadisticas.ajustar(signo=-1, **_clave_estadistica(original))
+        estadisticas.ajustar(signo=1, **_clave_estadistica(actual))
+    instance._original = actual
+
+
+@receiver(post_delete, sender=Cita)
+def actualizar_resumenes_al_eliminar(sender, instance, **kwargs):
+    if _diferidos.get():
+        return
+    original = instance._original or _valores(instance)
+    ocupacion.recalcular({(original['peluquero_id'], original['fecha'])})
+    eventos.avisar_cambio(original, None)
+    lista_espera.registrar_cambio(original, None)
+    estadisticas.ajustar(signo=-1, **_clave_estadistica(original))
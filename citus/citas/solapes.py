@@ -0,0 +1,108 @@
+"""Choques entre citas del mismo peluquero con servicios de distinta duración.
+
+Las citas activas de un peluquero en un día se leen en una sola consulta
+(con su servicio, para conocer la duración) y se ordenan por inicio. Cada
+pregunta "¿qué se cruza con [inicio, fin)?" es una búsqueda binaria más un
+recorrido hacia atrás que corta en cuanto el mayor fin acumulado ya no
+alcanza el inicio, así que sirve también para validar lotes grandes.
+"""
+import datetime
+import itertools
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.db.models import Q
+
+from .catalogo import obtener_servicio
+from .disponibilidad import a_minutos
+from .models import Cita
+
+
+class Intervalos:
+    """Intervalos [inicio, fin) de un día, ordenados por inicio, con el mayor fin hasta cada posición"""
+
+    def __init__(self, elementos=()):
+        # (inicio, fin, orden de llegada, dato): el orden desempata sin comparar los datos
+        self._items = sorted((inicio, fin, i, dato) for i, (inicio, fin, dato) in enumerate(elementos))
+        self._contador = len(self._items)
+        self._inicios = [item[0] for item in self._items]
+        self._max_fin = list(itertools.accumulate((item[1] for item in self._items), max))
+
+    def __len__(self):
+        return len(self._items)
+
+    def agregar(self, inicio, fin, dato=None):
+        """Inserta un intervalo manteniendo el orden (para validar un lote contra sí mismo)"""
+        item = (inicio, fin, self._contador, dato)
+        self._contador += 1
+        posicion = bisect_left(self._items, item)
+        self._items.insert(posicion, item)
+        self._inicios.insert(posicion, inicio)
+        mayor = self._max_fin[posicion - 1] if posicion else fin
+        self._max_fin[posicion:] = itertools.accumulate(
+            (i[1] for i in self._items[posicion:]), max, initial=mayor
+        )
+        del self._max_fin[posicion]  # el valor inicial no corresponde a ningún intervalo
+
+    def chocan(self, inicio, fin):
+        """Datos de los intervalos que se cruzan con [inicio, fin), en orden de inicio"""
+        choques = []
+        j = bisect_left(self._inicios, fin) - 1
+        while j >= 0 and self._max_fin[j] > inicio:
+            if self._items[j][1] > inicio:
+                choques.append(self._items[j][3])
+            j -= 1
+        return choques[::-1]
+
+
+def hora_fin(hora, minutos):
+    """Hora de término de un servicio de `minutos` que empieza a `hora` (a lo más, medianoche)"""
+    fin = datetime.datetime.combine(datetime.date.min, hora) + datetime.timedelta(minutes=minutos)
+    return fin.time() if fin.date() == datetime.date.min else datetime.time.max
+
+
+def duracion(cita):
+    """Minutos del servicio de la cita sin consultar la base si ya está cargado o en el catálogo"""
+    if Cita.servicio.is_cached(cita):
+        return cita.servicio.duracion_minutos
+    return obtener_servicio(cita.servicio_id).duracion_minutos
+
+
+def agendas(pares, excluir=()):
+    """{(peluquero_id, fecha): Intervalos de sus citas activas} con una sola consulta indexada"""
+    pares = {(p, f) for p, f in pares if p is not None and f is not None}
+    if not pares:
+        return {}
+    filtro = Q()
+    por_peluquero = defaultdict(set)
+    for peluquero_id, fecha in pares:
+        por_peluquero[peluquero_id].add(fecha)
+    for peluquero_id, fechas in por_peluquero.items():
+        filtro |= Q(peluquero_id=peluquero_id, fecha__in=fechas)
+
+    citas = Cita.objects.filter(filtro, estado__in=Cita.ESTADOS_ACTIVOS).select_related('servicio')
+    if excluir:
+        citas = citas.exclude(pk__in=excluir)
+    por_dia = defaultdict(list)
+    for cita in citas.order_by():
+        inicio = a_minutos(cita.hora)
+        por_dia[(cita.peluquero_id, cita.fecha)].append((inicio, inicio + cita.servicio.duracion_minutos, cita))
+    return {par: Intervalos(por_dia.get(par, ())) for par in pares}
+
+
+def choques(cita):
+    """Citas activas del mismo peluquero que se cruzan con `cita` (una consulta; [] si no ocupa agenda)"""
+    if cita.peluquero_id is None or cita.fecha is None or cita.hora is None or cita.servicio_id is None:
+        return []
+    if cita.estado not in Cita.ESTADOS_ACTIVOS:
+        return []
+    par = (cita.peluquero_id, cita.fecha)
+    inicio = a_minutos(cita.hora)
+    return agendas([par], excluir=[cita.pk] if cita.pk else [])[par].chocan(inicio, inicio + duracion(cita))
+
+
+def describir(citas):
+    detalle = ', '.join(
+        f"{c.hora:%H:%M} ({c.servicio.nombre}, {c.servicio.duracion_minutos} min)" for c in citas
+    )
+    return f"El peluquero ya tiene una cita que se cruza con ese horario: {detalle}."
@@ -0,0 +1,20 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from citas.cache_paginas import HUECO_CSRF, HUECO_MENSAJES, csrf_input, en_cache, mensajes_html
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def hueco_csrf(context):
+    """Como {% csrf_token %}, pero deja un hueco si la página se está cacheando"""
+    request = context['request']
+    return mark_safe(HUECO_CSRF) if en_cache(request) else csrf_input(request)
+
+
+@register.simple_tag(takes_context=True)
+def hueco_mensajes(context):
+    """Mensajes flash, o un hueco si la página se está cacheando"""
+    request = context['request']
+    return mark_safe(HUECO_MENSAJES) if en_cache(request) else mensajes_html(request)
@@ -1,3 +1,1787 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    estadisticas, eventos, historial, horarios, lista_espera, lotes, metricas, notificaciones, ocupacion, recordatorios, series, solapes,
+)
+from .asignacion import asignar_peluquero
+from .benchmark import datos as datos_benchmark, escritura, medicion
+from .cache_paginas import invalidar_paginas
+from .catalogo import obtener_catalogo
+from .disponibilidad import AgendaDia, disponibilidad_rango
+from .forms import CitaPublicaForm
+from .intercambio import Importador
+from .paginacion import paginar_citas
+from .perfilado import Perfil, PresupuestoConsultasMixin
+from .models import (
+    Ausencia, Cita, EsperaCita, EstadisticaDiaria, EventoNotificacion, HorarioSemanal, HuecoLiberado, OcupacionDiaria,
+    PerfilUsuario, SerieCita, ServicioCorte,
+)
+
+
+MANANA = timezone.localdate() + datetime.timedelta(days=1)
+
+
+def crear_peluquero(username):
+    user = User.objects.create_user(username=username, password="clave12345")
+    user.perfilusuario.es_peluquero = True
+    user.perfilusuario.save()
+    return user
+
+
+def crear_servicio(**datos):
+    """Un corte de 30 minutos a $10.000, salvo lo que se indique"""
+    datos = {"nombre": "Corte", "descripcion": "", "duracion_minutos": 30, "precio": 10000, **datos}
+    return ServicioCorte.objects.create(**datos)
+
+
+class DisponibilidadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.combo = crear_servicio(nombre="Corte + Barba", duracion_minutos=60, precio=18000)
+        cls.ana = crear_peluquero("ana")
+
+    def reservar(self, hora, servicio, peluquero=None, estado="pendiente"):
+        return Cita.objects.create(
+            fecha=MANANA, hora=hora, servicio=servicio, peluquero=peluquero or self.ana, estado=estado
+        )
+
+    def test_respeta_duracion_de_citas_reservadas(self):
+        self.reservar(datetime.time(10, 0), self.combo)
+        horas = AgendaDia.cargar(MANANA).inicios_libres(30)
+        self.assertNotIn(datetime.time(10, 0), horas)
+        self.assertNotIn(datetime.time(10, 30), horas)
+        self.assertIn(datetime.time(11, 0), horas)
+
+    def test_servicio_largo_no_cabe_antes_de_una_cita(self):
+        self.reservar(datetime.time(11, 0), self.corte)
+        horas = AgendaDia.cargar(MANANA).inicios_libres(60)
+        self.assertIn(datetime.time(10, 0), horas)
+        self.assertNotIn(datetime.time(10, 30), horas)
+        self.assertNotIn(datetime.time(18, 30), horas)
+
+    def test_otro_peluquero_libre_mantiene_la_hora(self):
+        crear_peluquero("beto")
+        self.reservar(datetime.time(10, 0), self.corte)
+        self.assertIn(datetime.time(10, 0), AgendaDia.cargar(MANANA).inicios_libres(30))
+
+    def test_citas_canceladas_no_ocupan(self):
+        self.reservar(datetime.time(10, 0), self.corte, estado="cancelada")
+        self.assertIn(datetime.time(10, 0), AgendaDia.cargar(MANANA).inicios_libres(30))
+
+    def test_agenda_del_dia_en_dos_consultas(self):
+        for h in (9, 11, 13):
+            self.reservar(datetime.time(h, 0), self.corte)
+        AgendaDia.cargar(MANANA)  # horario de los peluqueros ya compilado en caché
+        with self.assertNumQueries(2):
+            AgendaDia.cargar(MANANA).inicios_libres(60)
+
+    def test_endpoint_horas(self):
+        self.reservar(datetime.time(10, 0), self.combo)
+        url = reverse("obtener_horas_disponibles")
+        data = self.client.get(url, {"fecha": MANANA.isoformat(), "servicio": self.corte.pk}).json()
+        self.assertNotIn("10:30", data["horas"])
+        self.assertIn("11:00", data["horas"])
+        self.assertEqual(self.client.get(url, {"fecha": "mañana"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"fecha": MANANA.isoformat(), "servicio": "x"}).status_code, 400)
+
+    def test_formulario_rechaza_hora_ocupada(self):
+        self.reservar(datetime.time(10, 0), self.combo)
+        form = CitaPublicaForm({
+            "nombre_cliente": "Juan", "servicio": self.corte.pk,
+            "fecha": MANANA.isoformat(), "hora": "10:30",
+        })
+        self.assertFalse(form.is_valid())
+        self.assertIn("hora", form.errors)
+
+
+class HorariosTests(TestCase):
+    """Turnos, descansos y ausencias de cada peluquero dentro de la disponibilidad"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.ana = crear_peluquero("ana")
+        cls.beto = crear_peluquero("beto")
+
+    def setUp(self):
+        # Lo compilado queda en la caché del proceso: ningún otro test debe verlo
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def turno(self, inicio, fin, tipo="turno", fecha=MANANA):
+        return HorarioSemanal.objects.create(peluquero=self.ana, dia_semana=fecha.weekday(),
+                                             hora_inicio=datetime.time(*inicio), hora_fin=datetime.time(*fin), tipo=tipo)
+
+    def libres(self, hora):
+        return AgendaDia.cargar(MANANA).peluqueros_libres(datetime.time(*hora), 30)
+
+    def test_turnos_y_descansos(self):
+        self.turno((10, 0), (14, 0))
+        self.turno((12, 0), (12, 30), tipo="descanso")
+        self.assertEqual(self.libres((9, 0)), [self.beto.pk])
+        self.assertEqual(self.libres((10, 0)), [self.ana.pk, self.beto.pk])
+        self.assertEqual(self.libres((12, 0)), [self.beto.pk])
+        self.assertEqual(self.libres((14, 0)), [self.beto.pk])
+
+        Cita.objects.create(fecha=MANANA, hora=datetime.time(9, 0), servicio=self.corte, peluquero=self.beto)
+        with self.assertRaises(ValidationError):
+            asignar_peluquero(Cita(fecha=MANANA, hora=datetime.time(9, 0), servicio=self.corte))
+
+        # Otro día de la semana sin turnos: ana no atiende
+        otro_dia = MANANA + datetime.timedelta(days=1)
+        dias = horarios.bloqueos([otro_dia], [self.ana.pk])
+        self.assertEqual(dias[(self.ana.pk, otro_dia)], [(9 * 60, 19 * 60)])
+
+    def test_ausencias_y_feriados(self):
+        ausencia = Ausencia.objects.create(peluquero=self.ana, desde=MANANA, hasta=MANANA, motivo="Vacaciones")
+        self.assertEqual(self.libres((9, 0)), [self.beto.pk])
+        feriado = Ausencia.objects.create(desde=MANANA, hasta=MANANA + datetime.timedelta(days=2), motivo="Fiestas")
+        self.assertEqual(AgendaDia.cargar(MANANA).inicios_libres(30), [])
+        dias = disponibilidad_rango(MANANA, MANANA + datetime.timedelta(days=3), 30)
+        self.assertEqual([len(horas) for horas in dias.values()][:3], [0, 0, 0])
+        self.assertTrue(dias[MANANA + datetime.timedelta(days=3)])
+
+        feriado.delete()
+        ausencia.hora_inicio, ausencia.hora_fin = datetime.time(9, 0), datetime.time(11, 0)
+        ausencia.save()
+        self.assertEqual(self.libres((9, 0)), [self.beto.pk])
+        self.assertEqual(self.libres((11, 0)), [self.ana.pk, self.beto.pk])
+
+    def test_invalidacion_acotada_al_peluquero_y_fechas(self):
+        fechas = [MANANA, MANANA + datetime.timedelta(days=7)]
+        horarios.bloqueos(fechas, [self.ana.pk, self.beto.pk])
+        Ausencia.objects.create(peluquero=self.beto, desde=MANANA, hasta=MANANA)
+        with self.assertNumQueries(0):
+            horarios.bloqueos(fechas, [self.ana.pk])
+            horarios.bloqueos(fechas[1:], [self.beto.pk])
+        with self.assertNumQueries(2):
+            self.assertEqual(horarios.bloqueos(fechas[:1], [self.beto.pk])[(self.beto.pk, MANANA)], [(540, 1140)])
+
+        self.turno((9, 0), (13, 0))
+        with self.assertNumQueries(2):
+            self.assertEqual(horarios.bloqueos(fechas, [self.ana.pk])[(self.ana.pk, MANANA)], [(780, 1140)])
+
+
+class SolapesTests(TestCase):
+    """Choques según la duración de cada servicio, no solo a la misma hora"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.combo = crear_servicio(nombre="Corte + Barba", duracion_minutos=60, precio=18000)
+        cls.ana = crear_peluquero("ana")
+
+    def setUp(self):
+        self.larga = Cita.objects.create(servicio=self.combo, fecha=MANANA, hora=datetime.time(10), peluquero=self.ana)
+
+    def test_intervalos_ordenados(self):
+        intervalos = solapes.Intervalos([(600, 660, "a"), (540, 570, "b")])
+        intervalos.agregar(700, 730, "c")
+        intervalos.agregar(560, 600, "d")
+        self.assertEqual(intervalos.chocan(630, 660), ["a"])
+        self.assertEqual(intervalos.chocan(565, 610), ["b", "d", "a"])
+        self.assertEqual(intervalos.chocan(660, 700), [])
+
+    def test_clean_detecta_solape_con_una_consulta(self):
+        cruzada = Cita(servicio=self.corte, fecha=MANANA, hora=datetime.time(10, 30), peluquero=self.ana)
+        with self.assertNumQueries(1):
+            with self.assertRaisesMessage(ValidationError, "10:00 (Corte + Barba, 60 min)"):
+                cruzada.clean()
+        # Justo al terminar la otra, o si la otra ya no ocupa agenda, no hay choque
+        Cita(servicio=self.corte, fecha=MANANA, hora=datetime.time(11), peluquero=self.ana).clean()
+        self.larga.estado = "cancelada"
+        self.larga.save()
+        cruzada.clean()
+
+    def test_hora_fin_sigue_al_servicio(self):
+        self.assertEqual(self.larga.hora_fin, datetime.time(11))
+        self.larga.servicio = self.corte
+        self.larga.save(update_fields=["servicio"])
+        self.larga.refresh_from_db()
+        self.assertEqual(self.larga.hora_fin, datetime.time(10, 30))
+
+    def test_cambiar_la_duracion_del_servicio_corre_hora_fin(self):
+        pasada = Cita.objects.create(servicio=self.combo, fecha=MANANA - datetime.timedelta(days=2),
+                                     hora=datetime.time(10), peluquero=self.ana)
+        # El catálogo cacheado sobrevive al rollback del test
+        self.addCleanup(cache.clear)
+        self.combo.duracion_minutos = 90
+        self.combo.save()
+        self.larga.refresh_from_db()
+        pasada.refresh_from_db()
+        self.assertEqual(self.larga.hora_fin, datetime.time(11, 30))
+        self.assertEqual(pasada.hora_fin, datetime.time(11))
+
+    def test_cambiar_la_duracion_rehace_la_ocupacion(self):
+        self.addCleanup(cache.clear)
+        self.combo.duracion_minutos = 90
+        self.combo.save()
+        consulta = {"fecha": MANANA.isoformat(), "servicio": self.corte.pk}
+        horas = self.client.get(reverse("obtener_horas_disponibles"), consulta).json()["horas"]
+        consulta = {"desde": MANANA.isoformat(), "hasta": MANANA.isoformat(), "servicio": self.corte.pk}
+        rango = self.client.get(reverse("obtener_horas_rango"), consulta).json()["dias"][MANANA.isoformat()]
+        self.assertNotIn("11:00", horas)
+        self.assertEqual(horas, rango)
+
+    def test_reagendar_no_pisa_otra_cita(self):
+        cliente = User.objects.create_user(username="cliente", email="cliente@citus.test", password="clave12345")
+        cita = Cita.objects.create(usuario=cliente, servicio=self.corte, fecha=MANANA, hora=datetime.time(14),
+                                   peluquero=self.ana)
+        self.client.force_login(self.ana)
+        datos = {"nueva_fecha": MANANA.isoformat(), "nueva_hora": "10:30", "motivo_reagendamiento": "Imprevisto"}
+        respuesta = self.client.post(reverse("reagendar_cita_peluquero", args=[cita.pk]), datos)
+        self.assertContains(respuesta, "se cruza con ese horario")
+        cita.refresh_from_db()
+        self.assertEqual(cita.hora, datetime.time(14))
+
+        datos["nueva_hora"] = "11:00"
+        respuesta = self.client.post(reverse("reagendar_cita_peluquero", args=[cita.pk]), datos)
+        self.assertRedirects(respuesta, reverse("panel_peluquero"), fetch_redirect_response=False)
+        cita.refresh_from_db()
+        self.assertEqual((cita.hora, cita.hora_fin), (datetime.time(11), datetime.time(11, 30)))
+        self.assertTrue(EventoNotificacion.objects.filter(cita=cita, tipo="reagendada").exists())
+
+    def test_importacion_compara_duraciones(self):
+        lote = [
+            {"fecha": MANANA.isoformat(), "hora": "10:30", "servicio": "Corte", "peluquero": "ana"},
+            {"fecha": MANANA.isoformat(), "hora": "11:00", "servicio": "Corte + Barba", "peluquero": "ana"},
+            {"fecha": MANANA.isoformat(), "hora": "11:30", "servicio": "Corte", "peluquero": "ana"},
+            {"fecha": MANANA.isoformat(), "hora": "11:00", "estado": "cancelada", "servicio": "Corte", "peluquero": "ana"},
+        ]
+        creadas, conflictos, duplicadas, errores = Importador().importar_lote(lote, 1)
+        self.assertEqual((creadas, conflictos, duplicadas), (2, 2, 0))
+        self.assertEqual([numero for numero, _ in errores], [1, 3])
+        self.assertEqual(Cita.objects.get(hora=datetime.time(11), estado="pendiente").hora_fin, datetime.time(12))
+
+
+class OcupacionDiariaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.combo = crear_servicio(nombre="Corte + Barba", duracion_minutos=60, precio=18000)
+        cls.ana = crear_peluquero("ana")
+
+    def mapa(self, fecha=MANANA):
+        fila = OcupacionDiaria.objects.filter(peluquero=self.ana, fecha=fecha).first()
+        return ocupacion.de_bytes(fila.mapa) if fila else 0
+
+    def test_mapa_sigue_a_la_cita(self):
+        cita = Cita.objects.create(fecha=MANANA, hora=datetime.time(10, 0), servicio=self.combo, peluquero=self.ana)
+        self.assertEqual(self.mapa(), ocupacion.mascara(600, 660))
+
+        cita.fecha = MANANA + datetime.timedelta(days=1)
+        cita.save()
+        self.assertEqual(self.mapa(), 0)
+        self.assertEqual(self.mapa(cita.fecha), ocupacion.mascara(600, 660))
+
+        cita.estado = "cancelada"
+        cita.save()
+        self.assertEqual(self.mapa(cita.fecha), 0)
+
+        cita.estado = "pendiente"
+        cita.save()
+        cita.delete()
+        self.assertEqual(self.mapa(cita.fecha), 0)
+
+    def test_primera_escritura_concurrente_no_choca(self):
+        Cita.objects.bulk_create([Cita(fecha=MANANA, hora=datetime.time(10, 0), servicio=self.combo, peluquero=self.ana)])
+        bloquear = ocupacion._bloquear
+        lecturas = []
+
+        def bloquear_con_carrera(filtro):
+            filas = bloquear(filtro)
+            if not lecturas:
+                # Entre la lectura y el INSERT, otro proceso crea la fila del día
+                OcupacionDiaria.objects.create(peluquero=self.ana, fecha=MANANA)
+            lecturas.append(filtro)
+            return filas
+
+        with mock.patch.object(ocupacion, "_bloquear", bloquear_con_carrera):
+            ocupacion.recalcular({(self.ana.pk, MANANA)})
+        self.assertEqual(len(lecturas), 2)
+        self.assertEqual(OcupacionDiaria.objects.filter(peluquero=self.ana, fecha=MANANA).count(), 1)
+        self.assertEqual(self.mapa(), ocupacion.mascara(600, 660))
+
+    def test_rango_en_pocas_consultas(self):
+        Cita.objects.create(fecha=MANANA, hora=datetime.time(10, 0), servicio=self.combo, peluquero=self.ana)
+        url = reverse("obtener_horas_rango")
+        hasta = MANANA + datetime.timedelta(days=29)
+        obtener_catalogo()
+        horarios.bloqueos([MANANA + datetime.timedelta(days=i) for i in range(30)], [self.ana.pk])
+        with self.assertNumQueries(2):
+            data = self.client.get(url, {
+                "desde": MANANA.isoformat(), "hasta": hasta.isoformat(), "servicio": self.combo.pk,
+            }).json()
+        self.assertEqual(len(data["dias"]), 30)
+        self.assertNotIn("09:30", data["dias"][MANANA.isoformat()])
+        self.assertIn("09:00", data["dias"][MANANA.isoformat()])
+        self.assertIn("10:00", data["dias"][hasta.isoformat()])
+
+    def test_rango_maximo(self):
+        url = reverse("obtener_horas_rango")
+        hasta = MANANA + datetime.timedelta(days=60)
+        respuesta = self.client.get(url, {"desde": MANANA.isoformat(), "hasta": hasta.isoformat()})
+        self.assertEqual(respuesta.status_code, 400)
+
+
+class AsignacionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.combo = crear_servicio(nombre="Corte + Barba", duracion_minutos=60, precio=18000)
+        cls.peluqueros = [crear_peluquero(f"peluquero{i}") for i in range(15)]
+
+    def nueva(self, hora, servicio=None):
+        return Cita(fecha=MANANA, hora=hora, servicio=servicio or self.corte)
+
+    def ocupar(self, peluquero, hora, servicio=None):
+        Cita.objects.create(fecha=MANANA, hora=hora, servicio=servicio or self.corte, peluquero=peluquero)
+
+    def test_menor_carga_en_tres_consultas(self):
+        for p in self.peluqueros[:-1]:
+            self.ocupar(p, datetime.time(15, 0))
+        cita = self.nueva(datetime.time(10, 0))
+        with self.assertNumQueries(3):
+            asignar_peluquero(cita)
+        self.assertEqual(cita.peluquero_id, self.peluqueros[-1].pk)
+
+    def test_solo_elige_peluqueros_libres_todo_el_servicio(self):
+        for p in self.peluqueros[1:]:
+            self.ocupar(p, datetime.time(10, 30))
+        self.ocupar(self.peluqueros[0], datetime.time(14, 0))
+        self.ocupar(self.peluqueros[0], datetime.time(15, 0))
+        cita = self.nueva(datetime.time(10, 0), self.combo)
+        asignar_peluquero(cita)
+        self.assertEqual(cita.peluquero_id, self.peluqueros[0].pk)
+
+    def test_sin_peluqueros_libres(self):
+        for p in self.peluqueros:
+            self.ocupar(p, datetime.time(10, 0))
+        with self.assertRaises(ValidationError):
+            asignar_peluquero(self.nueva(datetime.time(10, 0)))
+
+    def test_preferido_y_rotativo(self):
+        preferido = self.peluqueros[7]
+        cita = self.nueva(datetime.time(10, 0))
+        asignar_peluquero(cita, preferido=preferido)
+        self.assertEqual(cita.peluquero_id, preferido.pk)
+
+        self.ocupar(self.peluqueros[3], datetime.time(16, 0))
+        cita = self.nueva(datetime.time(10, 0))
+        asignar_peluquero(cita, estrategia="rotativo")
+        self.assertEqual(cita.peluquero_id, self.peluqueros[4].pk)
+
+    def test_menor_minutos(self):
+        for p in self.peluqueros[1:]:
+            self.ocupar(p, datetime.time(15, 0))
+        self.ocupar(self.peluqueros[0], datetime.time(15, 0), self.combo)
+        cita = self.nueva(datetime.time(10, 0))
+        asignar_peluquero(cita)
+        self.assertEqual(cita.peluquero_id, self.peluqueros[0].pk)
+        asignar_peluquero(cita, estrategia="menor_minutos")
+        self.assertEqual(cita.peluquero_id, self.peluqueros[1].pk)
+
+    def test_agendar_sin_peluqueros_libres_no_falla(self):
+        for p in self.peluqueros:
+            self.ocupar(p, datetime.time(10, 0), self.combo)
+        respuesta = self.client.post(reverse("agendar_cita_publica"), {
+            "nombre_cliente": "Juan", "servicio": self.corte.pk,
+            "fecha": MANANA.isoformat(), "hora": "10:30",
+        })
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(Cita.objects.count(), 15)
+
+
+# Con 16 hilos compitiendo todas las peticiones superan el umbral de lentitud
+@override_settings(CITAS_PERFILADO_LENTO_MS=60000)
+class ReservaConcurrenteTests(TransactionTestCase):
+    """Cientos de reservas simultáneas sobre los mismos horarios"""
+
+    PELUQUEROS = 4
+    RESERVAS = 200
+
+    def setUp(self):
+        self.corte = crear_servicio()
+        self.combo = crear_servicio(nombre="Corte + Barba", duracion_minutos=60, precio=18000)
+        for i in range(self.PELUQUEROS):
+            crear_peluquero(f"peluquero{i}")
+
+    def reservar(self, i):
+        servicio = self.combo if i % 3 == 0 else self.corte
+        hora = ["10:00", "10:30", "11:00"][i % 3]
+        try:
+            respuesta = Client().post(reverse("agendar_cita_publica"), {
+                "nombre_cliente": f"Cliente {i}", "servicio": servicio.pk,
+                "fecha": MANANA.isoformat(), "hora": hora,
+            })
+            return respuesta.status_code
+        except Exception:
+            return 500
+        finally:
+            connection.close()
+
+    def test_sin_dobles_reservas_ni_errores(self):
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            estados = list(pool.map(self.reservar, range(self.RESERVAS)))
+
+        self.assertNotIn(500, estados)
+        citas = Cita.objects.filter(fecha=MANANA).select_related("servicio")
+        self.assertGreater(len(citas), 0)
+        por_peluquero = {}
+        for c in citas:
+            inicio = c.hora.hour * 60 + c.hora.minute
+            por_peluquero.setdefault(c.peluquero_id, []).append((inicio, inicio + c.servicio.duracion_minutos))
+        for intervalos in por_peluquero.values():
+            intervalos.sort()
+            for (_, fin), (inicio, _) in zip(intervalos, intervalos[1:]):
+                self.assertLessEqual(fin, inicio)
+
+
+class PlanesDeConsultaTests(TestCase):
+    """Las consultas calientes sobre Cita deben usar índices, nunca recorrer la tabla"""
+
+    TABLA = Cita._meta.db_table
+
+    @classmethod
+    def setUpTestData(cls):
+        servicios = [
+            crear_servicio(nombre=f"Servicio {i}", duracion_minutos=30 + 10 * i)
+            for i in range(4)
+        ]
+        cls.peluqueros = [crear_peluquero(f"peluquero{i}") for i in range(6)]
+        cls.cliente = User.objects.create_user(username="cliente", password="clave12345")
+        otro = User.objects.create_user(username="otro", password="clave12345")
+        inicio = MANANA - datetime.timedelta(days=400)
+        citas = []
+        for dia in range(420):
+            fecha = inicio + datetime.timedelta(days=dia)
+            for i, peluquero in enumerate(cls.peluqueros):
+                for hora in (9, 11, 14, 16):
+                    citas.append(Cita(
+                        fecha=fecha, hora=datetime.time(hora, 0), peluquero=peluquero,
+                        servicio=servicios[(dia + i) % 4], usuario=cls.cliente if dia % 7 == i else otro,
+                        estado="completada" if fecha < MANANA else "pendiente",
+                    ))
+        Cita.objects.bulk_create(citas)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def plan(self, sql):
+        prefijo = "EXPLAIN QUERY PLAN " if connection.vendor == "sqlite" else "EXPLAIN "
+        with connection.cursor() as cursor:
+            cursor.execute(prefijo + sql)
+            return "\n".join(" ".join(str(c) for c in fila) for fila in cursor.fetchall())
+
+    def escaneos_completos(self, plan):
+        if connection.vendor == "sqlite":
+            return [l for l in plan.splitlines() if f"SCAN {self.TABLA}" in l and "USING" not in l]
+        return [l for l in plan.splitlines() if f"Seq Scan on {self.TABLA}" in l]
+
+    def assertSinEscaneoCompleto(self, accion, ordenado=False, busqueda=None, sin_orden=False):
+        """`ordenado`: el ORDER BY sale del índice; `busqueda`: texto que debe aparecer en el plan (solo SQLite);
+        `sin_orden`: ninguna consulta pide orden (no hereda el Meta.ordering de Cita)"""
+        with CaptureQueriesContext(connection) as consultas:
+            accion()
+        revisadas = [q["sql"] for q in consultas.captured_queries
+                     if self.TABLA in q["sql"] and q["sql"].lstrip().upper().startswith("SELECT")]
+        self.assertTrue(revisadas, "No se ejecutó ninguna consulta sobre Cita")
+        for sql in revisadas:
+            if sin_orden:
+                self.assertNotIn("ORDER BY", sql, f"Consulta ordenada sin necesidad:\n{sql}")
+            plan = self.plan(sql)
+            self.assertFalse(self.escaneos_completos(plan), f"Escaneo completo de {self.TABLA}:\n{sql}\n{plan}")
+            if connection.vendor != "sqlite":
+                continue
+            if ordenado:
+                self.assertNotIn("TEMP B-TREE FOR ORDER BY", plan, f"Orden sin índice:\n{sql}\n{plan}")
+            if busqueda:
+                self.assertIn(busqueda, plan, f"Plan inesperado:\n{sql}\n{plan}")
+
+    def test_disponibilidad_del_dia(self):
+        self.assertSinEscaneoCompleto(
+            lambda: self.client.get(reverse("obtener_horas_disponibles"), {"fecha": MANANA.isoformat()}),
+            sin_orden=True,
+        )
+
+    def test_asignacion_y_reserva(self):
+        self.assertSinEscaneoCompleto(lambda: self.client.post(reverse("agendar_cita_publica"), {
+            "nombre_cliente": "Juan", "servicio": ServicioCorte.objects.first().pk,
+            "fecha": MANANA.isoformat(), "hora": "10:00",
+        }), sin_orden=True)
+
+    def test_panel_peluquero(self):
+        self.client.force_login(self.peluqueros[0])
+        self.assertSinEscaneoCompleto(lambda: self.client.get(reverse("panel_peluquero")))
+
+    def test_panel_usuario(self):
+        self.client.force_login(self.cliente)
+        self.assertSinEscaneoCompleto(lambda: self.client.get(reverse("panel_usuario")))
+
+    def test_panel_admin_por_rango(self):
+        admin = User.objects.create_superuser(username="admin", password="clave12345")
+        self.client.force_login(admin)
+        self.assertSinEscaneoCompleto(lambda: self.client.get(reverse("panel_admin"), {
+            "desde": MANANA.isoformat(), "hasta": (MANANA + datetime.timedelta(days=7)).isoformat(),
+        }))
+
+    def test_panel_admin_primera_pagina(self):
+        citas = Cita.objects.select_related("usuario", "servicio", "peluquero")
+        self.assertSinEscaneoCompleto(lambda: paginar_citas(citas, None, descendente=True), ordenado=True)
+
+    def test_recalcular_estadisticas_de_fechas(self):
+        fechas = {MANANA, MANANA - datetime.timedelta(days=3)}
+        self.assertSinEscaneoCompleto(lambda: estadisticas.recalcular_fechas(fechas), busqueda="cita_fecha_hora_idx")
+
+
+class PanelPeluqueroTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.ana = crear_peluquero("ana")
+        cls.cliente = User.objects.create_user(username="cliente", password="clave12345")
+        hoy = timezone.localdate()
+        Cita.objects.bulk_create([
+            Cita(fecha=hoy + datetime.timedelta(days=d), hora=datetime.time(9 + h, 0), servicio=cls.corte,
+                 peluquero=cls.ana, usuario=cls.cliente if h % 2 else None)
+            for d in range(-5, 10) for h in range(5)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.ana)
+
+    def test_recorre_paginas_desde_hoy(self):
+        url, vistas = reverse("panel_peluquero"), []
+        while url:
+            respuesta = self.client.get(url)
+            vistas.extend(respuesta.context["citas"])
+            url = respuesta.context["siguiente_url"]
+        self.assertEqual(len(vistas), 50)
+        self.assertEqual(vistas[0].fecha, timezone.localdate())
+        claves = [(c.fecha, c.hora, c.id) for c in vistas]
+        self.assertEqual(claves, sorted(claves))
+
+    def test_filtro_por_rango(self):
+        hoy = timezone.localdate()
+        respuesta = self.client.get(reverse("panel_peluquero"), {
+            "desde": (hoy - datetime.timedelta(days=5)).isoformat(),
+            "hasta": (hoy - datetime.timedelta(days=4)).isoformat(),
+        })
+        self.assertEqual(len(respuesta.context["citas"]), 10)
+        self.assertIsNone(respuesta.context["siguiente_url"])
+
+    def test_consultas_constantes(self):
+        self.client.get(reverse("panel_peluquero"))
+        with CaptureQueriesContext(connection) as primera:
+            self.client.get(reverse("panel_peluquero"), {"hasta": timezone.localdate().isoformat()})
+        with CaptureQueriesContext(connection) as completa:
+            self.client.get(reverse("panel_peluquero"))
+        self.assertEqual(len(primera), len(completa))
+
+
+class PanelAdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.barba = crear_servicio(nombre="Barba", precio=8000)
+        cls.ana = crear_peluquero("ana")
+        cls.admin = User.objects.create_superuser(username="admin", password="clave12345")
+        Cita.objects.bulk_create([
+            Cita(fecha=MANANA + datetime.timedelta(days=d), hora=datetime.time(9 + h, 0),
+                 servicio=cls.corte if h % 2 else cls.barba, peluquero=cls.ana, nombre_cliente=f"Cliente {d}-{h}",
+                 precio=10000 if h % 2 else 8000, estado="completada" if h == 0 else "pendiente")
+            for d in range(30) for h in range(4)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_totales_y_paginacion(self):
+        respuesta = self.client.get(reverse("panel_admin"))
+        self.assertEqual(respuesta.context["totales"]["total"], 120)
+        self.assertEqual(respuesta.context["totales"]["completada"], 30)
+        self.assertEqual(respuesta.context["totales"]["ingresos"], 30 * 8000)
+        self.assertEqual(len(respuesta.context["citas"]), 50)
+        segunda = self.client.get(respuesta.context["siguiente_url"])
+        self.assertLess(segunda.context["citas"][0].fecha, respuesta.context["citas"][0].fecha)
+
+    def test_filtros(self):
+        respuesta = self.client.get(reverse("panel_admin"), {"servicio": self.corte.pk, "estado": "pendiente"})
+        self.assertEqual(respuesta.context["totales"]["total"], 60)
+
+    def test_consultas_constantes(self):
+        with CaptureQueriesContext(connection) as primera:
+            self.client.get(reverse("panel_admin"), {"hasta": MANANA.isoformat()})
+        with CaptureQueriesContext(connection) as completa:
+            self.client.get(reverse("panel_admin"))
+        self.assertEqual(len(primera), len(completa))
+
+    async def test_exportacion_en_streaming(self):
+        async def contenido(respuesta):
+            return b"".join([parte async for parte in respuesta.streaming_content]).decode()
+
+        await self.async_client.aforce_login(self.admin)
+        respuesta = await self.async_client.get(reverse("exportar_citas_admin"), {"formato": "csv", "estado": "completada"})
+        # Iterador asíncrono: bajo ASGI se envía por partes, sin cargarlo entero
+        self.assertTrue(respuesta.streaming)
+        self.assertTrue(respuesta.is_async)
+        lineas = (await contenido(respuesta)).splitlines()
+        self.assertEqual(len(lineas), 31)
+        self.assertTrue(lineas[0].startswith("id,fecha,hora"))
+
+        respuesta = await self.async_client.get(reverse("exportar_citas_admin"), {"formato": "ndjson"})
+        filas = [json.loads(l) for l in (await contenido(respuesta)).splitlines()]
+        self.assertEqual(len(filas), 120)
+        self.assertEqual(filas[0]["peluquero__username"], "ana")
+
+    def test_solo_superusuario(self):
+        self.client.force_login(self.ana)
+        self.assertEqual(self.client.get(reverse("exportar_citas_admin")).status_code, 302)
+
+
+class EstadisticaDiariaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.combo = crear_servicio(nombre="Corte + Barba", duracion_minutos=60, precio=18000)
+        cls.ana = crear_peluquero("ana")
+        cls.beto = crear_peluquero("beto")
+        cls.admin = User.objects.create_superuser(username="admin", password="clave12345")
+
+    def resumen(self):
+        return sorted(EstadisticaDiaria.objects.filter(total__gt=0).values_list(
+            "fecha", "peluquero_id", "servicio_id", "estado", "total", "ingresos", "minutos"
+        ))
+
+    def test_incremental_coincide_con_reconstruccion(self):
+        hoy = timezone.localdate()
+        citas = [
+            Cita.objects.create(fecha=hoy, hora=datetime.time(9 + i, 0), servicio=self.corte if i % 2 else self.combo,
+                                peluquero=self.ana if i % 3 else self.beto)
+            for i in range(6)
+        ]
+        citas[0].estado = "completada"
+        citas[0].save()
+        citas[1].estado = "cancelada"
+        citas[1].save()
+        citas[2].peluquero = self.beto
+        citas[2].fecha = hoy - datetime.timedelta(days=1)
+        citas[2].save()
+        citas[3].servicio = self.combo
+        citas[3].save()
+        citas[4].delete()
+        Cita.objects.only("id").get(pk=citas[5].pk).save()
+
+        incremental = self.resumen()
+        call_command("reconstruir_estadisticas", stdout=open("/dev/null", "w"))
+        self.assertEqual(incremental, self.resumen())
+
+    def test_cambio_de_precio_y_duracion_no_desvia_el_resumen(self):
+        hoy = timezone.localdate()
+        citas = [Cita.objects.create(fecha=hoy, hora=datetime.time(9 + i, 0), servicio=self.corte, peluquero=self.ana)
+                 for i in range(3)]
+        # El catálogo cacheado sobrevive al rollback del test
+        self.addCleanup(cache.clear)
+        servicio = ServicioCorte.objects.get(pk=self.corte.pk)
+        servicio.precio, servicio.duracion_minutos = 12000, 45
+        servicio.save()
+        citas[0].delete()
+        Cita.objects.create(fecha=hoy, hora=datetime.time(15, 0), servicio=self.corte, peluquero=self.ana)
+
+        incremental = self.resumen()
+        # Las dos que quedan conservan su precio; la nueva entra con el vigente
+        self.assertEqual(incremental[0][4:], (3, 32000, 135))
+        call_command("reconstruir_estadisticas", stdout=io.StringIO())
+        self.assertEqual(incremental, self.resumen())
+
+    def test_cambio_de_precio_no_reescribe_lo_cobrado(self):
+        ayer = timezone.localdate() - datetime.timedelta(days=1)
+        cita = Cita.objects.create(fecha=ayer, hora=datetime.time(10, 0), servicio=self.corte, peluquero=self.ana,
+                                   estado="completada")
+        self.addCleanup(cache.clear)
+        servicio = ServicioCorte.objects.get(pk=self.corte.pk)
+        servicio.precio = 12000
+        servicio.save()
+        nueva = Cita.objects.create(fecha=MANANA, hora=datetime.time(10, 0), servicio=self.corte, peluquero=self.ana)
+
+        cita.refresh_from_db()
+        self.assertEqual((cita.precio, nueva.precio), (10000, 12000))
+        self.assertEqual(EstadisticaDiaria.objects.get(fecha=ayer).ingresos, 10000)
+        incremental = self.resumen()
+        call_command("reconstruir_estadisticas", stdout=io.StringIO())
+        self.assertEqual(incremental, self.resumen())
+
+        cita.servicio = self.combo
+        cita.save()
+        self.assertEqual(Cita.objects.get(pk=cita.pk).precio, 18000)
+
+    def test_reportes_leen_solo_el_resumen(self):
+        hoy = timezone.localdate()
+        for i in range(5):
+            Cita.objects.create(fecha=hoy - datetime.timedelta(days=i), hora=datetime.time(10, 0), servicio=self.corte,
+                                peluquero=self.ana, estado="completada" if i else "cancelada")
+        self.client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse("reportes_basicos"), {"agrupacion": "semana"})
+        self.assertFalse([q for q in consultas.captured_queries if Cita._meta.db_table in q["sql"]])
+        self.assertEqual(respuesta.context["cancelaciones"], 1)
+        peluqueros = list(respuesta.context["peluqueros_activos"])
+        self.assertEqual(peluqueros[0]["total"], 4)
+        self.assertEqual(peluqueros[0]["ingresos"], 40000)
+        self.assertEqual(sum(p["total"] for p in respuesta.context["periodos"]), 4)
+
+
+class CatalogoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        crear_servicio(nombre="Oculto", precio=1, activo=False)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_inicio_sin_consultas_y_con_etag(self):
+        self.client.get(reverse("inicio"))
+        with self.assertNumQueries(0):
+            respuesta = self.client.get(reverse("inicio"))
+        self.assertContains(respuesta, "Corte")
+        self.assertNotContains(respuesta, "Oculto")
+        self.assertTrue(respuesta.has_header("ETag"))
+        self.assertTrue(respuesta.has_header("Last-Modified"))
+
+        respuesta = self.client.get(reverse("inicio"), HTTP_IF_NONE_MATCH=respuesta["ETag"])
+        self.assertEqual(respuesta.status_code, 304)
+
+    def test_etag_cambia_con_la_version_de_las_paginas(self):
+        etag = self.client.get(reverse("inicio"))["ETag"]
+        invalidar_paginas()
+        respuesta = self.client.get(reverse("inicio"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta["ETag"], etag)
+
+    def test_cambio_de_servicio_invalida(self):
+        version = obtener_catalogo().version
+        self.corte.precio = 12000
+        self.corte.save()
+        self.assertNotEqual(obtener_catalogo().version, version)
+        self.assertEqual(obtener_catalogo().por_id[self.corte.pk].precio, 12000)
+
+    def test_formulario_valida_servicio_sin_consultas(self):
+        obtener_catalogo()
+        datos = {"nombre_cliente": "Juan", "servicio": self.corte.pk, "fecha": "", "hora": "10:00"}
+        with self.assertNumQueries(0):
+            form = CitaPublicaForm(datos)
+            self.assertEqual(form.fields["servicio"].clean(str(self.corte.pk)), self.corte)
+            self.assertIn("Corte", str(CitaPublicaForm()["servicio"]))
+        inactivo = ServicioCorte.objects.get(nombre="Oculto")
+        self.assertFalse(CitaPublicaForm({**datos, "servicio": inactivo.pk}).fields["servicio"].valid_value(inactivo.pk))
+
+
+class CachePaginasTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        crear_peluquero("ana")
+
+    def setUp(self):
+        cache.clear()
+
+    def token(self, respuesta):
+        return re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', respuesta.content.decode()).group(1)
+
+    def test_get_anonimo_servido_desde_cache(self):
+        url = reverse("agendar_cita_publica")
+        self.client.get(url)
+        aciertos = metricas.contadores().get("cache_pagina_aciertos", 0)
+        otro = Client()
+        with self.assertNumQueries(0):
+            respuesta = otro.get(url)
+        self.assertEqual(metricas.contadores()["cache_pagina_aciertos"], aciertos + 1)
+        self.assertNotIn("citus:hueco", respuesta.content.decode())
+        self.assertIn("Corte", respuesta.content.decode())
+
+    def test_csrf_valido_en_pagina_cacheada(self):
+        url = reverse("agendar_cita_publica")
+        Client().get(url)
+        cliente = Client(enforce_csrf_checks=True)
+        token = self.token(cliente.get(url))
+        respuesta = cliente.post(url, {
+            "csrfmiddlewaretoken": token, "nombre_cliente": "Juan", "servicio": self.corte.pk,
+            "fecha": MANANA.isoformat(), "hora": "10:00",
+        })
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertEqual(Cita.objects.count(), 1)
+
+    def test_mensajes_en_pagina_cacheada(self):
+        self.client.get(reverse("inicio"))
+        self.client.post(reverse("agendar_cita_publica"), {
+            "nombre_cliente": "Juan", "servicio": self.corte.pk, "fecha": MANANA.isoformat(), "hora": "10:00",
+        })
+        self.assertContains(self.client.get(reverse("inicio")), "Tu cita ha sido agendada")
+        self.assertNotContains(self.client.get(reverse("inicio")), "Tu cita ha sido agendada")
+
+    def test_navegacion_cacheada_sigue_el_rol(self):
+        usuario = User.objects.create_user(username="cliente", password="clave12345")
+        self.client.force_login(usuario)
+        self.assertContains(self.client.get(reverse("inicio")), "Mi Panel")
+        usuario.is_superuser = True
+        usuario.save(update_fields=["is_superuser"])
+        respuesta = self.client.get(reverse("inicio"))
+        self.assertContains(respuesta, "Panel Admin")
+        self.assertNotContains(respuesta, "Mi Panel")
+
+    def test_usuarios_registrados_no_usan_la_cache(self):
+        self.client.force_login(User.objects.create_user(username="cliente", password="clave12345"))
+        fallos = metricas.contadores().get("cache_pagina_fallos", 0)
+        self.client.get(reverse("agendar_cita_publica"))
+        self.assertEqual(metricas.contadores().get("cache_pagina_fallos", 0), fallos)
+
+
+class VistasAsincronasTests(TestCase):
+    """Las vistas de lectura atendidas por el handler ASGI (AsyncClient), sin consultas síncronas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.ana = crear_peluquero("ana")
+        cls.cliente = User.objects.create_user(username="cliente", password="clave12345")
+        Cita.objects.create(usuario=cls.cliente, peluquero=cls.ana, servicio=cls.corte, fecha=MANANA,
+                            hora=datetime.time(10, 0), estado="pendiente", nombre_cliente="cliente")
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_horas_disponibles(self):
+        respuesta = await self.async_client.get(
+            reverse("obtener_horas_disponibles"), {"fecha": MANANA.isoformat(), "servicio": self.corte.pk}
+        )
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotIn("10:00", respuesta.json()["horas"])
+        self.assertIn("10:30", respuesta.json()["horas"])
+        self.assertTrue(0 < respuesta.perfil.consultas <= 6, respuesta.perfil.consultas)
+
+        rango = await self.async_client.get(
+            reverse("obtener_horas_rango"), {"desde": MANANA.isoformat(), "hasta": MANANA.isoformat()}
+        )
+        self.assertNotIn("10:00", rango.json()["dias"][MANANA.isoformat()])
+
+    async def test_paginas(self):
+        inicio = await self.async_client.get(reverse("inicio"))
+        self.assertContains(inicio, "Corte")
+        condicional = await self.async_client.get(reverse("inicio"), headers={"if-none-match": inicio["ETag"]})
+        self.assertEqual(condicional.status_code, 304)
+        self.assertContains(await self.async_client.get(reverse("agendar_cita_publica")), "ana")
+
+        await self.async_client.aforce_login(self.cliente)
+        self.assertContains(await self.async_client.get(reverse("panel_usuario")), "Corte")
+        await self.async_client.aforce_login(self.ana)
+        self.assertContains(await self.async_client.get(reverse("panel_peluquero")), "cliente")
+
+    async def test_reserva(self):
+        respuesta = await self.async_client.post(reverse("agendar_cita_publica"), {
+            "nombre_cliente": "Juan", "servicio": self.corte.pk, "fecha": MANANA.isoformat(), "hora": "11:00",
+        })
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertTrue(await Cita.objects.filter(nombre_cliente="Juan", peluquero=self.ana).aexists())
+
+
+class EventosHuecosTests(TestCase):
+    """Avisos SSE de horas ocupadas y liberadas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.ana = crear_peluquero("ana")
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_central_reparte_por_fecha(self):
+        otro_dia = MANANA + datetime.timedelta(days=1)
+        async with eventos.central().suscribir(MANANA) as cola, eventos.central().suscribir(otro_dia) as otra:
+            hilo = threading.Thread(target=eventos.central().publicar, args=(MANANA, {"tipo": "ocupada"}))
+            hilo.start()
+            hilo.join()
+            self.assertEqual(await asyncio.wait_for(cola.get(), 1), {"tipo": "ocupada"})
+            self.assertTrue(otra.empty())
+        self.assertEqual(eventos.central().oyentes(MANANA), 0)
+
+    def reservar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Cita.objects.create(peluquero=self.ana, servicio=self.corte, fecha=MANANA,
+                                       hora=datetime.time(10, 0), estado="pendiente", nombre_cliente="Juan")
+
+    def cancelar(self, cita):
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.estado = "cancelada"
+            cita.save()
+
+    async def test_cambios_de_cita_publicados(self):
+        flujo = eventos.transmitir(MANANA, latido=5, duracion=5)
+        await anext(flujo)
+        cita = await sync_to_async(self.reservar)()
+        ocupada = json.loads((await anext(flujo)).split("data: ", 1)[1])
+        await sync_to_async(self.cancelar)(cita)
+        liberada = json.loads((await anext(flujo)).split("data: ", 1)[1])
+        await flujo.aclose()
+        self.assertEqual((ocupada["tipo"], ocupada["hora"]), ("ocupada", "10:00"))
+        self.assertNotIn("10:00", ocupada["libres"][str(self.corte.pk)])
+        self.assertEqual(liberada["tipo"], "liberada")
+        self.assertIn("10:00", liberada["libres"][str(self.corte.pk)])
+
+    async def test_aviso_publicado_no_calcula_horas(self):
+        async with eventos.central().suscribir(MANANA) as cola:
+            await sync_to_async(self.reservar)()
+            self.assertNotIn("libres", cola.get_nowait())
+
+    def test_central_caida_no_rompe_la_reserva(self):
+        with mock.patch.object(eventos.central(), "hay_oyentes", return_value=True), \
+                mock.patch.object(eventos.central(), "publicar", side_effect=ConnectionError("redis caído")), \
+                self.assertLogs("django", "ERROR"):
+            cita = self.reservar()
+        self.assertTrue(Cita.objects.filter(pk=cita.pk).exists())
+
+    @override_settings(CITAS_EVENTOS_LATIDO=0.05, CITAS_EVENTOS_DURACION=0.3)
+    async def test_flujo_sse(self):
+        respuesta = await self.async_client.get(reverse("eventos_huecos"), {"fecha": MANANA.isoformat()})
+        self.assertEqual(respuesta["Content-Type"], "text/event-stream")
+        flujo = aiter(respuesta.streaming_content)
+        self.assertTrue((await anext(flujo)).startswith(b"retry:"))
+        eventos.central().publicar(MANANA, {"tipo": "liberada", "libres": {}})
+        self.assertTrue((await anext(flujo)).startswith(b"event: liberada\ndata: "))
+        # Latidos hasta cumplir la duración máxima; luego el flujo termina y se desuscribe
+        self.assertIn(b": latido\n\n", [parte async for parte in flujo])
+        self.assertEqual(eventos.central().oyentes(MANANA), 0)
+
+        self.assertEqual((await self.async_client.get(reverse("eventos_huecos"))).status_code, 400)
+
+
+class CitasEnLoteTests(PresupuestoConsultasMixin, TestCase):
+    """Cambios de estado de varias citas con un UPDATE y los resúmenes al día"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.ana = crear_peluquero("ana")
+        cls.beto = crear_peluquero("beto")
+        cls.cliente = User.objects.create_user(username="cliente", email="cliente@citus.test", password="clave12345")
+
+    def setUp(self):
+        def cita(peluquero, hora, estado="pendiente"):
+            return Cita.objects.create(usuario=self.cliente, peluquero=peluquero, servicio=self.corte, fecha=MANANA,
+                                       hora=datetime.time(hora, 0), estado=estado, nombre_cliente="cliente")
+        self.citas = [cita(self.ana, 10), cita(self.ana, 11), cita(self.ana, 12, "completada")]
+        self.ajena = cita(self.beto, 10)
+        self.client.force_login(self.ana)
+
+    def lote(self, **datos):
+        return self.client.post(reverse("citas_en_lote"), json.dumps(datos), content_type="application/json")
+
+    def mapa(self):
+        fila = OcupacionDiaria.objects.filter(peluquero=self.ana, fecha=MANANA).first()
+        return ocupacion.de_bytes(fila.mapa) if fila else 0
+
+    def test_cancelar_en_lote(self):
+        ids = [c.pk for c in self.citas] + [self.ajena.pk, 999999]
+        antes = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.lote(accion="cancelar", ids=ids, motivo="Cierre anticipado")
+        self.assertDentroDelPresupuesto(respuesta)
+        self.assertEqual(respuesta.json(), {
+            "accion": "cancelar",
+            "aplicadas": [self.citas[0].pk, self.citas[1].pk],
+            "omitidas": [self.citas[2].pk],
+            "no_encontradas": [self.ajena.pk, 999999],
+        })
+        self.assertEqual(Cita.objects.filter(estado="cancelada", motivo_cancelacion="Cierre anticipado").count(), 2)
+        self.assertEqual(Cita.objects.filter(estado="cancelada", actualizado_en__gte=antes).count(), 2)
+        self.assertEqual(self.mapa(), 0)
+        canceladas = EstadisticaDiaria.objects.filter(fecha=MANANA, estado="cancelada").aggregate(n=Sum("total"))["n"]
+        self.assertEqual(canceladas, 2)
+        avisos = EventoNotificacion.objects.filter(tipo="cancelada")
+        self.assertEqual(avisos.count(), 2)  # solo al cliente: lo canceló el peluquero
+        self.assertTrue(all("Cierre anticipado" in a.cuerpo for a in avisos))
+        self.assertEqual(Cita.objects.get(pk=self.ajena.pk).estado, "pendiente")
+
+    def test_eliminar_recalcula_una_vez(self):
+        respuesta = self.lote(accion="eliminar", ids=[self.citas[0].pk])
+        self.assertEqual(respuesta.json()["aplicadas"], [self.citas[0].pk])
+        self.assertEqual(self.mapa(), ocupacion.mascara(660, 690))
+        self.assertEqual(EstadisticaDiaria.objects.filter(fecha=MANANA, peluquero=self.ana).aggregate(n=Sum("total"))["n"], 2)
+
+    def test_peticiones_no_validas(self):
+        self.assertEqual(self.lote(accion="borrar", ids=[1]).status_code, 400)
+        self.assertEqual(self.lote(accion="cancelar", ids=[self.citas[0].pk]).status_code, 400)
+        self.assertEqual(self.lote(accion="completar", ids=[]).status_code, 400)
+        self.assertEqual(self.lote(accion="completar", ids=["x"]).status_code, 400)
+
+    def test_accion_del_admin(self):
+        admin = User.objects.create_superuser("jefe", "jefe@citus.test", "clave12345")
+        self.client.force_login(admin)
+        self.client.post(reverse("admin:citas_cita_changelist"), {
+            "action": "completar_seleccionadas", "_selected_action": [c.pk for c in self.citas] + [self.ajena.pk],
+        })
+        self.assertEqual(Cita.objects.filter(estado="completada").count(), 4)
+        self.assertEqual(self.mapa(), 0)
+
+
+class SeriesCitasTests(PresupuestoConsultasMixin, TestCase):
+    """Citas recurrentes reservadas, editadas y canceladas en lote"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.barba = crear_servicio(nombre="Barba", duracion_minutos=60, precio=8000)
+        cls.ana = crear_peluquero("ana")
+        cls.ana.email = "ana@citus.test"
+        cls.ana.save()
+        cls.beto = crear_peluquero("beto")
+        cls.cliente = User.objects.create_user(username="cliente", email="cliente@citus.test", password="clave12345")
+
+    def serie(self, ocurrencias=12, **datos):
+        datos.setdefault("peluquero", self.ana)
+        datos.setdefault("hora", datetime.time(10, 0))
+        return SerieCita(
+            usuario=self.cliente, servicio=self.corte, fecha_inicio=MANANA,
+            intervalo_semanas=2, hasta=MANANA + datetime.timedelta(weeks=2 * (ocurrencias - 1)), **datos
+        )
+
+    def ocupar(self, fecha, peluquero=None, hora=10):
+        return Cita.objects.create(fecha=fecha, hora=datetime.time(hora, 0), servicio=self.corte,
+                                   peluquero=peluquero or self.ana, nombre_cliente="Otro")
+
+    def test_consultas_no_crecen_con_las_ocurrencias(self):
+        consultas = []
+        for ocurrencias in (4, 12):
+            with CaptureQueriesContext(connection) as contexto:
+                resultado = series.crear_serie(self.serie(ocurrencias, hora=datetime.time(9 + ocurrencias // 4, 0)))
+            consultas.append(len(contexto))
+            self.assertEqual(len(resultado["citas"]), ocurrencias)
+        self.assertEqual(consultas[0], consultas[1])
+
+        citas = Cita.objects.filter(serie__isnull=False, hora=datetime.time(12, 0))
+        self.assertEqual(citas.count(), 12)
+        self.assertEqual(citas.first().correo_cliente, "cliente@citus.test")
+        fila = OcupacionDiaria.objects.get(peluquero=self.ana, fecha=MANANA + datetime.timedelta(weeks=22))
+        self.assertEqual(ocupacion.de_bytes(fila.mapa), ocupacion.mascara(720, 750))
+        self.assertEqual(EstadisticaDiaria.objects.filter(estado="pendiente").aggregate(n=Sum("total"))["n"], 16)
+        self.assertEqual(EventoNotificacion.objects.filter(tipo="reservada").count(), 32)
+
+    def test_conflictos_se_informan_antes_de_reservar(self):
+        ocupada = MANANA + datetime.timedelta(weeks=4)
+        self.ocupar(ocupada)
+        with self.assertRaises(series.ConflictoSerie) as error:
+            series.crear_serie(self.serie())
+        self.assertEqual(error.exception.fechas, [ocupada])
+        self.assertFalse(SerieCita.objects.exists())
+        self.assertEqual(Cita.objects.count(), 1)
+
+        resultado = series.crear_serie(self.serie(), omitir_conflictos=True)
+        self.assertEqual(resultado["omitidas"], [ocupada])
+        self.assertEqual(len(resultado["citas"]), 11)
+
+    def test_sin_peluquero_elige_el_de_menos_choques(self):
+        self.ocupar(MANANA, self.ana)
+        resultado = series.crear_serie(self.serie(4, peluquero=None))
+        self.assertEqual(resultado["citas"][0].peluquero_id, self.beto.pk)
+        self.assertEqual(resultado["omitidas"], [])
+
+    def test_reserva_desde_el_panel(self):
+        self.ocupar(MANANA + datetime.timedelta(weeks=2))
+        self.client.force_login(self.cliente)
+        datos = {"servicio": self.corte.pk, "peluquero": self.ana.pk, "fecha_inicio": MANANA.isoformat(),
+                 "hora": "10:00", "intervalo_semanas": 2}
+        respuesta = self.client.post(reverse("agendar_serie"), datos)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertContains(respuesta, (MANANA + datetime.timedelta(weeks=2)).strftime("%d/%m/%Y"))
+
+        respuesta = self.client.post(reverse("agendar_serie"), dict(datos, omitir_conflictos="on"))
+        self.assertRedirects(respuesta, reverse("panel_usuario"), fetch_redirect_response=False)
+        self.assertDentroDelPresupuesto(respuesta)
+        self.assertEqual(Cita.objects.filter(serie__isnull=False).count(), len(series.fechas_serie(SerieCita.objects.get())) - 1)
+
+    def test_editar_y_cancelar_la_serie(self):
+        serie = series.crear_serie(self.serie(4))["citas"][0].serie
+        Cita.objects.filter(serie=serie, fecha=MANANA).update(estado="completada")
+        self.client.force_login(self.cliente)
+
+        respuesta = self.client.post(reverse("editar_serie", args=[serie.pk]), {
+            "servicio": self.barba.pk, "hora": "15:00", "notas": "Con barba",
+        })
+        self.assertRedirects(respuesta, reverse("panel_usuario"), fetch_redirect_response=False)
+        self.assertDentroDelPresupuesto(respuesta)
+        pendientes = Cita.objects.filter(serie=serie, estado="pendiente")
+        self.assertEqual(set(pendientes.values_list("hora", "servicio_id", "precio")),
+                         {(datetime.time(15, 0), self.barba.pk, self.barba.precio)})
+        self.assertEqual(Cita.objects.get(serie=serie, fecha=MANANA).hora, datetime.time(10, 0))
+        fila = OcupacionDiaria.objects.get(peluquero=self.ana, fecha=MANANA + datetime.timedelta(weeks=2))
+        self.assertEqual(ocupacion.de_bytes(fila.mapa), ocupacion.mascara(900, 960))
+        self.assertEqual(EventoNotificacion.objects.filter(tipo="reagendada").count(), 3)
+
+        respuesta = self.client.post(reverse("cancelar_serie", args=[serie.pk]))
+        self.assertDentroDelPresupuesto(respuesta)
+        self.assertEqual(Cita.objects.filter(serie=serie, estado="cancelada").count(), 3)
+        self.assertEqual(SerieCita.objects.get(pk=serie.pk).estado, "cancelada")
+        fila.refresh_from_db()
+        self.assertEqual(ocupacion.de_bytes(fila.mapa), 0)
+
+    def test_edicion_con_choque_no_cambia_nada(self):
+        serie = series.crear_serie(self.serie(4))["citas"][0].serie
+        self.ocupar(MANANA + datetime.timedelta(weeks=6), hora=16)
+        serie.hora = datetime.time(16, 0)
+        with self.assertRaises(series.ConflictoSerie):
+            series.actualizar_serie(serie)
+        self.assertFalse(Cita.objects.filter(serie=serie, hora=datetime.time(16, 0)).exists())
+
+
+class HistorialUsuarioTests(PresupuestoConsultasMixin, TestCase):
+    """Panel del cliente: próximas citas completas e historial paginado en JSON"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.ana = crear_peluquero("ana")
+        cls.cliente = User.objects.create_user(username="cliente", password="clave12345")
+        hoy = timezone.localdate()
+        Cita.objects.bulk_create([
+            Cita(usuario=cls.cliente, servicio=cls.corte, peluquero=cls.ana, estado="completada",
+                 fecha=hoy - datetime.timedelta(days=d), hora=datetime.time(10, 0))
+            for d in range(1, 46)
+        ])
+        cls.proxima = Cita.objects.create(usuario=cls.cliente, servicio=cls.corte, peluquero=cls.ana,
+                                          fecha=MANANA, hora=datetime.time(10, 0))
+        cls.cancelada = Cita.objects.create(usuario=cls.cliente, servicio=cls.corte, peluquero=cls.ana,
+                                            fecha=MANANA, hora=datetime.time(12, 0), estado="cancelada")
+
+    def setUp(self):
+        self.client.force_login(self.cliente)
+
+    def test_panel_solo_carga_las_proximas(self):
+        respuesta = self.client.get(reverse("panel_usuario"))
+        self.assertDentroDelPresupuesto(respuesta)
+        self.assertEqual([c.pk for c in respuesta.context["citas"]], [self.proxima.pk])
+        self.assertTrue(respuesta.context["citas"][0].cancelable)
+
+    def test_historial_paginado_con_consultas_constantes(self):
+        url, cursor, vistas, consultas = reverse("historial_usuario"), None, [], set()
+        while True:
+            respuesta = self.client.get(url, {"cursor": cursor} if cursor else {})
+            consultas.add(self.assertDentroDelPresupuesto(respuesta).consultas)
+            datos = respuesta.json()
+            vistas += datos["citas"]
+            cursor = datos["siguiente"]
+            if not cursor:
+                break
+        self.assertEqual(len(consultas), 1)
+        self.assertEqual(len(vistas), 46)
+        self.assertEqual(vistas[0]["id"], self.cancelada.pk)
+        self.assertEqual(vistas[1]["fecha"], (timezone.localdate() - datetime.timedelta(days=1)).isoformat())
+        self.assertEqual(vistas[1]["servicio"], "Corte")
+        self.assertFalse(any(c["cancelable"] for c in vistas))
+        self.assertNotIn(self.proxima.pk, [c["id"] for c in vistas])
+
+    def test_plazo_de_cancelacion_en_la_consulta(self):
+        Cita.objects.create(usuario=self.cliente, servicio=self.corte, peluquero=self.ana,
+                            fecha=MANANA, hora=datetime.time(11, 0))
+        ahora = timezone.make_aware(datetime.datetime.combine(MANANA, datetime.time(8, 30)))
+        citas = list(historial.proximas(self.cliente, ahora=ahora))
+        self.assertEqual([(c.hora.hour, c.cancelable) for c in citas], [(10, False), (11, True)])
+        with mock.patch("django.utils.timezone.now", return_value=ahora):
+            self.assertEqual([c.puede_cancelar for c in citas], [False, True])
+
+
+class ListaEsperaTests(TestCase):
+    """Horas liberadas por cancelaciones ofrecidas por el worker a quien espera"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.combo = crear_servicio(nombre="Corte + Barba", duracion_minutos=60, precio=18000)
+        cls.ana = crear_peluquero("ana")
+        cls.cliente = User.objects.create_user(username="cliente", email="cliente@citus.test", password="clave12345")
+        cls.eva = User.objects.create_user(username="eva", email="eva@citus.test", password="clave12345")
+        cls.luis = User.objects.create_user(username="luis", email="luis@citus.test", password="clave12345")
+
+    def setUp(self):
+        self.cita = Cita.objects.create(usuario=self.cliente, servicio=self.corte, fecha=MANANA,
+                                        hora=datetime.time(10), peluquero=self.ana)
+
+    def esperar(self, usuario, servicio=None, desde=9, hasta=12):
+        return EsperaCita.objects.create(usuario=usuario, servicio=servicio or self.corte, fecha=MANANA,
+                                         desde=datetime.time(desde), hasta=datetime.time(hasta))
+
+    def cancelar(self):
+        self.client.force_login(self.cliente)
+        self.client.post(reverse("cancelar_cita", args=[self.cita.pk]))
+
+    def test_inscripcion_valida_la_ventana(self):
+        self.client.force_login(self.eva)
+        datos = {"servicio": self.combo.pk, "fecha": MANANA.isoformat(), "desde": "09:00", "hasta": "09:30"}
+        respuesta = self.client.post(reverse("unirse_lista_espera"), datos)
+        self.assertContains(respuesta, "más corta que la duración del servicio")
+        datos["hasta"] = "19:00"
+        self.client.post(reverse("unirse_lista_espera"), datos)
+        espera = EsperaCita.objects.get()
+        self.assertEqual((espera.usuario, espera.hasta, espera.estado), (self.eva, datetime.time(19), "esperando"))
+
+    def test_cita_sin_peluquero_no_libera_hueco(self):
+        self.esperar(self.eva)
+        Cita.objects.filter(pk=self.cita.pk).update(peluquero=None)
+        self.cancelar()
+        self.assertFalse(HuecoLiberado.objects.exists())
+        # Un hueco sin peluquero que ya estaba en la bandeja se descarta sin reservar
+        HuecoLiberado.objects.create(fecha=MANANA, hora=datetime.time(10))
+        self.assertEqual(lista_espera.procesar_lote(), (0, 1, 0))
+        self.assertFalse(Cita.objects.filter(estado="pendiente").exists())
+
+    def test_cancelacion_se_ofrece_en_el_worker(self):
+        no_calza = self.esperar(self.luis, servicio=self.combo, desde=9, hasta=10)
+        espera = self.esperar(self.eva)
+        self.cancelar()
+        # La cancelación solo deja el hueco en la bandeja
+        hueco = HuecoLiberado.objects.get()
+        self.assertEqual((hueco.peluquero, hueco.hora), (self.ana, datetime.time(10)))
+        self.assertEqual(EsperaCita.objects.filter(estado="esperando").count(), 2)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(len(lista_espera.interesados([hueco])), 1)
+        self.assertEqual(lista_espera.procesar_lote(), (0, 1, 1))
+        espera.refresh_from_db()
+        self.assertEqual(espera.estado, "ofrecida")
+        self.assertEqual((espera.cita.usuario, espera.cita.peluquero, espera.cita.hora),
+                         (self.eva, self.ana, datetime.time(10)))
+        self.assertTrue(EventoNotificacion.objects.filter(tipo="oferta", destinatario="eva@citus.test").exists())
+        no_calza.refresh_from_db()
+        self.assertEqual(no_calza.estado, "esperando")
+        self.assertTrue(HuecoLiberado.objects.get().procesado)
+
+    def test_oferta_vencida_pasa_al_siguiente(self):
+        eva, luis = self.esperar(self.eva), self.esperar(self.luis)
+        self.cancelar()
+        lista_espera.procesar_lote()
+        despues = timezone.now() + lista_espera.plazo_oferta() + datetime.timedelta(minutes=1)
+        self.assertEqual(lista_espera.procesar_lote(ahora=despues), (1, 1, 1))
+        eva.refresh_from_db()
+        luis.refresh_from_db()
+        self.assertEqual((eva.estado, eva.cita.estado), ("vencida", "cancelada"))
+        self.assertEqual((luis.estado, luis.cita.hora), ("ofrecida", datetime.time(10)))
+
+    def test_aceptar_o_rechazar_desde_el_panel(self):
+        eva, luis = self.esperar(self.eva), self.esperar(self.luis)
+        self.cancelar()
+        lista_espera.procesar_lote()
+
+        self.client.force_login(self.eva)
+        self.assertContains(self.client.get(reverse("panel_usuario")), "Se liberó una hora para ti")
+        self.client.post(reverse("responder_lista_espera", args=[eva.pk]), {"accion": "rechazar"})
+        eva.refresh_from_db()
+        self.assertEqual((eva.estado, eva.cita.estado), ("cancelada", "cancelada"))
+
+        # El rechazo devuelve la hora a la bandeja: el siguiente la recibe y la acepta
+        lista_espera.procesar_lote()
+        self.client.force_login(self.luis)
+        self.client.post(reverse("responder_lista_espera", args=[luis.pk]), {"accion": "aceptar"})
+        luis.refresh_from_db()
+        self.assertEqual((luis.estado, luis.cita.estado), ("aceptada", "pendiente"))
+        respuesta = self.client.post(reverse("responder_lista_espera", args=[luis.pk]), {"accion": "rechazar"})
+        self.assertEqual(luis.cita.estado, "pendiente")
+        self.assertRedirects(respuesta, reverse("panel_usuario"), fetch_redirect_response=False)
+
+
+class RecordatoriosTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+
+    def crear_cita(self, horas, **datos):
+        inicio = (timezone.localtime() + datetime.timedelta(hours=horas)).replace(second=0, microsecond=0)
+        datos.setdefault("correo_cliente", "cliente@correo.com")
+        return Cita.objects.create(servicio=self.corte, fecha=inicio.date(), hora=inicio.time(), **datos)
+
+    def enviar(self):
+        call_command("enviar_recordatorios", stdout=io.StringIO())
+
+    def test_envia_solo_la_ventana_una_vez(self):
+        proxima = self.crear_cita(2, nombre_cliente="Juan")
+        self.crear_cita(30)
+        self.crear_cita(3, estado="cancelada")
+        self.enviar()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["cliente@correo.com"])
+        self.assertIn("Juan", mail.outbox[0].body)
+        proxima.refresh_from_db()
+        self.assertIsNotNone(proxima.recordatorio_enviado_en)
+
+        self.enviar()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_lotes_no_se_solapan(self):
+        for i in range(5):
+            self.crear_cita(1 + i * 0.1)
+        lote_a, pks_a = recordatorios.reclamar_lote(tamano=3)
+        lote_b, pks_b = recordatorios.reclamar_lote(tamano=3)
+        self.assertEqual(len(pks_a), 3)
+        self.assertEqual(len(pks_b), 2)
+        self.assertFalse(set(pks_a) & set(pks_b))
+        self.assertEqual(recordatorios.reclamar_lote(), (None, []))
+
+    def test_guardado_con_copia_vieja_no_borra_la_marca(self):
+        cita = self.crear_cita(2)
+        copia = Cita.objects.get(pk=cita.pk)
+        self.enviar()
+        copia.notas = "Trae foto de referencia"
+        copia.save(update_fields=["notas"])
+        cita.refresh_from_db()
+        self.assertIsNotNone(cita.recordatorio_enviado_en)
+
+    def test_guardado_completo_respeta_la_marca_y_la_fila_borrada(self):
+        cita = self.crear_cita(2)
+        cita.recordatorio_enviado_en = timezone.now()
+        cita.save()
+        self.assertIsNotNone(Cita.objects.get(pk=cita.pk).recordatorio_enviado_en)
+
+        # Un guardado completo de una cita borrada la vuelve a insertar
+        Cita.objects.filter(pk=cita.pk).delete()
+        cita.save()
+        self.assertTrue(Cita.objects.filter(pk=cita.pk).exists())
+
+    def test_reagendar_con_campos_pedidos_pide_un_recordatorio_nuevo(self):
+        cita = self.crear_cita(2)
+        self.enviar()
+        cita.refresh_from_db()
+        cita.hora = datetime.time(8, 0) if cita.hora != datetime.time(8, 0) else datetime.time(9, 0)
+        cita.save(update_fields=["hora"])
+        cita.refresh_from_db()
+        self.assertIsNone(cita.recordatorio_enviado_en)
+        self.assertEqual(cita.hora_fin, solapes.hora_fin(cita.hora, 30))
+
+    def test_envia_por_tramos_y_marca_cada_tramo(self):
+        citas = [self.crear_cita(1 + i * 0.1) for i in range(5)]
+        llamadas = []
+
+        class Conexion:
+            def send_messages(self, mensajes):
+                llamadas.append(len(mensajes))
+                if len(llamadas) == 2:
+                    raise ConnectionResetError("se cortó la conexión")
+
+        lote, pks = recordatorios.reclamar_lote()
+        with self.assertRaises(ConnectionResetError):
+            recordatorios.enviar_lote(lote, pks, Conexion(), tamano=2)
+        self.assertEqual(llamadas, [2, 2])
+        enviadas = Cita.objects.filter(recordatorio_enviado_en__isnull=False)
+        self.assertEqual(set(enviadas.values_list("pk", flat=True)), {citas[0].pk, citas[1].pk})
+        # El tramo fallido y los siguientes quedan libres para otra ejecución
+        self.assertFalse(Cita.objects.filter(recordatorio_enviado_en__isnull=True, recordatorio_lote__isnull=False).exists())
+
+    def test_lote_retomado_por_otra_ejecucion_no_se_marca(self):
+        for i in range(4):
+            self.crear_cita(1 + i * 0.1)
+        lote, pks = recordatorios.reclamar_lote()
+
+        class Conexion:
+            def send_messages(self, mensajes):
+                # Mientras tanto el lote venció y otra ejecución reclamó lo que faltaba
+                Cita.objects.filter(pk__in=pks[2:]).update(recordatorio_lote="otra")
+
+        self.assertEqual(recordatorios.enviar_lote(lote, pks, Conexion(), tamano=2), 2)
+        self.assertEqual(Cita.objects.filter(recordatorio_lote="otra", recordatorio_enviado_en__isnull=True).count(), 2)
+
+    def test_reagendar_pide_un_recordatorio_nuevo(self):
+        cita = self.crear_cita(2)
+        self.enviar()
+        cita.refresh_from_db()
+        cita.fecha += datetime.timedelta(days=3)
+        cita.save()
+        cita.refresh_from_db()
+        self.assertIsNone(cita.recordatorio_enviado_en)
+
+
+class BackendQueFalla:
+    """Backend de correo de prueba: el servidor nunca responde"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def open(self):
+        raise ConnectionRefusedError("servidor caído")
+
+    def close(self):
+        pass
+
+
+class NotificacionesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.ana = crear_peluquero("ana")
+        cls.ana.email = "ana@citus.cl"
+        cls.ana.save()
+
+    def reservar(self, hora, correo="cliente@correo.com"):
+        return self.client.post(reverse("agendar_cita_publica"), {
+            "nombre_cliente": "Juan", "correo_cliente": correo, "servicio": self.corte.pk,
+            "fecha": MANANA.isoformat(), "hora": hora,
+        })
+
+    def test_reserva_encola_sin_enviar(self):
+        self.reservar("10:00")
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            sorted(EventoNotificacion.objects.values_list("destinatario", flat=True)),
+            ["ana@citus.cl", "cliente@correo.com"],
+        )
+
+    def test_cancelacion_del_peluquero_avisa_al_cliente(self):
+        self.reservar("10:00")
+        EventoNotificacion.objects.all().delete()
+        cita = Cita.objects.get()
+        self.client.force_login(self.ana)
+        self.client.post(reverse("cancelar_cita_peluquero", args=[cita.pk]), {"motivo_cancelacion": "Enfermo"})
+        evento = EventoNotificacion.objects.get()
+        self.assertEqual((evento.tipo, evento.destinatario), ("cancelada", "cliente@correo.com"))
+        self.assertIn("Enfermo", evento.cuerpo)
+
+    def test_worker_agrupa_por_destinatario(self):
+        self.reservar("10:00")
+        self.reservar("11:00")
+        self.assertEqual(notificaciones.procesar_lote(concurrencia=2), (4, 0))
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ["ana@citus.cl", "cliente@correo.com"])
+        self.assertFalse(EventoNotificacion.objects.exclude(estado="enviada").exists())
+        self.assertEqual(notificaciones.procesar_lote(), (0, 0))
+
+    @override_settings(EMAIL_BACKEND="citas.tests.BackendQueFalla")
+    def test_fallo_reintenta_con_espera(self):
+        self.reservar("10:00")
+        self.assertEqual(notificaciones.procesar_lote(), (0, 2))
+        evento = EventoNotificacion.objects.first()
+        self.assertEqual((evento.estado, evento.intentos), ("pendiente", 1))
+        self.assertGreater(evento.disponible_en, timezone.now())
+        self.assertIn("servidor caído", evento.ultimo_error)
+        # Todavía en espera: el siguiente lote no lo toma
+        self.assertEqual(notificaciones.procesar_lote(), (0, 0))
+
+    def test_lote_retomado_no_se_pisa(self):
+        self.reservar("10:00")
+        self.reservar("11:00")
+
+        reclamar = notificaciones.reclamar
+
+        def reclamar_y_vencer(*args, **kwargs):
+            eventos = reclamar(*args, **kwargs)
+            # El plazo vence durante el envío y otro worker retoma los eventos del cliente
+            EventoNotificacion.objects.filter(destinatario="cliente@correo.com").update(lote="otro")
+            return eventos
+
+        with mock.patch.object(notificaciones, "reclamar", reclamar_y_vencer):
+            self.assertEqual(notificaciones.procesar_lote(), (2, 0))
+        retomados = EventoNotificacion.objects.filter(destinatario="cliente@correo.com")
+        self.assertEqual(set(retomados.values_list("estado", "intentos", "lote")), {("enviando", 0, "otro")})
+
+
+class IntercambioCitasTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        cls.ana = crear_peluquero("ana")
+
+    def setUp(self):
+        self.carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(self.carpeta.cleanup)
+
+    def archivo(self, nombre, contenido):
+        ruta = os.path.join(self.carpeta.name, nombre)
+        with open(ruta, "w", encoding="utf-8") as f:
+            f.write(contenido)
+        return ruta
+
+    def importar(self, ruta, **opciones):
+        salida, errores = io.StringIO(), io.StringIO()
+        call_command("importar_citas", ruta, stdout=salida, stderr=errores, **opciones)
+        return salida.getvalue(), errores.getvalue()
+
+    def test_importa_csv_y_detecta_conflictos(self):
+        fecha = MANANA.isoformat()
+        ruta = self.archivo("citas.csv", "fecha,hora,estado,servicio,peluquero,nombre_cliente\n"
+                            f"{fecha},10:00,pendiente,Corte,ana,Juan\n"
+                            f"{fecha},10:00,pendiente,Corte,ana,Pedro\n"
+                            f"{fecha},11:00,pendiente,Teñido,ana,Luis\n"
+                            f"{fecha},12:00,completada,Corte,,Diego\n")
+        salida, errores = self.importar(ruta, lote=2)
+        self.assertIn("Citas creadas: 2, ya importadas: 0, conflictos: 1, registros inválidos: 1", salida)
+        self.assertIn("Registro 3: servicio desconocido", errores)
+        self.assertFalse(os.path.exists(ruta + ".checkpoint"))
+        # Los resúmenes se mantienen aunque bulk_create no emita señales
+        self.assertTrue(OcupacionDiaria.objects.filter(peluquero=self.ana, fecha=MANANA).exists())
+        self.assertEqual(EstadisticaDiaria.objects.filter(fecha=MANANA).aggregate(t=Sum("total"))["t"], 2)
+
+    def test_reanuda_desde_el_checkpoint(self):
+        lineas = [json.dumps({"fecha": MANANA.isoformat(), "hora": f"{h}:00", "servicio": "Corte", "peluquero": "ana"})
+                  for h in (10, 11, 12)]
+        ruta = self.archivo("citas.jsonl", "\n".join(lineas) + "\n")
+        with open(ruta + ".checkpoint", "w") as f:
+            json.dump({"registros": 2}, f)
+        salida, _ = self.importar(ruta)
+        self.assertIn("Citas creadas: 1", salida)
+        self.assertEqual(Cita.objects.get().hora, datetime.time(12, 0))
+
+    def test_reimportar_no_duplica_el_historial(self):
+        ayer = (timezone.localdate() - datetime.timedelta(days=1)).isoformat()
+        ruta = self.archivo("historial.csv", "fecha,hora,estado,servicio,peluquero,correo_cliente\n"
+                            f"{ayer},10:00,completada,Corte,ana,juan@correo.com\n"
+                            f"{ayer},10:00,cancelada,Corte,ana,pedro@correo.com\n")
+        self.importar(ruta)
+        # Como si el proceso hubiera caído antes de escribir el punto de control
+        salida, _ = self.importar(ruta)
+        self.assertIn("Citas creadas: 0, ya importadas: 2", salida)
+        self.assertEqual(Cita.objects.count(), 2)
+
+    def test_exportacion_se_puede_volver_a_importar(self):
+        Cita.objects.create(servicio=self.corte, fecha=MANANA, hora=datetime.time(10), peluquero=self.ana,
+                            nombre_cliente="Juan")
+        ruta = os.path.join(self.carpeta.name, "citas.csv")
+        call_command("exportar_citas", salida=ruta, stderr=io.StringIO())
+        Cita.objects.all().delete()
+        salida, _ = self.importar(ruta)
+        self.assertIn("Citas creadas: 1", salida)
+        self.assertEqual(Cita.objects.get().nombre_cliente, "Juan")
+
+    def test_cargar_servicios_es_idempotente(self):
+        call_command("cargar_servicios", stdout=io.StringIO())
+        total = ServicioCorte.objects.count()
+        call_command("cargar_servicios", stdout=io.StringIO())
+        self.assertEqual(ServicioCorte.objects.count(), total)
+        self.assertTrue(PerfilUsuario.objects.get(usuario__username="admin_barber").es_peluquero)
+
+    def test_cargar_servicios_propaga_la_duracion(self):
+        self.addCleanup(cache.clear)
+        call_command("cargar_servicios", stdout=io.StringIO())
+        ServicioCorte.objects.filter(nombre="Corte Clasico").update(duracion_minutos=45, precio=5000)
+        servicio = ServicioCorte.objects.get(nombre="Corte Clasico")
+        peluquero = User.objects.get(username="admin_barber")
+        cita = Cita.objects.create(servicio=servicio, fecha=MANANA, hora=datetime.time(12), peluquero=peluquero)
+        self.assertEqual(cita.hora_fin, datetime.time(12, 45))
+        cache.clear()
+
+        call_command("cargar_servicios", stdout=io.StringIO())
+        cita.refresh_from_db()
+        self.assertEqual(cita.hora_fin, datetime.time(12, 30))
+        fila = OcupacionDiaria.objects.get(peluquero=peluquero, fecha=MANANA)
+        self.assertEqual(ocupacion.de_bytes(fila.mapa), ocupacion.mascara(720, 750))
+        estadistica = EstadisticaDiaria.objects.get(servicio=servicio)
+        # El precio quedó fijado al reservar; la duración sí se propaga
+        self.assertEqual((estadistica.ingresos, estadistica.minutos), (5000, 30))
+
+
+class BenchmarkTests(TestCase):
+    def test_siembra_y_mide_todos_los_escenarios(self):
+        datos = datos_benchmark.sembrar(peluqueros=2, servicios=3, anios=0.05, clientes=5, citas_por_dia=3)
+        self.assertTrue(Cita.objects.filter(fecha__lt=timezone.localdate(), estado="completada").exists())
+        resultados = medicion.medir(datos, repeticiones=3)
+        self.assertEqual(set(resultados), {"horas", "agendar_get", "agendar_post", "peluquero", "panel", "reportes"})
+        for nombre, medida in resultados.items():
+            self.assertTrue(set(medida["estados"]) <= {200, 302}, nombre)
+        self.assertEqual(Cita.objects.filter(nombre_cliente="Carga").count(), 1 + 3 + medicion.PETICIONES_MEMORIA)
+
+    def test_comparar_marca_regresiones(self):
+        base = {"horas": {"p95_ms": 10.0, "consultas": 2}}
+        self.assertEqual(medicion.comparar(base, {"horas": {"p95_ms": 11.5, "consultas": 2}}), [])
+        self.assertEqual(len(medicion.comparar(base, {"horas": {"p95_ms": 15.0, "consultas": 3}})), 2)
+        self.assertEqual(medicion.percentil([1, 2, 3, 4, 5], 50), 3)
+
+
+@override_settings(CITAS_PERFILADO_LENTO_MS=60000)
+class BaseDatosTests(TransactionTestCase):
+    """PRAGMAs de SQLite por conexión y reservas concurrentes medidas por el benchmark de escritura"""
+
+    def pragma(self, nombre):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {nombre}")
+            return cursor.fetchone()[0]
+
+    def test_conexion_nueva_en_wal(self):
+        connection.close()
+        self.assertEqual(self.pragma("journal_mode"), "wal")
+        self.assertEqual(self.pragma("synchronous"), 1)  # NORMAL
+        self.assertEqual(self.pragma("busy_timeout"), int(connection.settings_dict["OPTIONS"]["timeout"] * 1000))
+
+    @override_settings(CITAS_SQLITE_DIARIO="delete", CITAS_SQLITE_SINCRONICO="full")
+    def test_modo_configurable(self):
+        connection.close()
+        self.addCleanup(connection.close)
+        self.assertEqual(self.pragma("journal_mode"), "delete")
+        self.assertEqual(self.pragma("synchronous"), 2)  # FULL
+
+    def test_reservas_concurrentes_sin_errores(self):
+        datos = datos_benchmark.sembrar(peluqueros=2, servicios=1, anios=0, clientes=2, citas_por_dia=1, dias_futuros=1)
+        connection.close()
+        resultado = escritura.medir_reservas(datos, reservas=20, hilos=4)
+        self.assertEqual(resultado["errores"], 0)
+        self.assertEqual(Cita.objects.filter(nombre_cliente="Carga").count(), 20)
+
+
+class PresupuestoConsultasTests(PresupuestoConsultasMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = datos_benchmark.sembrar(peluqueros=2, servicios=3, anios=0.05, clientes=3, citas_por_dia=4)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_vistas_principales_dentro_del_presupuesto(self):
+        datos = self.datos
+        servicio = datos.servicios[0].pk
+        visitas = [
+            (None, reverse("inicio")),
+            (None, reverse("agendar_cita_publica")),
+            (None, f"{reverse('obtener_horas_disponibles')}?fecha={datos.hasta}&servicio={servicio}"),
+            (None, f"{reverse('obtener_horas_rango')}?desde={datos.hasta}&hasta={datos.hasta}&servicio={servicio}"),
+            (datos.clientes[0], reverse("panel_usuario")),
+            (datos.peluqueros[0], reverse("panel_peluquero")),
+            (datos.admin, reverse("panel_admin")),
+            (datos.admin, reverse("reportes_basicos")),
+            (datos.admin, reverse("exportar_citas_admin")),
+        ]
+        for usuario, url in visitas:
+            with self.subTest(url=url):
+                cliente = Client()
+                if usuario:
+                    cliente.force_login(usuario)
+                respuesta = cliente.get(url)
+                self.assertEqual(respuesta.status_code, 200)
+                self.assertDentroDelPresupuesto(respuesta)
+
+    def test_reserva_dentro_del_presupuesto(self):
+        fecha = self.datos.hasta + datetime.timedelta(days=2)
+        respuesta = self.client.post(reverse("agendar_cita_publica"), {
+            "nombre_cliente": "Juan", "servicio": self.datos.servicios[0].pk,
+            "fecha": fecha.isoformat(), "hora": "10:00",
+        })
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertDentroDelPresupuesto(respuesta)
+
+    @override_settings(CITAS_PERFILADO_CABECERAS=True)
+    def test_cabecera_server_timing(self):
+        respuesta = self.client.get(f"{reverse('obtener_horas_disponibles')}?fecha={self.datos.hasta}")
+        self.assertRegex(respuesta["Server-Timing"], r'db;dur=[\d.]+;desc="\d+ consultas", tpl;dur=[\d.]+, total;dur=')
+
+    @override_settings(CITAS_PERFILADO=False)
+    def test_sin_perfilado_solo_cuenta_consultas(self):
+        respuesta = Client().get(reverse("inicio"))
+        perfil = respuesta.perfil
+        self.assertGreater(perfil.consultas, 0)
+        self.assertFalse(perfil.formas)
+        self.assertEqual(perfil.plantillas_ms, 0)
+        self.assertIn('citus_peticion_segundos_count{vista="inicio"}', metricas.exportar())
+
+    @override_settings(CITAS_PERFILADO=True)
+    def test_perfilado_mide_plantillas(self):
+        perfil = Client().get(reverse("inicio")).perfil
+        self.assertGreater(perfil.plantillas_ms, 0)
+        self.assertEqual(sum(perfil.formas.values()), perfil.consultas)
+
+    def test_detecta_consultas_repetidas(self):
+        perfil = Perfil()
+        for pk in range(6):
+            perfil.formas[f"SELECT * FROM citas_cita WHERE id = {pk} AND estado IN (%s, %s)"] += 1
+        perfil.formas["SELECT * FROM citas_cita WHERE estado IN (%s, %s, %s)"] += 1
+        self.assertEqual(perfil.repetidas(), [("SELECT * FROM citas_cita WHERE id = ? AND estado IN (…)", 6)])
+        perfil.consultas, perfil.presupuesto = 7, 6
+        self.assertTrue(perfil.excede_presupuesto)
+
+
+@override_settings(CITAS_METRICAS_IPS=["127.0.0.1"], CITAS_METRICAS_TOKEN="")
+class MetricasTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.corte = crear_servicio()
+        crear_peluquero("ana")
+
+    def valor(self, texto, linea):
+        coincidencia = re.search(rf"^{re.escape(linea)} (\S+)$", texto, re.M)
+        return float(coincidencia.group(1)) if coincidencia else 0.0
+
+    def test_embudo_y_latencias_en_metrics(self):
+        antes = self.client.get(reverse("metricas")).content.decode()
+        self.client.get(reverse("obtener_horas_disponibles"), {"fecha": MANANA.isoformat()})
+        datos = {"nombre_cliente": "Juan", "servicio": self.corte.pk, "fecha": MANANA.isoformat(), "hora": "10:00"}
+        self.client.post(reverse("agendar_cita_publica"), datos)
+        self.client.post(reverse("agendar_cita_publica"), datos)
+        respuesta = self.client.get(reverse("metricas"))
+        self.assertEqual(respuesta["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        despues = respuesta.content.decode()
+
+        for etapa, esperado in (("disponibilidad", 1), ("envio", 2), ("reservada", 1), ("invalida", 1)):
+            linea = f'citus_embudo_reserva_total{{etapa="{etapa}"}}'
+            self.assertEqual(self.valor(despues, linea) - self.valor(antes, linea), esperado, etapa)
+        linea = 'citus_asignaciones_total{resultado="unico_libre"}'
+        self.assertEqual(self.valor(despues, linea) - self.valor(antes, linea), 1)
+        self.assertIn("# TYPE citus_peticion_segundos histogram", despues)
+        self.assertIn('citus_peticion_segundos_bucket{vista="obtener_horas_disponibles",le="+Inf"}', despues)
+
+    def test_metrics_restringido(self):
+        self.assertEqual(self.client.get(reverse("metricas"), REMOTE_ADDR="10.1.2.3").status_code, 403)
+
+    @override_settings(CITAS_METRICAS_IPS=[])
+    def test_metrics_desactivado_sin_configuracion(self):
+        self.assertEqual(self.client.get(reverse("metricas")).status_code, 404)
+
+    @override_settings(CITAS_METRICAS_IPS=[], CITAS_METRICAS_TOKEN="secreto")
+    def test_metrics_con_token(self):
+        url = reverse("metricas")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Bearer otro").status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Bearer secreto").status_code, 200)
+
+    def test_hilos_se_suman_al_leer(self):
+        def trabajar():
+            for _ in range(1000):
+                metricas.incrementar("prueba_hilos")
+        hilos = [threading.Thread(target=trabajar) for _ in range(4)]
+        antes = metricas.contadores().get("prueba_hilos", 0)
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        self.assertEqual(metricas.contadores()["prueba_hilos"] - antes, 4000)
+
+    def test_hilos_terminados_no_acumulan_porciones(self):
+        antes = metricas.contadores().get("prueba_hilos_cortos", 0)
+        porciones = len(metricas._porciones)
+        for _ in range(50):
+            hilo = threading.Thread(target=metricas.incrementar, args=("prueba_hilos_cortos",))
+            hilo.start()
+            hilo.join()
+        self.assertLessEqual(len(metricas._porciones), porciones)
+        self.assertEqual(metricas.contadores()["prueba_hilos_cortos"] - antes, 50)
+
+    def test_histograma_acumulado(self):
+        metricas.observar("prueba_histograma", 3, limites=(1, 5), caso="a")
+        metricas.observar("prueba_histograma", 7, limites=(1, 5), caso="a")
+        texto = metricas.exportar()
+        self.assertIn('citus_prueba_histograma_bucket{caso="a",le="1"} 0', texto)
+        self.assertIn('citus_prueba_histograma_bucket{caso="a",le="5"} 1', texto)
+        self.assertIn('citus_prueba_histograma_bucket{caso="a",le="+Inf"} 2', texto)
+        self.assertIn('citus_prueba_histograma_sum{caso="a"} 10', texto)
@@ -1,10 +1,32 @@
+import asyncio
+import csv
+import hmac
+import json
+
+from asgiref.sync import sync_to_async
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
+from django.contrib.messages import get_messages
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.utils import timezone
-from django.http import JsonResponse
-from .forms import CustomUserCreationForm, CitaPublicaForm, CitaEstadoForm, ReagendarCitaPeluqueroForm, CancelarCitaPeluqueroForm
-from .models import Cita, ServicioCorte, PerfilUsuario
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition, require_POST
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from .forms import aopciones_peluqueros, CustomUserCreationForm, EsperaCitaForm, SerieCitaForm, CitaPublicaForm, CitaEstadoForm, ReagendarCitaPeluqueroForm, CancelarCitaPeluqueroForm, FiltroFechasForm, FiltroCitasAdminForm, ReporteForm
+from .models import Cita, EsperaCita, EstadisticaDiaria, PerfilUsuario, SerieCita
+from . import eventos, historial, lista_espera, lotes, metricas, notificaciones, series
+from .asincrono import preparar_peticion, resolver_usuario
+from .cache_paginas import cachear_pagina_anonima, version_paginas
+from .catalogo import aobtener_catalogo, obtener_catalogo
+from .paginacion import apaginar_citas
+from .perfilado import presupuesto_consultas
+from .reservas import reagendar_cita as guardar_reagendamiento, reservar_cita
+from .disponibilidad import AgendaDia, INTERVALO_MINUTOS, adisponibilidad_rango
 from django.contrib.auth import login as auth_login
 from django.core.exceptions import ValidationError
 from django.contrib.auth import logout
@@ -13,7 +35,7 @@ from django.contrib.auth import logout
 def finalizar_cita(request, cita_id):
     cita = get_object_or_404(Cita, id=cita_id, peluquero=request.user)
     cita.estado = 'completada'
-    cita.save()
+    cita.save(update_fields=['estado', 'actualizado_en'])
     messages.success(request, f"La cita del {cita.fecha} a las {cita.hora} ha sido marcada como completada ✅")
     return redirect('panel_peluquero')
 
@@ -26,7 +48,9 @@ def cancelar_cita_peluquero(request, cita_id):
         if form.is_valid():
             cita.estado = 'cancelada'
             cita.motivo_cancelacion = form.cleaned_data['motivo_cancelacion']
-            cita.save()
+            with transaction.atomic():
+                cita.save(update_fields=['estado', 'motivo_cancelacion', 'actualizado_en'])
+                notificaciones.registrar(cita, 'cancelada', por='peluquero', motivo=cita.motivo_cancelacion)
             messages.warning(request, "La cita ha sido cancelada")
             return redirect('panel_peluquero')
     else:
@@ -44,9 +68,13 @@ def reagendar_cita_peluquero(request, cita_id):
             cita.hora = form.cleaned_data['nueva_hora']
             cita.motivo_reagendamiento = form.cleaned_data['motivo_reagendamiento']
             cita.estado = 'pendiente'
-            cita.save()
-            messages.info(request, "La cita ha sido reagendada correctamente")
-            return redirect('panel_peluquero')
+            try:
+                guardar_reagendamiento(cita, por='peluquero', motivo=cita.motivo_reagendamiento)
+            except ValidationError as e:
+                form.add_error(None, e)
+            else:
+                messages.info(request, "La cita ha sido reagendada correctamente")
+                return redirect('panel_peluquero')
     else:
         form = ReagendarCitaPeluqueroForm()
     return render(request, "reagendar_cita_peluquero.html", {"form": form, "cita": cita})
@@ -84,105 +112,214 @@ def registro(request):
 #   FUNCIONES GENERALES
 # -----------------------
 
-def inicio(request):
-    servicios = ServicioCorte.objects.filter(activo=True)
-    return render(request, "index.html", {"servicios": servicios})
+def _etag_inicio(request):
+    # Solo los visitantes anónimos sin mensajes pendientes ven la misma página
+    if request.user.is_authenticated or len(get_messages(request)):
+        return None
+    # La navegación y el resto de la plantilla dependen también de version_paginas
+    return f"{version_paginas()}-{obtener_catalogo().version}"
+
+
+def _modificado_inicio(request):
+    if request.user.is_authenticated or len(get_messages(request)):
+        return None
+    return obtener_catalogo().actualizado
+
 
+# condition llama a las funciones de ETag de forma síncrona: preparar_peticion
+# deja antes el usuario y el catálogo cargados
+@preparar_peticion
+@condition(etag_func=_etag_inicio, last_modified_func=_modificado_inicio)
+@cachear_pagina_anonima
+@presupuesto_consultas(5)
+async def inicio(request):
+    catalogo = await aobtener_catalogo()
+    return render(request, "index.html", {"servicios": catalogo.servicios})
 
-def obtener_horas_disponibles(request):
-    fecha = request.GET.get("fecha")
+
+def _parsear_fecha(valor):
+    try:
+        return timezone.datetime.strptime(valor or "", "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def _duracion_solicitada(request, catalogo):
+    """Duración del servicio indicado en ?servicio= (None si no es válido)"""
+    servicio_id = request.GET.get("servicio")
+    if not servicio_id:
+        return INTERVALO_MINUTOS
+    if not servicio_id.isdigit():
+        return None
+    servicio = catalogo.por_id.get(int(servicio_id))
+    return servicio.duracion_minutos if servicio else None
+
+
+@presupuesto_consultas(6)
+async def obtener_horas_disponibles(request):
+    fecha = _parsear_fecha(request.GET.get("fecha"))
     if not fecha:
         return JsonResponse({"error": "Fecha no válida"}, status=400)
 
-    fecha = timezone.datetime.strptime(fecha, "%Y-%m-%d").date()
-    horas_ocupadas = Cita.objects.filter(
-        fecha=fecha,
-        estado__in=["pendiente", "confirmada"]
-    ).values_list("hora", flat=True)
+    # Catálogo, peluqueros y citas del día son independientes: se piden a la vez
+    catalogo, agenda = await asyncio.gather(aobtener_catalogo(), AgendaDia.acargar(fecha))
+    duracion = _duracion_solicitada(request, catalogo)
+    if duracion is None:
+        return JsonResponse({"error": "Servicio no válido"}, status=400)
+
+    horas = agenda.inicios_libres(duracion)
+    metricas.incrementar('embudo_reserva', etapa='disponibilidad')
+    return JsonResponse({"horas": [h.strftime("%H:%M") for h in horas]})
 
-    todas_horas = [timezone.datetime.strptime(f"{h:02d}:00", "%H:%M").time() for h in range(9, 19)]
-    disponibles = [h.strftime("%H:%M") for h in todas_horas if h not in horas_ocupadas]
-    return JsonResponse({"horas": disponibles})
 
+MAX_DIAS_RANGO = 60
 
-def _asignar_peluquero_automatico(cita: Cita):
-    """Asigna automáticamente un peluquero según menor carga"""
-    peluqueros = PerfilUsuario.objects.filter(es_peluquero=True).select_related('usuario')
-    if not peluqueros.exists():
-        return  # ⚠️ Si no hay peluqueros, no hace nada
-    cargas = []
-    for p in peluqueros:
-        cantidad = Cita.objects.filter(peluquero=p.usuario, fecha=cita.fecha).count()
-        cargas.append((cantidad, p.usuario))
-    cargas.sort(key=lambda x: x[0])
-    cita.peluquero = cargas[0][1]  # ✅ Asignación directa
 
+@presupuesto_consultas(6)
+async def obtener_horas_rango(request):
+    """Horas libres para varios días en una sola respuesta (máximo 60)"""
+    desde = _parsear_fecha(request.GET.get("desde"))
+    hasta = _parsear_fecha(request.GET.get("hasta"))
+    if not desde or not hasta or hasta < desde:
+        return JsonResponse({"error": "Rango de fechas no válido"}, status=400)
+    if (hasta - desde).days >= MAX_DIAS_RANGO:
+        return JsonResponse({"error": f"El rango no puede superar {MAX_DIAS_RANGO} días"}, status=400)
 
+    duracion = _duracion_solicitada(request, await aobtener_catalogo())
+    if duracion is None:
+        return JsonResponse({"error": "Servicio no válido"}, status=400)
 
-def agendar_cita_publica(request):
+    dias = await adisponibilidad_rango(desde, hasta, duracion)
+    metricas.incrementar('embudo_reserva', etapa='disponibilidad')
+    return JsonResponse({
+        "dias": {f.isoformat(): [h.strftime("%H:%M") for h in horas] for f, horas in dias.items()}
+    })
+
+
+async def eventos_huecos(request):
+    """Flujo SSE con las horas que se ocupan o liberan en ?fecha= (reemplaza el sondeo de /horas/)"""
+    fecha = _parsear_fecha(request.GET.get("fecha"))
+    if not fecha:
+        return JsonResponse({"error": "Fecha no válida"}, status=400)
+    respuesta = StreamingHttpResponse(eventos.transmitir(fecha), content_type="text/event-stream")
+    respuesta["Cache-Control"] = "no-cache"
+    # nginx no debe acumular el flujo antes de enviarlo
+    respuesta["X-Accel-Buffering"] = "no"
+    return respuesta
+
+
+@cachear_pagina_anonima
+@presupuesto_consultas(35)
+async def agendar_cita_publica(request):
     """Permite agendar una cita (usuarios y público general)"""
     if request.method == "POST":
-        form = CitaPublicaForm(request.POST, user=request.user)
-        if form.is_valid():
-            cita = form.save(commit=False)
-            cita.estado = "pendiente"
-
-            # Asignar peluquero automáticamente
-            _asignar_peluquero_automatico(cita)
-
-            # Si el usuario está logeado, guardar sus datos
-            if request.user.is_authenticated:
-                cita.usuario = request.user
-                cita.nombre_cliente = request.user.username
-                cita.correo_cliente = request.user.email
-                perfil = getattr(request.user, 'perfilusuario', None)
-                if perfil:
-                    cita.telefono_cliente = perfil.telefono or ""
-
-            # Validar y guardar
-            cita.full_clean()
-            cita.save()
-
-            messages.success(
-                request,
-                "Tu cita ha sido agendada correctamente"
-                "Recibirás un recordatorio automático 24 horas antes de la fecha programada."
-            )
-            return redirect("inicio")
-        else:
-            messages.error(request, "Corrige los errores en el formulario.")
-    else:
-        form = CitaPublicaForm(user=request.user)
+        await resolver_usuario(request)
+        # La reserva toma bloqueos y reintenta en una transacción: sigue siendo síncrona
+        return await sync_to_async(_agendar_cita_post)(request)
+
+    usuario, _, peluqueros = await asyncio.gather(
+        resolver_usuario(request), aobtener_catalogo(), aopciones_peluqueros()
+    )
+    form = CitaPublicaForm(user=usuario, peluqueros=peluqueros)
     return render(request, "agendar_cita.html", {"form": form})
+
+
+def _agendar_cita_post(request):
+    metricas.incrementar('embudo_reserva', etapa='envio')
+    form = CitaPublicaForm(request.POST, user=request.user)
+    if not form.is_valid():
+        metricas.incrementar('embudo_reserva', etapa='invalida')
+        messages.error(request, "Corrige los errores en el formulario.")
+        return render(request, "agendar_cita.html", {"form": form})
+
+    cita = form.save(commit=False)
+    cita.estado = "pendiente"
+
+    # Si el usuario está logeado, guardar sus datos
+    if request.user.is_authenticated:
+        cita.usuario = request.user
+        cita.nombre_cliente = request.user.username
+        cita.correo_cliente = request.user.email
+        perfil = getattr(request.user, 'perfilusuario', None)
+        if perfil:
+            cita.telefono_cliente = perfil.telefono or ""
+
+    # Asignar peluquero, validar y guardar sin dobles reservas
+    try:
+        reservar_cita(cita, preferido=form.cleaned_data.get('peluquero_preferido'))
+    except ValidationError as e:
+        metricas.incrementar('embudo_reserva', etapa='invalida')
+        form.add_error(None, e)
+        messages.error(request, "Corrige los errores en el formulario.")
+        return render(request, "agendar_cita.html", {"form": form})
+
+    messages.success(
+        request,
+        "Tu cita ha sido agendada correctamente"
+        "Recibirás un recordatorio automático 24 horas antes de la fecha programada."
+    )
+    return redirect("inicio")
+PERIODOS_REPORTE = {'dia': TruncDay, 'semana': TruncWeek, 'mes': TruncMonth}
+
+
 @user_passes_test(lambda u: u.is_superuser)
+@presupuesto_consultas(9)
 def reportes_basicos(request):
-    from django.db.models import Count
+    """Reportes leídos solo desde el resumen diario (EstadisticaDiaria)"""
+    filtro = ReporteForm(request.GET or None)
+    hasta = timezone.localdate()
+    desde = hasta - timezone.timedelta(days=90)
+    agrupacion = 'dia'
+    if filtro.is_valid():
+        desde = filtro.cleaned_data['desde'] or desde
+        hasta = filtro.cleaned_data['hasta'] or hasta
+        agrupacion = filtro.cleaned_data['agrupacion'] or agrupacion
+
+    resumen = EstadisticaDiaria.objects.filter(fecha__range=(desde, hasta)).order_by()
+    efectivas = resumen.exclude(estado='cancelada')
+    completadas = Q(estado='completada')
+
+    # Citas, ingresos y minutos por período
+    periodos = (
+        efectivas.annotate(periodo=PERIODOS_REPORTE[agrupacion]('fecha'))
+        .values('periodo')
+        .annotate(total=Sum('total'), ingresos=Sum('ingresos', filter=completadas), minutos=Sum('minutos'))
+        .order_by('periodo')
+    )
 
     # Días con más citas
     dias_populares = (
-        Cita.objects.values('fecha')
-        .annotate(total=Count('id'))
+        efectivas.values('fecha')
+        .annotate(total=Sum('total'))
         .order_by('-total')[:7]
     )
 
     # Servicios más solicitados
     servicios_populares = (
-        Cita.objects.values('servicio__nombre')
-        .annotate(total=Count('id'))
+        efectivas.values('servicio__nombre')
+        .annotate(total=Sum('total'))
         .order_by('-total')[:5]
     )
 
-    # Peluqueros más activos
+    # Peluqueros más activos e ingresos de cada uno
     peluqueros_activos = (
-        Cita.objects.values('peluquero__username')
-        .annotate(total=Count('id'))
-        .order_by('-total')[:5]
+        efectivas.values('peluquero__username')
+        .annotate(total=Sum('total'), ingresos=Sum('ingresos', filter=completadas), minutos=Sum('minutos'))
+        .order_by('-total')
     )
 
+    cancelaciones = resumen.filter(estado='cancelada').aggregate(total=Sum('total'))['total'] or 0
+
     return render(request, "reportes_admin.html", {
+        "filtro": filtro,
+        "desde": desde,
+        "hasta": hasta,
+        "agrupacion": agrupacion,
+        "periodos": periodos,
         "dias_populares": dias_populares,
         "servicios_populares": servicios_populares,
-        "peluqueros_activos": peluqueros_activos
+        "peluqueros_activos": peluqueros_activos,
+        "cancelaciones": cancelaciones,
     })
 
 
@@ -191,9 +328,39 @@ def reportes_basicos(request):
 # -----------------------
 
 @login_required
-def panel_usuario(request):
-    citas = Cita.objects.filter(usuario=request.user).order_by('-fecha', '-hora')
-    return render(request, "panel_usuario.html", {"citas": citas})
+@presupuesto_consultas(7)
+async def panel_usuario(request):
+    """Próximas citas, series activas y lista de espera; el historial se pide aparte (historial_usuario)"""
+    usuario = await request.auser()
+    consulta_series = SerieCita.objects.filter(usuario=usuario, estado='activa').select_related('servicio', 'peluquero')
+    consulta_esperas = EsperaCita.objects.filter(
+        usuario=usuario, estado__in=('esperando', 'ofrecida'),
+    ).select_related('servicio', 'peluquero', 'cita')
+
+    async def citas():
+        return [c async for c in historial.proximas(usuario)]
+
+    async def series_activas():
+        return [s async for s in consulta_series.order_by('fecha_inicio')]
+
+    async def esperas():
+        return [e async for e in consulta_esperas.order_by('fecha', 'desde')]
+
+    _, lista, series_, esperas_ = await asyncio.gather(
+        resolver_usuario(request), citas(), series_activas(), esperas()
+    )
+    return render(request, "panel_usuario.html", {"citas": lista, "series": series_, "esperas": esperas_})
+
+
+@login_required
+@presupuesto_consultas(3)
+async def historial_usuario(request):
+    """Citas pasadas, completadas o canceladas del cliente, en páginas JSON (?cursor=)"""
+    usuario = await request.auser()
+    citas, siguiente = await apaginar_citas(
+        historial.historial(usuario), request.GET.get('cursor'), descendente=True
+    )
+    return JsonResponse({"citas": [historial.a_json(c) for c in citas], "siguiente": siguiente})
 
 
 @login_required
@@ -201,7 +368,9 @@ def cancelar_cita(request, cita_id):
     cita = get_object_or_404(Cita, id=cita_id, usuario=request.user)
     if request.method == "POST":
         cita.estado = "cancelada"
-        cita.save()
+        with transaction.atomic():
+            cita.save(update_fields=['estado', 'actualizado_en'])
+            notificaciones.registrar(cita, 'cancelada', por='cliente')
         messages.success(request, "Cita cancelada correctamente ❌")
         return redirect("panel_usuario")
     return render(request, "cancelar_cita.html", {"cita": cita})
@@ -221,33 +390,155 @@ def reagendar_cita(request, cita_id):
         if form.is_valid():
             nueva_cita = form.save(commit=False)
             nueva_cita.estado = "pendiente"
-            nueva_cita.full_clean()
-            nueva_cita.save()
-            messages.success(request, "Cita reagendada correctamente")
-            return redirect('panel_usuario')
+            por = 'cliente' if request.user == cita.usuario else 'peluquero'
+            try:
+                guardar_reagendamiento(nueva_cita, por=por)
+            except ValidationError as e:
+                form.add_error(None, e)
+            else:
+                messages.success(request, "Cita reagendada correctamente")
+                return redirect('panel_usuario')
     else:
         form = CitaPublicaForm(instance=cita, user=request.user)
 
     return render(request, "reagendar_cita.html", {"form": form, "cita": cita})
 
 
+# -----------------------
+#   CITAS RECURRENTES
+# -----------------------
+
+@login_required
+@presupuesto_consultas(22)
+def agendar_serie(request):
+    """Reserva de una vez todas las citas de una serie recurrente"""
+    form = SerieCitaForm(request.POST or None)
+    conflictos = []
+    if request.method == "POST" and form.is_valid():
+        serie = form.save(commit=False)
+        serie.usuario = request.user
+        try:
+            resultado = series.crear_serie(serie, omitir_conflictos=form.cleaned_data['omitir_conflictos'])
+        except series.ConflictoSerie as e:
+            conflictos = e.fechas
+            form.add_error(None, e)
+        except ValidationError as e:
+            form.add_error(None, e)
+        else:
+            mensaje = f"Se agendaron {len(resultado['citas'])} citas recurrentes"
+            if resultado['omitidas']:
+                mensaje += f"; {len(resultado['omitidas'])} fechas ocupadas quedaron fuera"
+            messages.success(request, mensaje)
+            return redirect("panel_usuario")
+    return render(request, "serie_cita.html", {"form": form, "conflictos": conflictos})
+
+
+@login_required
+@presupuesto_consultas(23)
+def editar_serie(request, serie_id):
+    """Cambia servicio, hora o notas de todas las citas pendientes de la serie"""
+    serie = get_object_or_404(SerieCita.objects.select_related('servicio'), id=serie_id, usuario=request.user, estado='activa')
+    form = SerieCitaForm(request.POST or None, instance=serie)
+    conflictos = []
+    if request.method == "POST" and form.is_valid():
+        try:
+            citas = series.actualizar_serie(form.save(commit=False), por='cliente')
+        except series.ConflictoSerie as e:
+            conflictos = e.fechas
+            form.add_error(None, e)
+        except ValidationError as e:
+            form.add_error(None, e)
+        else:
+            messages.success(request, f"Serie actualizada: {len(citas)} citas pendientes modificadas")
+            return redirect("panel_usuario")
+    return render(request, "serie_cita.html", {"form": form, "serie": serie, "conflictos": conflictos})
+
+
+@login_required
+@require_POST
+@presupuesto_consultas(21)
+def cancelar_serie(request, serie_id):
+    serie = get_object_or_404(SerieCita, id=serie_id, usuario=request.user, estado='activa')
+    resumen = series.cancelar_serie(serie, por='cliente', motivo=request.POST.get('motivo', ''))
+    messages.success(request, f"Serie cancelada: {len(resumen['aplicadas'])} citas pendientes canceladas ❌")
+    return redirect("panel_usuario")
+
+
+# -----------------------
+#   LISTA DE ESPERA
+# -----------------------
+
+@login_required
+@presupuesto_consultas(8)
+def unirse_lista_espera(request):
+    """Inscribe al cliente para que se le ofrezca una hora que se libere en su ventana"""
+    form = EsperaCitaForm(request.POST or None, initial={'fecha': request.GET.get('fecha')})
+    if request.method == "POST" and form.is_valid():
+        espera = form.save(commit=False)
+        espera.usuario = request.user
+        espera.save()
+        messages.success(request, "Te avisaremos por correo si se libera un horario en esa ventana")
+        return redirect("panel_usuario")
+    return render(request, "lista_espera.html", {"form": form})
+
+
+@login_required
+@require_POST
+@presupuesto_consultas(25)
+def responder_lista_espera(request, espera_id):
+    """Aceptar o rechazar la hora ofrecida, o salir de la lista de espera"""
+    espera = get_object_or_404(EsperaCita, id=espera_id, usuario=request.user)
+    accion = request.POST.get('accion')
+    if accion not in ('aceptar', 'rechazar', 'salir'):
+        return HttpResponse("Acción no válida", status=400)
+    try:
+        lista_espera.responder(espera, accion)
+    except ValidationError as e:
+        messages.error(request, e.messages[0])
+    else:
+        textos = {
+            'aceptar': "Hora aceptada: tu cita quedó reservada ✅",
+            'rechazar': "Rechazaste la hora ofrecida; se ofrecerá a otra persona",
+            'salir': "Saliste de la lista de espera",
+        }
+        messages.success(request, textos[accion])
+    return redirect("panel_usuario")
+
+
 def es_peluquero(user):
     return hasattr(user, 'perfilusuario') and user.perfilusuario.es_peluquero
 
-@user_passes_test(es_peluquero, login_url='login')
-def panel_peluquero(request):
-    perfil = getattr(request.user, 'perfilusuario', None)
-    citas = Cita.objects.filter(peluquero=request.user).order_by('fecha', 'hora')
+def _url_pagina(request, cursor):
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return f"{request.path}?{params.urlencode()}"
 
-    print("Usuario logeado:", request.user.username, request.user.id)
-    print(" Citas encontradas:", citas.count())
 
-    for c in citas:
-        print(f" - {c.servicio.nombre} | {c.fecha} | {c.hora} | Cliente: {c.nombre_cliente}")
+@user_passes_test(es_peluquero, login_url='login')
+@presupuesto_consultas(6)
+async def panel_peluquero(request):
+    filtro = FiltroFechasForm(request.GET or None)
+    desde, hasta = timezone.localdate(), None
+    if filtro.is_valid():
+        desde = filtro.cleaned_data['desde'] or desde
+        hasta = filtro.cleaned_data['hasta']
+
+    usuario = await request.auser()
+    citas = Cita.objects.filter(peluquero=usuario, fecha__gte=desde)
+    if hasta:
+        citas = citas.filter(fecha__lte=hasta)
+    citas = citas.select_related('servicio', 'usuario').only(
+        'id', 'fecha', 'hora', 'estado', 'nombre_cliente', 'servicio__nombre', 'usuario__username'
+    )
+    usuario, (citas, siguiente) = await asyncio.gather(
+        resolver_usuario(request), apaginar_citas(citas, request.GET.get('cursor'))
+    )
 
     return render(request, "panel_peluquero.html", {
         "citas": citas,
-        "perfil": perfil
+        "perfil": usuario.perfilusuario,
+        "filtro": filtro,
+        "siguiente_url": _url_pagina(request, siguiente) if siguiente else None,
     })
 
 @login_required
@@ -283,16 +574,171 @@ def eliminar_cita_peluquero(request, cita_id):
 def marcar_cita_atendida(request, cita_id):
     cita = get_object_or_404(Cita, id=cita_id, peluquero=request.user)
     cita.estado = "completada"
-    cita.save()
+    cita.save(update_fields=['estado', 'actualizado_en'])
     messages.success(request, "Cita marcada como atendida")
     return redirect("panel_peluquero")
 
 
+def _datos_lote(request):
+    """{'accion', 'ids', 'motivo'} desde un cuerpo JSON o un formulario (ids repetido)"""
+    if request.content_type == 'application/json':
+        try:
+            datos = json.loads(request.body)
+        except ValueError:
+            return None
+        return datos if isinstance(datos, dict) else None
+    return {
+        'accion': request.POST.get('accion'),
+        'ids': request.POST.getlist('ids'),
+        'motivo': request.POST.get('motivo', ''),
+    }
+
+
+@user_passes_test(lambda u: u.is_superuser or es_peluquero(u), login_url='login')
+@require_POST
+@presupuesto_consultas(19)
+def citas_en_lote(request):
+    """Confirma, completa, cancela o elimina varias citas en una petición; responde un resumen JSON.
+
+    Un peluquero solo alcanza sus propias citas; el administrador, cualquiera.
+    """
+    datos = _datos_lote(request)
+    if datos is None:
+        return JsonResponse({"error": "Cuerpo no válido"}, status=400)
+    accion, motivo = datos.get('accion'), (datos.get('motivo') or '').strip()
+    if accion not in lotes.ACCIONES:
+        return JsonResponse({"error": "Acción no válida"}, status=400)
+    try:
+        ids = [int(pk) for pk in datos.get('ids') or []]
+    except (TypeError, ValueError):
+        return JsonResponse({"error": "Identificadores no válidos"}, status=400)
+    if not 0 < len(ids) <= lotes.MAX_CITAS:
+        return JsonResponse({"error": f"Indica entre 1 y {lotes.MAX_CITAS} citas"}, status=400)
+    if accion == 'cancelar' and not motivo:
+        return JsonResponse({"error": "Indica el motivo de cancelación"}, status=400)
+
+    if request.user.is_superuser:
+        resumen = lotes.aplicar(accion, ids, motivo=motivo)
+    else:
+        resumen = lotes.aplicar(accion, ids, peluquero=request.user, por='peluquero', motivo=motivo)
+    return JsonResponse(resumen)
+
+
 # -----------------------
 #   PANEL ADMIN
 # -----------------------
 
 @user_passes_test(lambda u: u.is_superuser)
-def panel_admin(request):
-    citas = Cita.objects.all().order_by("-fecha", "-hora")
-    return render(request, "panel_admin.html", {"citas": citas})
+@presupuesto_consultas(8)
+async def panel_admin(request):
+    filtro = FiltroCitasAdminForm(request.GET or None)
+    # Validar el filtro consulta los peluqueros y servicios elegidos
+    citas = await sync_to_async(filtro.filtrar)(Cita.objects.all())
+
+    # Totales y página son independientes: se piden a la vez
+    totales, (pagina, siguiente) = await asyncio.gather(
+        citas.aaggregate(
+            total=Count('id'),
+            ingresos=Sum('precio', filter=Q(estado='completada')),
+            **{estado: Count('id', filter=Q(estado=estado)) for estado, _ in Cita.ESTADOS},
+        ),
+        apaginar_citas(
+            citas.select_related('usuario', 'servicio', 'peluquero').only(
+                'id', 'fecha', 'hora', 'estado', 'nombre_cliente', 'apellido_cliente',
+                'usuario__username', 'servicio__nombre', 'peluquero__username',
+            ),
+            request.GET.get('cursor'),
+            tamano=50,
+            descendente=True,
+        ),
+    )
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    # Los selectores de peluquero y servicio del filtro consultan la base al dibujarse
+    return await sync_to_async(render)(request, "panel_admin.html", {
+        "citas": pagina,
+        "filtro": filtro,
+        "totales": totales,
+        "filtros_url": params.urlencode(),
+        "siguiente_url": _url_pagina(request, siguiente) if siguiente else None,
+    })
+
+
+class _Eco:
+    """Pseudo-archivo: csv.writer escribe y el valor se devuelve al generador"""
+
+    def write(self, valor):
+        return valor
+
+
+COLUMNAS_EXPORTACION = [
+    'id', 'fecha', 'hora', 'estado', 'servicio__nombre', 'precio',
+    'peluquero__username', 'usuario__username', 'nombre_cliente', 'apellido_cliente',
+    'correo_cliente', 'telefono_cliente', 'creado_en',
+]
+
+
+@user_passes_test(lambda u: u.is_superuser)
+@presupuesto_consultas(4)
+async def exportar_citas_admin(request):
+    """Descarga las citas filtradas en CSV o NDJSON con memoria constante.
+
+    Asíncrona de punta a punta: bajo ASGI un iterador síncrono se
+    consumiría entero en memoria antes de enviar el primer byte.
+    """
+    formato = request.GET.get('formato', 'csv')
+    if formato not in ('csv', 'ndjson'):
+        return JsonResponse({"error": "Formato no válido"}, status=400)
+
+    filtro = FiltroCitasAdminForm(request.GET or None)
+    # Validar el filtro consulta los peluqueros y servicios elegidos
+    citas = await sync_to_async(filtro.filtrar)(Cita.objects.all())
+    # values() y no values_list(): su iterador es perezoso y aiterator() lo consume por trozos en un hilo
+    filas = citas.order_by('fecha', 'hora', 'id').values(*COLUMNAS_EXPORTACION).aiterator(chunk_size=2000)
+
+    if formato == 'csv':
+        tipo = 'text/csv'
+
+        async def contenido():
+            escritor = csv.writer(_Eco())
+            yield escritor.writerow(COLUMNAS_EXPORTACION)
+            async for fila in filas:
+                yield escritor.writerow(fila.values())
+    else:
+        tipo = 'application/x-ndjson'
+
+        async def contenido():
+            async for fila in filas:
+                yield json.dumps(fila, cls=DjangoJSONEncoder) + "\n"
+
+    respuesta = StreamingHttpResponse(contenido(), content_type=tipo)
+    respuesta['Content-Disposition'] = f'attachment; filename="citas.{formato}"'
+    return respuesta
+
+
+# -----------------------
+#   MÉTRICAS
+# -----------------------
+
+def _token_metricas_valido(request, token):
+    esquema, _, valor = request.headers.get('Authorization', '').partition(' ')
+    return esquema.lower() == 'bearer' and hmac.compare_digest(valor.strip().encode(), token.encode())
+
+
+def metricas_prometheus(request):
+    """Contadores e histogramas del proceso en formato de texto de Prometheus.
+
+    Desactivada (404) mientras no se configure CITAS_METRICAS_IPS o CITAS_METRICAS_TOKEN.
+    """
+    permitidas = getattr(settings, 'CITAS_METRICAS_IPS', [])
+    token = getattr(settings, 'CITAS_METRICAS_TOKEN', '')
+    if not permitidas and not token:
+        raise Http404
+    autorizado = (
+        request.META.get('REMOTE_ADDR') in permitidas
+        or (token and _token_metricas_valido(request, token))
+        or request.user.is_superuser
+    )
+    if not autorizado:
+        return HttpResponseForbidden()
+    return HttpResponse(metricas.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
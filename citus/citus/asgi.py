@@ -5,6 +5,13 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Producción (varios procesos, cada uno con su bucle de eventos):
+
+    CITUS_ASGI=1 gunicorn citus.asgi:application -k uvicorn_worker.UvicornWorker -w 4
+
+Las vistas de disponibilidad y los paneles son asíncronos: una consulta de
+horas en espera no ocupa un hilo.
 """
 
 import os
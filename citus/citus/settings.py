@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'citas.perfilado.PerfiladoMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,7 +58,7 @@ ROOT_URLCONF = 'citus.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'citas.perfilado.PlantillasMedidas',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -64,24 +66,108 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'citas.context_processors.versiones_cache',
             ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'citus.wsgi.application'
+ASGI_APPLICATION = 'citus.asgi.application'
+
+# Despliegue ASGI (uvicorn): las vistas asíncronas atienden muchas conexiones
+# con pocos hilos. Django recomienda no usar conexiones persistentes en modo
+# asíncrono; con PostgreSQL conviene activar el pool (CITUS_DB_POOL=1).
+CITUS_ASGI = os.environ.get('CITUS_ASGI') == '1'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# Motor según el entorno: 'sqlite' (por defecto) o 'postgresql'
+CITUS_DB_MOTOR = os.environ.get('CITUS_DB_MOTOR', 'sqlite')
+
+# Conexiones persistentes: se reutilizan entre peticiones durante estos segundos
+CITUS_DB_CONN_MAX_AGE = 0 if CITUS_ASGI else int(os.environ.get('CITUS_DB_CONN_MAX_AGE', 60))
+
+if CITUS_DB_MOTOR == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('CITUS_DB_NOMBRE', 'citus'),
+            'USER': os.environ.get('CITUS_DB_USUARIO', 'citus'),
+            'PASSWORD': os.environ.get('CITUS_DB_CLAVE', ''),
+            'HOST': os.environ.get('CITUS_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('CITUS_DB_PUERTO', '5432'),
+            # Comprueba la conexión reutilizada antes de usarla en cada petición
+            'CONN_HEALTH_CHECKS': True,
+            'CONN_MAX_AGE': CITUS_DB_CONN_MAX_AGE,
+            'OPTIONS': {},
+        }
+    }
+    # Pool nativo de Django 5.1+ (psycopg 3); reemplaza a las conexiones persistentes
+    if os.environ.get('CITUS_DB_POOL') == '1':
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('CITUS_DB_POOL_MIN', 2)),
+            'max_size': int(os.environ.get('CITUS_DB_POOL_MAX', 10)),
+            'timeout': int(os.environ.get('CITUS_DB_POOL_ESPERA', 10)),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('CITUS_DB_NOMBRE', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': CITUS_DB_CONN_MAX_AGE,
+            # Toma el bloqueo de escritura al abrir la transacción y espera en vez
+            # de fallar si otro proceso está escribiendo
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+            # Base de pruebas en archivo para que los tests concurrentes usen
+            # conexiones reales por hilo
+            'TEST': {
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
+        }
+    }
+
+# PRAGMAs que citas.basedatos aplica a cada conexión SQLite nueva. En WAL los
+# lectores no bloquean al escritor, así varios workers de Gunicorn comparten la base.
+CITAS_SQLITE_DIARIO = os.environ.get('CITUS_SQLITE_DIARIO', 'WAL')
+CITAS_SQLITE_SINCRONICO = os.environ.get('CITUS_SQLITE_SINCRONICO', 'NORMAL')
+
+# Solo PostgreSQL: la migración 0013 agrega una restricción de exclusión (btree_gist)
+# que impide en la base dos citas activas solapadas del mismo peluquero
+CITAS_RESTRICCION_SOLAPES = os.environ.get('CITUS_RESTRICCION_SOLAPES', '1') == '1'
+
+
+# Caché
+# Por defecto en memoria del proceso; en producción se puede apuntar a
+# Redis o Memcached con CITUS_CACHE_BACKEND / CITUS_CACHE_LOCATION
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': os.environ.get('CITUS_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CITUS_CACHE_LOCATION', 'citus'),
     }
 }
 
+# Alias de caché donde se guarda el catálogo de servicios
+CITAS_CACHE_CATALOGO = 'default'
+
+# Páginas completas para visitantes anónimos (inicio y agendar)
+CITAS_CACHE_PAGINAS = 'default'
+CITAS_CACHE_PAGINAS_SEGUNDOS = 300
+
+# Horario compilado de cada peluquero por día (turnos, descansos y ausencias)
+CITAS_CACHE_HORARIOS = 'default'
+CITAS_CACHE_HORARIOS_SEGUNDOS = 3600
+
+# Minutos que se retiene una hora ofrecida a la lista de espera antes de pasar al siguiente
+CITAS_ESPERA_PLAZO_MINUTOS = int(os.environ.get('CITUS_ESPERA_PLAZO_MINUTOS', 30))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -149,3 +235,51 @@ MESSAGE_TAGS = {
     messages.ERROR: 'error',
 }
 
+
+# Estrategia de asignación automática de peluquero:
+# 'menor_carga', 'menor_minutos', 'rotativo' o 'preferido'
+CITAS_ESTRATEGIA_ASIGNACION = 'menor_carga'
+
+
+# Correo (recordatorios y notificaciones). En desarrollo se imprime en consola.
+EMAIL_BACKEND = os.environ.get('CITUS_EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = os.environ.get('CITUS_EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('CITUS_EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.environ.get('CITUS_EMAIL_USUARIO', '')
+EMAIL_HOST_PASSWORD = os.environ.get('CITUS_EMAIL_CLAVE', '')
+EMAIL_USE_TLS = os.environ.get('CITUS_EMAIL_TLS', '') == '1'
+DEFAULT_FROM_EMAIL = os.environ.get('CITUS_EMAIL_REMITENTE', 'Citus Peluquería <no-responder@citus.cl>')
+
+
+# Perfilado detallado por petición (citas.perfilado.PerfiladoMiddleware): consultas
+# repetidas y tiempo de plantillas. Por defecto solo en desarrollo; las métricas
+# de duración y consultas por vista se miden siempre
+CITAS_PERFILADO = os.environ.get('CITUS_PERFILADO', '1' if DEBUG else '0') == '1'
+# Cabecera Server-Timing con consultas y tiempos (expone detalles internos: solo en desarrollo)
+CITAS_PERFILADO_CABECERAS = DEBUG
+# Peticiones más lentas que esto se registran en el logger 'citas.perfilado'
+CITAS_PERFILADO_LENTO_MS = int(os.environ.get('CITUS_PERFILADO_LENTO_MS', 500))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'consola': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'citas.perfilado': {'handlers': ['consola'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
+# Avisos en vivo de horas (citas.eventos). Con varios workers se necesita una
+# central compartida: 'citas.eventos.CentralRedis' con {'url': 'redis://...'}
+CITAS_EVENTOS_CENTRAL = os.environ.get('CITUS_EVENTOS_CENTRAL', 'citas.eventos.CentralLocal')
+CITAS_EVENTOS_OPCIONES = {'url': os.environ['CITUS_EVENTOS_REDIS']} if os.environ.get('CITUS_EVENTOS_REDIS') else {}
+# Segundos entre latidos y duración máxima de cada conexión SSE
+CITAS_EVENTOS_LATIDO = 15
+CITAS_EVENTOS_DURACION = 300
+
+# Acceso del scraper de Prometheus a /metrics: direcciones permitidas y/o un
+# token (Authorization: Bearer ...). Sin ninguno de los dos la ruta responde 404
+CITAS_METRICAS_IPS = [ip.strip() for ip in os.environ.get('CITUS_METRICAS_IPS', '').split(',') if ip.strip()]
+CITAS_METRICAS_TOKEN = os.environ.get('CITUS_METRICAS_TOKEN', '')
@@ -10,6 +10,8 @@ urlpatterns = [
     path('registro/', v.registro, name='registrarse'),
     path('agendar/', v.agendar_cita_publica, name='agendar_cita_publica'),
     path('horas/', v.obtener_horas_disponibles, name='obtener_horas_disponibles'),
+    path('horas/rango/', v.obtener_horas_rango, name='obtener_horas_rango'),
+    path('horas/eventos/', v.eventos_huecos, name='eventos_huecos'),
     path('cita/<int:cita_id>/reagendar/', v.reagendar_cita, name='reagendar_cita'),
 
 
@@ -17,7 +19,13 @@ urlpatterns = [
     path('logout/', v.logout_view, name='logout'),
 
     path('panel/', v.panel_usuario, name='panel_usuario'),
+    path('panel/historial/', v.historial_usuario, name='historial_usuario'),
     path('panel/cita/<int:cita_id>/cancelar/', v.cancelar_cita, name='cancelar_cita'),
+    path('panel/serie/nueva/', v.agendar_serie, name='agendar_serie'),
+    path('panel/serie/<int:serie_id>/editar/', v.editar_serie, name='editar_serie'),
+    path('panel/serie/<int:serie_id>/cancelar/', v.cancelar_serie, name='cancelar_serie'),
+    path('panel/espera/nueva/', v.unirse_lista_espera, name='unirse_lista_espera'),
+    path('panel/espera/<int:espera_id>/responder/', v.responder_lista_espera, name='responder_lista_espera'),
     path('cita/<int:cita_id>/detalle/', v.detalle_cita, name='detalle_cita'),
     path('peluquero/', v.panel_peluquero, name='panel_peluquero'),
     path('peluquero/cita/<int:cita_id>/editar/', v.editar_cita_peluquero, name='editar_cita_peluquero'),
@@ -27,7 +35,11 @@ urlpatterns = [
     path('peluquero/cita/<int:cita_id>/finalizar/', v.finalizar_cita, name='finalizar_cita'),
     path('peluquero/cita/<int:cita_id>/reagendar/', v.reagendar_cita_peluquero, name='reagendar_cita_peluquero'),
     path('peluquero/cita/<int:cita_id>/cancelar/', v.cancelar_cita_peluquero, name='cancelar_cita_peluquero'),
+    path('peluquero/citas/lote/', v.citas_en_lote, name='citas_en_lote'),
 
 
     path('admin_panel/', v.panel_admin, name='panel_admin'),
+    path('admin_panel/exportar/', v.exportar_citas_admin, name='exportar_citas_admin'),
+
+    path('metrics', v.metricas_prometheus, name='metricas'),
 ]